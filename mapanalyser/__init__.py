@@ -45,4 +45,4 @@ def classFactory(iface):  # pylint: disable=invalid-name
     check(filename, README_PATH)
 
     from .map_analyser import MapAnalyserPlugin
-    return MapAnalyserPlugin()
+    return MapAnalyserPlugin(iface)
@@ -0,0 +1,436 @@
+"""
+    Batch runs of the workspace algorithms over many workspaces
+    in a pool of processes with a checkpoint to resume interrupted runs
+"""
+import csv
+import importlib
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import processing
+
+from qgis.core import (QgsApplication,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterNumber)
+from .utils import tr, raise_exception
+
+WORKSPACE_EXTENSIONS = ('.gpkg',)
+
+DELIMITER = ';'
+
+# the processing application of a worker process
+_worker = {}
+
+
+def get_workspaces(path):
+    """
+    Returns the workspaces of a batch: the GeoPackages of a directory
+    or the paths listed in a text file (one per line)
+
+    :param path: directory or list file
+    """
+
+    if not path:
+        raise_exception('workspaces path is empty')
+
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(WORKSPACE_EXTENSIONS))
+
+    directory = os.path.dirname(os.path.abspath(path))
+
+    with open(path, encoding='utf-8') as list_file:
+        lines = [line.strip() for line in list_file]
+
+    return [os.path.normpath(os.path.join(directory, line)) for line in lines if line and not line.startswith('#')]
+
+
+def get_workspace_key(workspace):
+    """
+    Returns the normalized full path of a workspace that keys it in the checkpoint
+    and in the output rows, workspaces with the same name in other directories differ
+
+    :param workspace: path to the workspace
+    """
+
+    return os.path.normpath(os.path.abspath(workspace))
+
+
+def get_checkpoint_path(output):
+    """
+    Returns the path of the checkpoint next to the output file
+
+    :param output: path of the output file
+    """
+
+    return '{}_checkpoint.txt'.format(os.path.splitext(output)[0])
+
+
+def read_checkpoint(path):
+    """
+    Returns the set of the keys of completed workspaces (see get_workspace_key)
+
+    :param path: path of the checkpoint
+    """
+
+    if not os.path.isfile(path):
+        return set()
+
+    with open(path, encoding='utf-8') as checkpoint:
+        return {get_workspace_key(line.rstrip('\n')) for line in checkpoint if line.endswith('\n')}
+
+
+def write_durably(path, text, mode='a'):
+    """
+    Writes the text with one write call and flushes it to the disk
+
+    :param path: path of the file
+    :param text: text to write
+    :param mode: file mode
+    """
+
+    with open(path, mode, newline='', encoding='utf-8') as output_file:
+        output_file.write(text)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+
+def append_rows(output, header, rows):
+    """
+    Appends the rows of a workspace to the output file at once
+
+    :param output: path of the output file
+    :param header: header of the csv file
+    :param rows: csv rows
+    """
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, header, delimiter=DELIMITER)
+
+    if not os.path.isfile(output) or not os.path.getsize(output):
+        writer.writeheader()
+
+    writer.writerows(rows)
+    write_durably(output, buffer.getvalue())
+
+
+def remove_unfinished_rows(output, unfinished):
+    """
+    Rewrites the output file without the rows of unfinished workspaces
+    (written before an interruption but not checkpointed)
+
+    :param output: path of the output file
+    :param unfinished: keys of the unfinished workspaces (see get_workspace_key)
+    """
+
+    if not os.path.isfile(output):
+        return
+
+    with open(output, newline='', encoding='utf-8') as output_file:
+        reader = csv.DictReader(output_file, delimiter=DELIMITER)
+        header = reader.fieldnames
+        rows = [row for row in reader
+                if row.get('workspace') and get_workspace_key(row['workspace']) not in unfinished
+                and None not in row.values()]
+
+    if not header:
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, header, delimiter=DELIMITER)
+    writer.writeheader()
+    writer.writerows(rows)
+    temporary = '{}.tmp'.format(output)
+    write_durably(temporary, buffer.getvalue(), 'w')
+    os.replace(temporary, output)
+
+
+def read_rows(path):
+    """
+    Reads the rows of an output file of an algorithm
+
+    :param path: path of the csv file
+    """
+
+    if not os.path.isfile(path):
+        return None, []
+
+    with open(path, newline='', encoding='utf-8') as output_file:
+        reader = csv.DictReader(output_file, delimiter=DELIMITER)
+        return reader.fieldnames, list(reader)
+
+
+def get_python_executable():
+    """
+    Returns the python interpreter for the worker processes,
+    inside QGIS sys.executable is the QGIS application
+    """
+
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+
+    for candidate in (os.path.join(sys.exec_prefix, 'python.exe'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python3'),
+                      shutil.which('python3'),
+                      shutil.which('python')):
+        if candidate and os.path.isfile(candidate):
+            return candidate
+
+    raise_exception('can\'t find the python interpreter for the worker processes')
+
+
+def init_worker(prefix_path, processing_path, package_path):
+    """
+    Initializes QGIS and processing in a worker process
+
+    :param prefix_path: QGIS prefix path
+    :param processing_path: directory of the processing plugin
+    :param package_path: directory of this plugin
+    """
+
+    QgsApplication.setPrefixPath(prefix_path, True)
+    application = QgsApplication([], False)
+    application.initQgis()
+    _worker['application'] = application
+
+    for path in (processing_path, os.path.dirname(package_path)):
+        if path not in sys.path:
+            sys.path.append(path)
+
+    from processing.core.Processing import Processing
+    Processing.initialize()
+
+
+def run_workspace(module, class_name, parameters, workspace, directory, context=None, feedback=None):
+    """
+    Runs the algorithm on a workspace, returns (workspace, header, rows)
+
+    :param module: module of the algorithm
+    :param class_name: class of the algorithm
+    :param parameters: parameters of the algorithm without INPUT and OUTPUT
+    :param workspace: path to the workspace
+    :param directory: directory for the temporary output
+    :param context: processing context (in the main process)
+    :param feedback: processing feedback (in the main process)
+    """
+
+    algorithm = getattr(importlib.import_module(module), class_name)()
+    output = os.path.join(directory, '{}.csv'.format(uuid.uuid4().hex))
+
+    try:
+        processing.run(algorithm, dict(parameters, INPUT=workspace, OUTPUT=output),
+                       context=context, feedback=feedback)
+        header, rows = read_rows(output)
+    finally:
+        if os.path.isfile(output):
+            os.remove(output)
+
+    return workspace, header, rows
+
+
+class BatchAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is a base class that runs a workspace algorithm on
+    every workspace of a directory or a list file in a pool of processes.
+    The completed workspaces are recorded in a checkpoint file,
+    a restarted run skips them
+    """
+
+    INPUT = 'INPUT'
+    OUTPUT = 'OUTPUT'
+    PROCESSES = 'PROCESSES'
+    # parameters of the workspace algorithm that are not passed to it
+    SKIPPED_PARAMETERS = ('INPUT', 'OUTPUT', 'BENDS_OUTPUT')
+    # class of the workspace algorithm, set by the subclasses
+    WORKSPACE_ALGORITHM = None
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INPUT,
+                tr('Directory or list file of workspaces')
+            )
+        )
+
+        if self.WORKSPACE_ALGORITHM is None:
+            raise_exception('workspace algorithm is not set')
+
+        algorithm = self.WORKSPACE_ALGORITHM()
+        algorithm.initAlgorithm(config)
+        self.forwarded = []
+
+        for definition in algorithm.parameterDefinitions():
+            if definition.name() in self.SKIPPED_PARAMETERS:
+                continue
+
+            self.forwarded.append(definition.name())
+            self.addParameter(definition.clone())
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PROCESSES,
+                tr('Number of processes'),
+                minValue=1,
+                defaultValue=max(1, (os.cpu_count() or 2) - 1)))
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT,
+                tr('Output File'),
+                'csv(*.csv)',
+            )
+        )
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        path = self.parameterAsFile(parameters, self.INPUT, context)
+        output = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        processes = self.parameterAsInt(parameters, self.PROCESSES, context)
+
+        if not output:
+            raise_exception('can\'t get an output')
+
+        workspaces = get_workspaces(path)
+        checkpoint = get_checkpoint_path(output)
+        completed = read_checkpoint(checkpoint)
+        remove_unfinished_rows(output, {get_workspace_key(workspace) for workspace in workspaces} - completed)
+        pending = [workspace for workspace in workspaces if get_workspace_key(workspace) not in completed]
+        feedback.pushInfo(tr('{} workspaces, {} completed before, {} to process').format(
+            len(workspaces), len(workspaces) - len(pending), len(pending)))
+
+        algorithm = self.WORKSPACE_ALGORITHM
+        module = algorithm.__module__
+        parameters = {name: parameters[name] for name in self.forwarded if name in parameters}
+        directory = tempfile.mkdtemp(prefix='mapanalyser_batch_')
+        failed = []
+        total = 100.0 / len(pending) if pending else 0
+
+        def complete(workspace, header, rows):
+            key = get_workspace_key(workspace)
+
+            if rows:
+                # the workspace algorithm writes the name of the workspace, the batch keeps its full path
+                header = ['workspace'] + [name for name in header if name != 'workspace']
+                append_rows(output, header, [dict(row, workspace=key) for row in rows])
+
+            write_durably(checkpoint, '{}\n'.format(key))
+
+        try:
+            if processes == 1:
+                for current, workspace in enumerate(pending):
+                    if feedback.isCanceled():
+                        break
+
+                    feedback.pushInfo(tr('Workspace {}').format(workspace))
+
+                    try:
+                        complete(*run_workspace(
+                            module, algorithm.__name__, parameters, workspace, directory, context, feedback))
+                    except Exception as error:
+                        failed.append(workspace)
+                        feedback.reportError(tr('{} failed: {}').format(workspace, error))
+
+                    feedback.setProgress(int((current + 1) * total))
+            else:
+                self.run_pool(pending, module, algorithm.__name__, parameters, directory,
+                              processes, complete, failed, feedback)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if failed:
+            feedback.reportError(tr('{} workspaces failed, run the algorithm again to retry them').format(len(failed)))
+
+        return {
+            self.OUTPUT: output,
+            'COMPLETED': len(read_checkpoint(checkpoint)),
+            'FAILED': len(failed),
+        }
+
+
+    def run_pool(self, workspaces, module, class_name, parameters, directory, processes,
+                 complete, failed, feedback):
+        """
+        Runs the workspace algorithm in a pool of processes,
+        the results are written by this process as the workspaces complete
+
+        :param workspaces: paths to the workspaces
+        :param module: module of the algorithm
+        :param class_name: class of the algorithm
+        :param parameters: parameters of the algorithm
+        :param directory: directory for the temporary outputs
+        :param processes: the number of processes
+        :param complete: function(workspace, header, rows) recording a completed workspace
+        :param failed: list to collect the failed workspaces
+        :param feedback: Feedback from a processing algorithm
+        """
+
+        spawn = multiprocessing.get_context('spawn')
+        spawn.set_executable(get_python_executable())
+        plugin_directory = os.path.dirname(__file__)
+        initializer_arguments = (
+            QgsApplication.prefixPath(),
+            os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'),
+            plugin_directory)
+        total = 100.0 / len(workspaces) if workspaces else 0
+
+        with ProcessPoolExecutor(processes, mp_context=spawn,
+                                 initializer=init_worker, initargs=initializer_arguments) as executor:
+            futures = {
+                executor.submit(run_workspace, module, class_name, parameters, workspace, directory): workspace
+                for workspace in workspaces
+            }
+
+            for current, future in enumerate(as_completed(futures)):
+                workspace = futures[future]
+
+                if feedback.isCanceled():
+                    for other in futures:
+                        other.cancel()
+                    break
+
+                try:
+                    complete(*future.result())
+                    feedback.pushInfo(tr('Workspace {} completed').format(workspace))
+                except Exception as error:
+                    failed.append(workspace)
+                    feedback.reportError(tr('{} failed: {}').format(workspace, error))
+
+                feedback.setProgress(int((current + 1) * total))
+
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return tr(self.groupId())
+
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'Map characteristics'
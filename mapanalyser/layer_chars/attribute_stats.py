@@ -0,0 +1,286 @@
+"""
+    Columnar statistics of the attribute values: the values are read in chunks
+    of rows, converted to numpy columns and counted with numpy.unique
+"""
+import os
+import sqlite3
+
+from collections import namedtuple
+from hashlib import blake2b
+
+import numpy
+
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsFeatureRequest
+from .gpkg_reader import get_gpkg_table, get_extent_condition
+from .utils import quote_identifier
+from ..utils import raise_exception
+
+# the number of rows converted to columns at once
+CHUNK_SIZE = 65536
+
+INTEGER_TYPES = (QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong, QVariant.Bool)
+REAL_TYPES = (QVariant.Double,)
+
+FIELDS_HEADER = ['layer', 'field', 'type', 'count', 'uniq_values_number', 'null_ratio', 'entropy']
+
+FieldStatistics = namedtuple('FieldStatistics', ['count', 'distinct', 'nulls', 'entropy'])
+
+
+def is_null(value):
+    """
+    Checks whether an attribute value is NULL
+
+    :param value: attribute value
+    """
+
+    return value is None or (isinstance(value, QVariant) and value.isNull())
+
+
+def get_hashes(values):
+    """
+    Returns the 64-bit hashes of the text of the values as a numpy array
+
+    :param values: attribute values
+    """
+
+    return numpy.fromiter(
+        (int.from_bytes(blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+         for value in values), numpy.int64, len(values))
+
+
+class ColumnCounter:
+    """
+    Running counts of the distinct values of a column, the text values are
+    counted by their 64-bit hashes
+    """
+
+    def __init__(self, field_type):
+        if field_type in INTEGER_TYPES:
+            self.dtype = numpy.int64
+        elif field_type in REAL_TYPES:
+            self.dtype = numpy.float64
+        else:
+            self.dtype = None
+
+        # the distinct values and their counts of every chunk, merged once
+        self.chunks = []
+        self.total = 0
+        self.nulls = 0
+
+    def convert(self, values):
+        """
+        Converts the non-NULL values of a chunk to a numpy array
+
+        :param values: attribute values
+        """
+
+        if self.dtype is None:
+            return get_hashes(values)
+
+        try:
+            return numpy.array(values, dtype=self.dtype)
+        except (TypeError, ValueError, OverflowError):
+            # values that don't fit the field type are compared as text
+            self.dtype = None
+            self.chunks = [(get_hashes(values), counts) for values, counts in self.chunks]
+
+            return get_hashes(values)
+
+    def add(self, column):
+        """
+        Adds a chunk of the column
+
+        :param column: sequence of attribute values
+        """
+
+        values = [value for value in column if not is_null(value)]
+        self.total += len(column)
+        self.nulls += len(column) - len(values)
+
+        if values:
+            values = self.convert(values)
+            self.chunks.append(numpy.unique(values, return_counts=True))
+
+    def get_counts(self):
+        """
+        Merges the counts of the chunks, returns the counts of the distinct values
+        """
+
+        if not self.chunks:
+            return numpy.empty(0, numpy.int64)
+
+        if len(self.chunks) > 1:
+            values, inverse = numpy.unique(
+                numpy.concatenate([values for values, _ in self.chunks]), return_inverse=True)
+            counts = numpy.bincount(
+                inverse, numpy.concatenate([counts for _, counts in self.chunks])).astype(numpy.int64)
+            self.chunks = [(values, counts)]
+
+        return self.chunks[0][1]
+
+    def statistics(self):
+        """
+        Returns FieldStatistics, NULL is counted as one more distinct value
+        """
+
+        counts = self.get_counts()
+
+        if self.nulls:
+            counts = numpy.append(counts, self.nulls)
+
+        distinct = len(counts)
+        entropy = 0.0
+
+        if self.total:
+            probabilities = counts / self.total
+            entropy = float(-(probabilities * numpy.log2(probabilities)).sum()) + 0.0
+
+        return FieldStatistics(self.total, distinct, self.nulls, entropy)
+
+
+def get_gpkg_rows(layer, names, extent, chunk_size):
+    """
+    Reads the attribute rows of a GeoPackage table with sqlite in chunks,
+    returns None if the layer is not a plain GeoPackage table
+
+    :param layer: Vector layer
+    :param names: field names
+    :param extent: filter extent or None
+    :param chunk_size: the number of rows of a chunk
+    """
+
+    table = get_gpkg_table(layer)
+
+    if table is None:
+        return None
+
+    path, table, column = table
+
+    def rows():
+        connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+        sql = 'SELECT {} FROM {}{}'.format(
+            ', '.join(quote_identifier(name) for name in names),
+            quote_identifier(table), get_extent_condition(table, column, extent))
+
+        try:
+            cursor = connection.execute(sql)
+
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+
+                if not chunk:
+                    break
+
+                yield chunk
+        finally:
+            connection.close()
+
+    return rows()
+
+
+def get_feature_rows(layer, indexes, extent, chunk_size):
+    """
+    Reads the attribute rows of a layer through the data provider in chunks
+
+    :param layer: Vector layer
+    :param indexes: field indexes
+    :param extent: filter extent or None
+    :param chunk_size: the number of rows of a chunk
+    """
+
+    request = QgsFeatureRequest()
+
+    if extent is not None:
+        request.setFilterRect(extent)
+
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(indexes)
+    chunk = []
+
+    for feature in layer.getFeatures(request):
+        attributes = feature.attributes()
+        chunk.append([attributes[index] for index in indexes])
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def compute_field_statistics(layer, indexes, extent=None, feedback=None, chunk_size=CHUNK_SIZE):
+    """
+    Computes the number of distinct values, the share of NULL values and
+    the entropy of the values of every field.
+    Returns a dictionary {field index: FieldStatistics}
+
+    :param layer: Vector layer
+    :param indexes: field indexes
+    :param extent: filter extent or None for the whole layer
+    :param feedback: Feedback from a processing algorithm
+    :param chunk_size: the number of rows converted to columns at once
+    """
+
+    if not layer:
+        raise_exception('layer is empty')
+
+    fields = layer.dataProvider().fields()
+    names = [fields.at(index).name() for index in indexes]
+    counters = [ColumnCounter(fields.at(index).type()) for index in indexes]
+
+    if extent is not None and extent.contains(layer.extent()):
+        extent = None
+
+    chunks = get_gpkg_rows(layer, names, extent, chunk_size) if indexes else None
+
+    if chunks is None:
+        chunks = get_feature_rows(layer, indexes, extent, chunk_size)
+
+    for chunk in chunks:
+        if feedback and feedback.isCanceled():
+            break
+
+        for counter, column in zip(counters, zip(*chunk)):
+            counter.add(column)
+
+    return {index: counter.statistics() for index, counter in zip(indexes, counters)}
+
+
+def get_field_statistics_rows(layer, statistics):
+    """
+    Builds the rows of the per-field statistics file
+
+    :param layer: Vector layer
+    :param statistics: dictionary {field index: FieldStatistics}
+    """
+
+    fields = layer.dataProvider().fields()
+    rows = []
+
+    for index, field_statistics in statistics.items():
+        field = fields.at(index)
+        rows.append({
+            'layer': layer.name(),
+            'field': field.name(),
+            'type': field.typeName(),
+            'count': field_statistics.count,
+            'uniq_values_number': field_statistics.distinct,
+            'null_ratio': round(field_statistics.nulls / field_statistics.count, 3) if field_statistics.count else 0.0,
+            'entropy': round(field_statistics.entropy, 3),
+        })
+
+    return rows
+
+
+def get_fields_path(output):
+    """
+    Returns the path of the file with the per-field statistics
+
+    :param output: path of the output file
+    """
+
+    base, extension = os.path.splitext(output)
+
+    return '{}_fields{}'.format(base, extension or '.csv')
@@ -0,0 +1,383 @@
+"""
+    Accumulation of the layer characteristics shared by the algorithms
+"""
+from PyQt5.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureRequest,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsCurvePolygon,
+                       QgsGeometry,
+                       QgsWkbTypes)
+from .utils import get, get_formatted_result, update_unique_values
+from ..utils import raise_exception
+
+ATTRIBUTES = 0
+LENGTH_AREA = 1
+BENDS = 2
+INTERSECTIONS = 3
+
+METRIC_GROUPS = [
+    'Attribute statistics',
+    'Length and area',
+    'Bends',
+    'Intersections',
+]
+
+HEADER = [
+    'layer',
+    'field_count',
+    'features_count',
+    'uniq_values_number',
+    'average_uniq_values',
+    'total_length',
+    'number_of_points',
+    'number_of_bends',
+    'average_area_of_bends',
+    'average_length_of_bends_baseline',
+    'average_height_of_bends',
+    'average_length_of_the_bends',
+    'total_polygons_area',
+    'average_polygons_area',
+    'average_length',
+    'layer_type',
+    'total_bends_area',
+    'total_intersections',
+]
+
+# the number of features written to a sink at once
+BATCH_SIZE = 10000
+
+BENDS_FIELDS = [
+    ('feature_id', QVariant.LongLong),
+    ('part', QVariant.Int),
+    ('points', QVariant.Int),
+    ('bends', QVariant.Int),
+    ('bend_area', QVariant.Double),
+    ('baseline', QVariant.Double),
+    ('height', QVariant.Double),
+    ('bend_len', QVariant.Double),
+    ('length', QVariant.Double),
+]
+
+
+def sum_bends(results):
+    """
+    Sums the results of layer_chars.utils.get for the rings of a part
+
+    :param results: iterable of the results of layer_chars.utils.get
+    """
+
+    total = [0, 0, 0.0, 0.0, 0.0, 0.0]
+
+    for result in results:
+        for i, value in enumerate(result):
+            total[i] += value
+
+    return tuple(total)
+
+
+def get_part_bends(part):
+    """
+    Returns the bends of a part, the rings of a polygon are processed
+    one by one so that the end of a ring and the start of the next one
+    don't make a bend
+
+    :param part: line or polygon part
+    """
+
+    if isinstance(part, QgsCurvePolygon):
+        rings = [part.exteriorRing()] + [part.interiorRing(i) for i in range(part.numInteriorRings())]
+    else:
+        rings = [part]
+
+    return sum_bends(get([(v.x(), v.y()) for v in ring.vertices()]) for ring in rings)
+
+
+class LayerCharacteristics:
+    """
+    Running sums of the geometric characteristics of a layer
+    """
+
+    def __init__(self):
+        self.features_count = 0
+        self.count = 0
+        self.points_num = 0
+        self.total_length = 0.0
+        self.total_polygon_area = 0.0
+        self.bend_num = 0
+        self.total_bend_area = 0.0
+        self.bend_base_line_len = 0.0
+        self.bend_height = 0.0
+        self.bend_length = 0.0
+
+    def add_part(self, result):
+        """
+        Adds the bends of a line part
+
+        :param result: the result of layer_chars.utils.get
+        """
+
+        self.bend_num += result[1]
+        self.total_bend_area += result[2]
+        self.bend_base_line_len += result[3]
+        self.bend_height += result[4]
+        self.bend_length += result[5]
+
+    def add_geometry(self, geom, groups):
+        """
+        Adds the geometry of a feature,
+        returns a list of (part number, part, bends of the part)
+
+        :param geom: feature geometry
+        :param groups: selected metric groups
+        """
+
+        results = []
+        geometry_type = geom.type()
+
+        if geometry_type not in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry):
+            return results
+
+        if LENGTH_AREA in groups:
+            self.total_length += geom.length()
+
+            if geometry_type == QgsWkbTypes.PolygonGeometry:
+                self.total_polygon_area += geom.area()
+
+        for number, part in enumerate(geom.parts()):
+            points_number = part.nCoordinates()
+
+            if points_number < 3:
+                continue
+
+            self.count += 1
+            self.points_num += points_number
+
+            if BENDS in groups:
+                result = get_part_bends(part)
+                self.add_part(result)
+                results.append((number, part, result))
+
+        return results
+
+    def merge(self, other):
+        """
+        Adds the sums of other characteristics
+
+        :param other: LayerCharacteristics
+        """
+
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def subtract(self, other):
+        """
+        Subtracts the sums of other characteristics added before
+
+        :param other: LayerCharacteristics
+        """
+
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) - value)
+
+
+class FeatureBendsWriter:
+    """
+    Writes the bends of every feature part to a feature sink in batches
+    """
+
+    def __init__(self, sink, fields, with_geometry=True, batch_size=BATCH_SIZE):
+        self.sink = sink
+        self.fields = fields
+        self.with_geometry = with_geometry
+        self.batch_size = batch_size
+        self.values = []
+        self.batch = []
+
+    def add(self, feature_id, parts):
+        """
+        Adds the parts of a feature
+
+        :param feature_id: feature id
+        :param parts: list of (part number, part, bends of the part)
+        """
+
+        for number, part, result in parts:
+            bend_num = result[1]
+            feature = QgsFeature(self.fields)
+
+            if self.with_geometry:
+                feature.setGeometry(QgsGeometry(part.clone()))
+
+            feature.setAttributes(self.values + [
+                feature_id,
+                number,
+                result[0],
+                bend_num,
+                get_formatted_result(result[2] / bend_num) if bend_num > 0 else 0.0,
+                get_formatted_result(result[3] / bend_num) if bend_num > 0 else 0.0,
+                get_formatted_result(result[4] / bend_num) if bend_num > 0 else 0.0,
+                get_formatted_result(result[5] / bend_num) if bend_num > 0 else 0.0,
+                get_formatted_result(part.length() or part.perimeter()),
+                ])
+            self.batch.append(feature)
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the collected features
+        """
+
+        if self.batch:
+            self.sink.addFeatures(self.batch, QgsFeatureSink.FastInsert)
+            self.batch = []
+
+
+def get_bends_fields(with_layer=False):
+    """
+    Returns the fields of the per-feature bends output
+
+    :param with_layer: add the workspace and layer name fields
+    """
+
+    fields = QgsFields()
+
+    if with_layer:
+        fields.append(QgsField('workspace', QVariant.String))
+        fields.append(QgsField('layer', QVariant.String))
+
+    for name, field_type in BENDS_FIELDS:
+        fields.append(QgsField(name, field_type))
+
+    return fields
+
+
+def get_feature_request(groups, extent=None, indexes=None):
+    """
+    Builds a request that fetches only what the metric groups need
+
+    :param groups: selected metric groups
+    :param extent: filter extent or None for the whole layer
+    :param indexes: field indexes to fetch or None if no attributes are needed
+    """
+
+    request = QgsFeatureRequest()
+
+    if extent is not None:
+        request.setFilterRect(extent)
+
+    if LENGTH_AREA not in groups and BENDS not in groups:
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+
+    request.setSubsetOfAttributes(indexes if indexes else [])
+
+    return request
+
+
+def compute_characteristics(layer, request, groups, unique_values_per_field, feedback,
+                            feature_ids=None, bends_writer=None, cache=None):
+    """
+    Reads the features of the layer once and accumulates the characteristics
+
+    :param layer: Vector layer
+    :param request: Feature request (see get_feature_request)
+    :param groups: selected metric groups
+    :param unique_values_per_field: dictionary of sets (or sketches) to fill
+        or None if the values are not collected from the features
+    :param feedback: Feedback from a processing algorithm
+    :param feature_ids: optional list to collect the ids of the features
+    :param bends_writer: optional FeatureBendsWriter for the bends of every part
+    :param cache: optional MetricsCache with the characteristics of unchanged features
+    """
+
+    if not layer:
+        raise_exception('layer is empty')
+
+    characteristics = LayerCharacteristics()
+    indexes = list(unique_values_per_field) if unique_values_per_field else None
+    read_geometry = LENGTH_AREA in groups or BENDS in groups
+    layer_features_count = layer.featureCount()
+    total = 100.0 / layer_features_count if layer_features_count > 0 else 0
+
+    for current, feature in enumerate(layer.getFeatures(request)):
+        if feedback.isCanceled():
+            break
+
+        characteristics.features_count += 1
+
+        if feature_ids is not None:
+            feature_ids.append(feature.id())
+
+        if indexes:
+            update_unique_values(feature, indexes, unique_values_per_field)
+
+        if read_geometry and feature.hasGeometry():
+            if cache is not None:
+                feature_characteristics, parts = cache.get_characteristics(feature.id(), feature.geometry(), groups)
+                characteristics.merge(feature_characteristics)
+            else:
+                parts = characteristics.add_geometry(feature.geometry(), groups)
+
+            if bends_writer is not None and parts:
+                bends_writer.add(feature.id(), parts)
+
+        feedback.setProgress(min(int(current * total), 100))
+
+    if bends_writer is not None:
+        bends_writer.flush()
+
+    return characteristics
+
+
+def get_characteristics_row(layer, fields_count, characteristics, groups,
+                            uniq_values_number=None, ave_uniq_values_number=None,
+                            total_intersections=None):
+    """
+    Builds the output row, the values of skipped metric groups are empty
+
+    :param layer: Vector layer
+    :param fields_count: the number of fields in the layer data provider
+    :param characteristics: LayerCharacteristics
+    :param groups: selected metric groups
+    :param uniq_values_number: the ratio of unique values
+    :param ave_uniq_values_number: the ave ratio of unique values
+    :param total_intersections: the number of intersections
+    """
+
+    c = characteristics
+    bend_num = c.bend_num
+    row = dict.fromkeys(HEADER)
+    row['layer'] = layer.name()
+    row['field_count'] = fields_count
+    row['features_count'] = c.features_count
+    row['layer_type'] = QgsWkbTypes.geometryDisplayString(int(layer.geometryType()))
+
+    if ATTRIBUTES in groups:
+        row['uniq_values_number'] = uniq_values_number
+        row['average_uniq_values'] = ave_uniq_values_number
+
+    if LENGTH_AREA in groups or BENDS in groups:
+        row['number_of_points'] = c.points_num
+
+    if LENGTH_AREA in groups:
+        row['total_length'] = get_formatted_result(c.total_length)
+        row['total_polygons_area'] = get_formatted_result(c.total_polygon_area)
+        row['average_polygons_area'] = get_formatted_result(c.total_polygon_area / c.count) if c.count > 0 else 0.0
+        row['average_length'] = get_formatted_result(c.total_length / c.count) if c.count > 0 else 0.0
+
+    if BENDS in groups:
+        row['number_of_bends'] = bend_num
+        row['average_area_of_bends'] = get_formatted_result(c.total_bend_area / bend_num) if bend_num > 0 else 0.0
+        row['average_length_of_bends_baseline'] = get_formatted_result(c.bend_base_line_len / bend_num) if bend_num > 0 else 0.0
+        row['average_height_of_bends'] = get_formatted_result(c.bend_height / bend_num) if bend_num > 0 else 0.0
+        row['average_length_of_the_bends'] = get_formatted_result(c.bend_length / bend_num) if bend_num > 0 else 0.0
+        row['total_bends_area'] = get_formatted_result(c.total_bend_area)
+
+    if INTERSECTIONS in groups:
+        row['total_intersections'] = get_formatted_result(total_intersections or 0)
+
+    return row
@@ -0,0 +1,320 @@
+"""
+    Columnar cache of the layer geometries in memory-mapped numpy files,
+    repeated runs on the same layer read the coordinates without parsing
+"""
+import json
+import os
+import shutil
+
+from hashlib import blake2b
+
+import numpy
+
+from qgis.core import QgsFeatureRequest, QgsGeometry, QgsProviderRegistry, QgsWkbTypes
+from .characteristics import LENGTH_AREA, BENDS, LayerCharacteristics
+from .gpkg_reader import read_wkb
+from .ring_metrics import add_ragged
+from ..utils import raise_exception, get_safe_name
+from ..workspace import get_signature
+
+ARRAYS = (
+    'coords',
+    'ring_offsets',
+    'part_offsets',
+    'part_polygons',
+    'feature_offsets',
+    'fids',
+    'bbox',
+)
+
+META_FILE = 'meta.json'
+
+# version of the cache layout, older caches are rebuilt
+VERSION = 1
+
+# the number of features measured at once
+CHUNK_SIZE = 100000
+
+
+def get_layer_file(layer):
+    """
+    Returns the path of the source file of the layer or None
+
+    :param layer: Vector layer
+    """
+
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')
+
+    return path if path and os.path.isfile(path) else None
+
+
+def get_layer_fingerprint(layer):
+    """
+    Returns the fingerprint of the layer data: the source, the filter,
+    the number of features and the modification time and the size of the source file.
+    The layers without a file (memory layers, databases) have no cheap version
+    of their data and are not cached, None is returned for them
+
+    :param layer: Vector layer
+    """
+
+    path = get_layer_file(layer)
+
+    if path is None:
+        return None
+
+    return blake2b(json.dumps([
+        layer.source(),
+        layer.subsetString(),
+        list(get_signature(path)),
+        layer.featureCount(),
+        VERSION,
+    ]).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def get_cache_directory(root, layer):
+    """
+    Returns the directory of the layer cache
+
+    :param root: directory of the geometry caches
+    :param layer: Vector layer
+    """
+
+    name = blake2b(layer.source().encode('utf-8'), digest_size=8).hexdigest()
+
+    return os.path.join(root, '{}_{}'.format(get_safe_name(layer.name()), name))
+
+
+class GeometryCache:
+    """
+    Geometries of a layer as flat arrays:
+        coords - (n, 2) coordinates relative to the origin
+        ring_offsets - the first point of every ring (and the end)
+        part_offsets - the first ring of every part (and the end)
+        part_polygons - the part is a polygon
+        feature_offsets - the first part of every feature (and the end)
+        fids - feature ids
+        bbox - (features, 4) xmin, ymin, xmax, ymax, NaN for empty geometries
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+        self.origin = numpy.array(self.meta['origin'])
+
+    @classmethod
+    def open(cls, root, layer, float32=False, feedback=None):
+        """
+        Returns the cache of the layer, builds it if it is missing
+        or the layer has changed
+
+        :param root: directory of the geometry caches
+        :param layer: Vector layer
+        :param float32: store the coordinates as float32
+        :param feedback: Feedback from a processing algorithm
+        """
+
+        if not root:
+            raise_exception('geometry cache directory is empty')
+
+        directory = get_cache_directory(root, layer)
+        fingerprint = get_layer_fingerprint(layer)
+
+        if fingerprint is None:
+            raise_exception('the geometries of a layer without a file can\'t be cached')
+        meta_path = os.path.join(directory, META_FILE)
+
+        if os.path.isfile(meta_path):
+            with open(meta_path, encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+
+            if meta.get('fingerprint') == fingerprint and meta.get('float32') == float32:
+                return cls(directory)
+
+        if feedback:
+            feedback.pushInfo('Building the geometry cache of {}'.format(layer.name()))
+
+        build_geometry_cache(layer, directory, fingerprint, float32, feedback)
+
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.fids)
+
+    def select(self, extent=None):
+        """
+        Returns the indexes of the features whose bounding box
+        intersects the extent (all features with geometry without the extent)
+
+        :param extent: extent or None
+        """
+
+        if extent is None:
+            return numpy.flatnonzero(~numpy.isnan(self.bbox[:, 0]))
+
+        bbox = self.bbox
+
+        return numpy.flatnonzero(
+            (bbox[:, 0] <= extent.xMaximum()) & (bbox[:, 2] >= extent.xMinimum()) &
+            (bbox[:, 1] <= extent.yMaximum()) & (bbox[:, 3] >= extent.yMinimum()))
+
+    def get_lines(self):
+        """
+        Returns the lines and the polygon rings with more than one point as
+        (coords, lengths of the lines, index of the feature of every line in the cache)
+        """
+
+        ring_lengths = numpy.diff(self.ring_offsets)
+        ring_parts = numpy.repeat(numpy.arange(len(self.part_offsets) - 1), numpy.diff(self.part_offsets))
+        part_features = numpy.repeat(numpy.arange(len(self)), numpy.diff(self.feature_offsets))
+        kept = ring_lengths > 1
+        coords = numpy.asarray(self.coords, numpy.float64)[numpy.repeat(kept, ring_lengths)] + self.origin
+
+        return coords, ring_lengths[kept], part_features[ring_parts][kept]
+
+
+def get_geometry_parts(geom):
+    """
+    Returns the parts of a QGIS geometry as a list of (is polygon, list of rings),
+    curves are segmentized
+
+    :param geom: feature geometry
+    """
+
+    if QgsWkbTypes.isCurvedType(geom.wkbType()):
+        geom = QgsGeometry(geom.constGet().segmentize())
+
+    return read_wkb(bytes(geom.asWkb()))[0]
+
+
+def build_geometry_cache(layer, directory, fingerprint, float32=False, feedback=None):
+    """
+    Reads the geometries of the layer once and writes the cache
+
+    :param layer: Vector layer
+    :param directory: directory of the layer cache
+    :param fingerprint: fingerprint of the layer data
+    :param float32: store the coordinates as float32
+    :param feedback: Feedback from a processing algorithm
+    """
+
+    extent = layer.extent()
+    # float32 coordinates are stored relative to the corner of the layer extent to keep the precision
+    origin = [extent.xMinimum(), extent.yMinimum()] if float32 and not extent.isNull() else [0.0, 0.0]
+    dtype = numpy.float32 if float32 else numpy.float64
+    coords = []
+    ring_offsets = [0]
+    part_offsets = [0]
+    part_polygons = []
+    feature_offsets = [0]
+    fids = []
+    bbox = []
+    points_number = 0
+    request = QgsFeatureRequest().setNoAttributes()
+    layer_features_count = layer.featureCount()
+    total = 100.0 / layer_features_count if layer_features_count > 0 else 0
+
+    for current, feature in enumerate(layer.getFeatures(request)):
+        if feedback and feedback.isCanceled():
+            raise_exception('the geometry cache is not built, the algorithm was canceled')
+
+        fids.append(feature.id())
+        geom = feature.geometry()
+        has_geometry = feature.hasGeometry() and not geom.isEmpty()
+        parts = get_geometry_parts(geom) if has_geometry else []
+
+        if has_geometry:
+            box = geom.boundingBox()
+            bbox.append((box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()))
+        else:
+            bbox.append((numpy.nan,) * 4)
+
+        for is_polygon, rings in parts:
+            for ring in rings:
+                coords.append((ring - origin).astype(dtype))
+                points_number += len(ring)
+                ring_offsets.append(points_number)
+
+            part_offsets.append(len(ring_offsets) - 1)
+            part_polygons.append(is_polygon)
+
+        feature_offsets.append(len(part_polygons))
+
+        if feedback:
+            feedback.setProgress(min(int(current * total), 100))
+
+    arrays = {
+        'coords': numpy.concatenate(coords) if coords else numpy.empty((0, 2), dtype),
+        'ring_offsets': numpy.array(ring_offsets, numpy.int64),
+        'part_offsets': numpy.array(part_offsets, numpy.int64),
+        'part_polygons': numpy.array(part_polygons, numpy.bool_),
+        'feature_offsets': numpy.array(feature_offsets, numpy.int64),
+        'fids': numpy.array(fids, numpy.int64),
+        'bbox': numpy.array(bbox, numpy.float64).reshape(-1, 4),
+    }
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    for name, array in arrays.items():
+        numpy.save(os.path.join(temporary, name + '.npy'), array)
+
+    with open(os.path.join(temporary, META_FILE), 'w', encoding='utf-8') as meta_file:
+        json.dump({
+            'fingerprint': fingerprint,
+            'float32': float32,
+            'origin': origin,
+            'source': layer.source(),
+            'features': len(fids),
+            'points': points_number,
+        }, meta_file)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+
+
+def compute_cached_characteristics(cache, groups, feedback, extent=None):
+    """
+    Accumulates the geometric characteristics of the cached features
+
+    :param cache: GeometryCache
+    :param groups: selected metric groups
+    :param feedback: Feedback from a processing algorithm
+    :param extent: filter extent or None for the whole layer
+    """
+
+    characteristics = LayerCharacteristics()
+    indexes = cache.select(extent) if extent is not None else numpy.arange(len(cache))
+    characteristics.features_count = len(indexes)
+
+    if LENGTH_AREA not in groups and BENDS not in groups:
+        return characteristics
+
+    for start in range(0, len(cache), CHUNK_SIZE):
+        if feedback.isCanceled():
+            break
+
+        end = min(start + CHUNK_SIZE, len(cache))
+        selected = indexes[(indexes >= start) & (indexes < end)]
+
+        if not len(selected):
+            continue
+
+        # the features of a chunk are stored one after another, the offsets are rebased to the chunk
+        first_part, end_part = cache.feature_offsets[start], cache.feature_offsets[end]
+        part_offsets = numpy.asarray(cache.part_offsets[first_part:end_part + 1])
+        ring_offsets = numpy.asarray(cache.ring_offsets[part_offsets[0]:part_offsets[-1] + 1])
+        coords = cache.coords[ring_offsets[0]:ring_offsets[-1]]
+        feature_offsets = numpy.asarray(cache.feature_offsets[start:end + 1]) - first_part
+        features = numpy.zeros(end - start, numpy.bool_)
+        features[selected - start] = True
+        parts = numpy.flatnonzero(numpy.repeat(features, numpy.diff(feature_offsets)))
+        add_ragged(characteristics, coords, ring_offsets - ring_offsets[0], part_offsets - part_offsets[0],
+                   numpy.asarray(cache.part_polygons[first_part:end_part]), groups, parts)
+        feedback.setProgress(min(int(end * 100.0 / len(cache)), 100))
+
+    return characteristics
@@ -0,0 +1,285 @@
+"""
+    Direct reader of GeoPackage geometries: the geometry blobs are read with
+    sqlite3 and parsed into numpy coordinate arrays without QgsFeature objects
+"""
+import os
+import sqlite3
+import struct
+
+import numpy
+
+from qgis.core import QgsProviderRegistry
+from .characteristics import LENGTH_AREA, BENDS, LayerCharacteristics
+from .ring_metrics import pack_parts, add_ragged
+from .utils import quote_identifier
+
+# the number of rows fetched from sqlite at once
+FETCH_SIZE = 10000
+
+# sizes of the GPKG header envelopes by the envelope indicator
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+WKB_GEOMETRYCOLLECTION = 7
+
+
+class UnsupportedGeometryError(ValueError):
+    """
+    The geometry can't be parsed by the direct reader (e.g. curves)
+    """
+
+
+def get_gpkg_tables(path):
+    """
+    Returns a dictionary {table: (geometry column, srs id)} of the feature tables of a GeoPackage
+
+    :param path: path to the .gpkg file
+    """
+
+    connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+
+    try:
+        rows = connection.execute(
+            'SELECT c.table_name, g.column_name, c.srs_id FROM gpkg_contents c '
+            'JOIN gpkg_geometry_columns g ON g.table_name = c.table_name '
+            'WHERE c.data_type = \'features\'').fetchall()
+    finally:
+        connection.close()
+
+    return {table: (column, srs_id) for table, column, srs_id in rows}
+
+
+def get_gpkg_table(layer):
+    """
+    Returns (path, table, geometry column) of a GeoPackage layer
+    or None if the layer can't be read directly
+
+    :param layer: Vector layer
+    """
+
+    if layer.providerType() != 'ogr' or layer.subsetString():
+        return None
+
+    parts = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())
+    path = parts.get('path')
+    table = parts.get('layerName')
+
+    if not path or not table or not path.lower().endswith('.gpkg') or not os.path.isfile(path):
+        return None
+
+    tables = get_gpkg_tables(path)
+
+    if table not in tables:
+        return None
+
+    return path, table, tables[table][0]
+
+
+def get_header_size(blob):
+    """
+    Returns the size of the GPKG geometry header or None for an empty geometry
+
+    :param blob: GPKG geometry blob
+    """
+
+    if blob[:2] != b'GP':
+        raise UnsupportedGeometryError('not a GeoPackage geometry')
+
+    flags = blob[3]
+
+    if flags & 0x10:
+        return None
+
+    envelope = (flags >> 1) & 0x07
+
+    if envelope not in ENVELOPE_SIZES:
+        raise UnsupportedGeometryError('invalid envelope code {}'.format(envelope))
+
+    return 8 + ENVELOPE_SIZES[envelope]
+
+
+def read_wkb(data, offset=0):
+    """
+    Parses WKB (ISO or extended) into a list of (is polygon, list of rings),
+    every ring is a (n, 2) numpy array viewing the buffer.
+    Returns the parts and the offset after the geometry
+
+    :param data: buffer
+    :param offset: offset of the geometry in the buffer
+    """
+
+    endian = '<' if data[offset] == 1 else '>'
+    code = struct.unpack_from(endian + 'I', data, offset + 1)[0]
+    offset += 5
+    dimensions = 2 + (1 if code & 0x80000000 else 0) + (1 if code & 0x40000000 else 0)
+    code &= 0x0FFFFFFF
+
+    if code // 1000 > 3:
+        raise UnsupportedGeometryError('unknown geometry type {}'.format(code))
+
+    dimensions += (0, 1, 1, 2)[code // 1000]
+    base_type = code % 1000
+    dtype = numpy.dtype(endian + 'f8')
+
+    if base_type == WKB_POINT:
+        return [], offset + 8 * dimensions
+
+    if base_type == WKB_LINESTRING:
+        ring, offset = read_ring(data, offset, endian, dtype, dimensions)
+        return [(False, [ring])], offset
+
+    if base_type == WKB_POLYGON:
+        rings_number = struct.unpack_from(endian + 'I', data, offset)[0]
+        offset += 4
+        rings = []
+
+        for _ in range(rings_number):
+            ring, offset = read_ring(data, offset, endian, dtype, dimensions)
+            rings.append(ring)
+
+        return [(True, rings)], offset
+
+    if base_type in (WKB_MULTIPOINT, WKB_MULTILINESTRING, WKB_MULTIPOLYGON, WKB_GEOMETRYCOLLECTION):
+        geometries_number = struct.unpack_from(endian + 'I', data, offset)[0]
+        offset += 4
+        parts = []
+
+        for _ in range(geometries_number):
+            geometry_parts, offset = read_wkb(data, offset)
+            parts.extend(geometry_parts)
+
+        return parts, offset
+
+    raise UnsupportedGeometryError('unsupported WKB geometry type {}'.format(code))
+
+
+def read_ring(data, offset, endian, dtype, dimensions):
+    """
+    Reads the points of a line string or a ring as a (n, 2) array
+
+    :param data: buffer
+    :param offset: offset of the number of points
+    :param endian: byte order of the geometry
+    :param dtype: numpy type of the coordinates
+    :param dimensions: the number of coordinates of a point
+    """
+
+    points_number = struct.unpack_from(endian + 'I', data, offset)[0]
+    offset += 4
+    coordinates = numpy.frombuffer(data, dtype, points_number * dimensions, offset)
+
+    return coordinates.reshape(points_number, dimensions)[:, :2], offset + 8 * points_number * dimensions
+
+
+def get_extent_condition(table, column, extent):
+    """
+    Returns the WHERE clause selecting the rows whose bounding box
+    intersects the extent with the GPKG R-tree index
+
+    :param table: table name
+    :param column: geometry column name
+    :param extent: filter extent or None for the whole table
+    """
+
+    if extent is None:
+        return ''
+
+    return (' WHERE rowid IN (SELECT id FROM {} WHERE minx <= {!r} AND maxx >= {!r} '
+            'AND miny <= {!r} AND maxy >= {!r})').format(
+        quote_identifier('rtree_{}_{}'.format(table, column)),
+        extent.xMaximum(), extent.xMinimum(),
+        extent.yMaximum(), extent.yMinimum())
+
+
+def read_gpkg_geometries(path, table, column, extent=None, fetch_size=FETCH_SIZE):
+    """
+    Streams the geometries of a GeoPackage table, yields the parts of
+    every feature (see read_wkb), None for features without geometry.
+    The extent is filtered through the GPKG R-tree index
+
+    :param path: path to the .gpkg file
+    :param table: table name
+    :param column: geometry column name
+    :param extent: filter extent or None for the whole table
+    :param fetch_size: the number of rows fetched at once
+    """
+
+    connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+    sql = 'SELECT {} FROM {}{}'.format(
+        quote_identifier(column), quote_identifier(table), get_extent_condition(table, column, extent))
+
+    try:
+        cursor = connection.execute(sql)
+
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+
+            if not rows:
+                break
+
+            for (blob,) in rows:
+                header_size = get_header_size(blob) if blob is not None else None
+
+                if header_size is None:
+                    yield None
+                else:
+                    yield read_wkb(memoryview(blob), header_size)[0]
+    finally:
+        connection.close()
+
+
+def add_parts(characteristics, parts, groups):
+    """
+    Adds the parts of a feature the same way LayerCharacteristics.add_geometry does
+
+    :param characteristics: LayerCharacteristics
+    :param parts: list of (is polygon, list of rings)
+    :param groups: selected metric groups
+    """
+
+    add_ragged(characteristics, *pack_parts([parts]), groups)
+
+
+def compute_gpkg_characteristics(path, table, column, groups, feedback, extent=None, features_count=0):
+    """
+    Reads the geometries of a GeoPackage table once and accumulates the characteristics
+
+    :param path: path to the .gpkg file
+    :param table: table name
+    :param column: geometry column name
+    :param groups: selected metric groups
+    :param feedback: Feedback from a processing algorithm
+    :param extent: filter extent or None for the whole table
+    :param features_count: the number of features for the progress
+    """
+
+    characteristics = LayerCharacteristics()
+    total = 100.0 / features_count if features_count > 0 else 0
+    with_geometry = LENGTH_AREA in groups or BENDS in groups
+    batch = []
+
+    for current, parts in enumerate(read_gpkg_geometries(path, table, column, extent)):
+        if feedback.isCanceled():
+            break
+
+        characteristics.features_count += 1
+
+        if parts and with_geometry:
+            batch.append(parts)
+
+        # the parts of a batch of features are measured at once
+        if len(batch) >= FETCH_SIZE:
+            add_ragged(characteristics, *pack_parts(batch), groups)
+            batch = []
+
+        feedback.setProgress(min(int(current * total), 100))
+
+    if batch:
+        add_ragged(characteristics, *pack_parts(batch), groups)
+
+    return characteristics
@@ -32,22 +32,33 @@ __revision__ = '$Format:%H$'
 
 import os
 
-from random import randrange
-
 from PyQt5.QtCore import QCoreApplication
-from qgis.core import (QgsFeatureRequest,
-                       QgsProcessing,
+from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
                        QgsProcessingParameterExtent,
+                       QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterFileDestination,
                        QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
                        QgsProcessingParameterVectorLayer,
                        QgsWkbTypes)
 from qgis.utils import iface
 
-from .utils import get, get_formatted_ratios_result, update_unique_values, get_formatted_result, get_unique_values_ratio, get_ave_unique_values_ratio
-from ..utils import tr, raise_exception, write_to_file, define_help_info, filter_layers, get_total_intersection
+from .characteristics import (METRIC_GROUPS, HEADER, ATTRIBUTES, LENGTH_AREA, BENDS, INTERSECTIONS,
+                              FeatureBendsWriter, get_bends_fields, get_feature_request,
+                              compute_characteristics, get_characteristics_row)
+from .geometry_cache import GeometryCache, compute_cached_characteristics, get_layer_file
+from .metrics_cache import MetricsCache, get_cache_path
+from .sampling import (SAMPLING_METHODS, NO_SAMPLING, CONFIDENCE_HEADER, get_sample_strata,
+                       compute_sample_characteristics, estimate_characteristics, get_confidence_path)
+from .attribute_stats import FIELDS_HEADER, compute_field_statistics, get_field_statistics_rows, get_fields_path
+from .unique_values import UNIQUE_VALUES_METHODS, EXACT, COLUMNAR, create_unique_values_per_field
+from .utils import get_unique_values_ratio, get_ave_unique_values_ratio, get_formatted_result
+from ..total_intersections.segment_intersection import get_intersection_layers
+from ..utils import tr, raise_exception, write_to_file, define_help_info, get_total_intersection_count
 
 
 class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
@@ -67,7 +78,16 @@ class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
     # calling from the QGIS console.
 
     OUTPUT = 'OUTPUT'
+    BENDS_OUTPUT = 'BENDS_OUTPUT'
     INPUT = 'INPUT'
+    METRICS = 'METRICS'
+    UNIQUE_VALUES_METHOD = 'UNIQUE_VALUES_METHOD'
+    USE_CACHE = 'USE_CACHE'
+    SAMPLING = 'SAMPLING'
+    SAMPLE_SIZE = 'SAMPLE_SIZE'
+    SEED = 'SEED'
+    GEOMETRY_CACHE = 'GEOMETRY_CACHE'
+    GEOMETRY_CACHE_FLOAT32 = 'GEOMETRY_CACHE_FLOAT32'
     EXTENT = 'EXTENT'
     HELP_FILE = 'layer_characteristics_help.txt'
 
@@ -105,6 +125,60 @@ class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
                 tr('Minimum extent to render'),
                 defaultValue=str(default_extent_value)))
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METRICS,
+                tr('Metric groups'),
+                options=[tr(option) for option in METRIC_GROUPS],
+                allowMultiple=True,
+                defaultValue=list(range(len(METRIC_GROUPS)))))
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.UNIQUE_VALUES_METHOD,
+                tr('Unique values counting method'),
+                options=[tr(option) for option in UNIQUE_VALUES_METHODS],
+                defaultValue=EXACT))
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SAMPLING,
+                tr('Sampling of bends, length and area'),
+                options=[tr(option) for option in SAMPLING_METHODS],
+                defaultValue=NO_SAMPLING))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SAMPLE_SIZE,
+                tr('Sample size'),
+                minValue=1,
+                defaultValue=1000))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEED,
+                tr('Random seed'),
+                defaultValue=1))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.USE_CACHE,
+                tr('Cache the characteristics of the features next to the output file'),
+                defaultValue=False))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GEOMETRY_CACHE,
+                tr('Geometry cache directory'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.GEOMETRY_CACHE_FLOAT32,
+                tr('Store the cached coordinates as float32'),
+                defaultValue=False))
+
         self.addParameter(
             QgsProcessingParameterFileDestination(
                 self.OUTPUT,
@@ -113,6 +187,15 @@ class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.BENDS_OUTPUT,
+                tr('Bends of the features'),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -122,6 +205,14 @@ class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
         extent = self.parameterAsExtent(parameters, self.EXTENT, context)
         layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
         output = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        groups = self.parameterAsEnums(parameters, self.METRICS, context)
+        unique_values_method = self.parameterAsEnum(parameters, self.UNIQUE_VALUES_METHOD, context)
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE, context)
+        sampling = self.parameterAsEnum(parameters, self.SAMPLING, context)
+        sample_size = self.parameterAsInt(parameters, self.SAMPLE_SIZE, context)
+        seed = self.parameterAsInt(parameters, self.SEED, context)
+        geometry_cache_root = self.parameterAsFile(parameters, self.GEOMETRY_CACHE, context)
+        float32 = self.parameterAsBoolean(parameters, self.GEOMETRY_CACHE_FLOAT32, context)
 
         if not extent:
             raise_exception('can\'t read extent')
@@ -133,163 +224,155 @@ class LayerCharacteristicsAlgorithm(QgsProcessingAlgorithm):
             raise_exception('can\'t get an output')
 
         feedback.pushInfo(tr('The algorithm is running'))
-        request = QgsFeatureRequest().setFilterRect(extent)
-        features = list(layer.getFeatures(request))
-        features_count = len(features)
         fields = layer.dataProvider().fields()
         indexes = [fields.indexFromName(field.name()) for field in fields]
+        unique_values_per_field = None
+        collect_unique_values = False
+        total_intersections = None
+
+        if ATTRIBUTES in groups and unique_values_method == COLUMNAR:
+            statistics = compute_field_statistics(layer, indexes, extent, feedback)
+            unique_values_per_field = {index: value.distinct for index, value in statistics.items()}
+
+            if statistics:
+                write_to_file(get_fields_path(output), FIELDS_HEADER, get_field_statistics_rows(layer, statistics), ';')
+        elif ATTRIBUTES in groups:
+            unique_values_per_field, collect_unique_values = create_unique_values_per_field(
+                layer, indexes, unique_values_method, extent, feedback)
+
+        if LENGTH_AREA not in groups and BENDS not in groups:
+            sampling = NO_SAMPLING
+
+        intervals = {}
+        feature_ids = [] if sampling != NO_SAMPLING else None
+        read_groups = groups if sampling == NO_SAMPLING else [g for g in groups if g not in (LENGTH_AREA, BENDS)]
+        bends_writer = None
+        (bends_sink, bends_dest_id) = self.parameterAsSink(
+            parameters, self.BENDS_OUTPUT,
+            context, get_bends_fields(),
+            QgsWkbTypes.singleType(layer.wkbType()),
+            layer.sourceCrs()
+        )
 
-        unique_values_per_field = {key: set() for key in indexes}
-        points_num = 0
-        total_length = 0
-        bend_num = 0
-        total_bend_area = 0.0
-        ave_bend_base_line_len = 0.0
-        ave_bend_height = 0.0
-        ave_bend_length = 0.0
-        total_polygon_area = 0.0
-        count = 0.0
-        total_intersections = 0
-
-        total = 100.0 / features_count if features_count > 0 else 0
-
-        for current, feature in enumerate(features):
-            if feedback.isCanceled():
-                break
-
-            update_unique_values(feature, indexes, unique_values_per_field)
-            geom = feature.geometry()
-            is_single_type = QgsWkbTypes.isSingleType(geom.wkbType())
-
-            if geom.type() == QgsWkbTypes.LineGeometry:
-                total_length += geom.length()
-
-                if is_single_type:
-                    data_list = [(v.x(), v.y()) for v in geom.vertices()]
-
-                    if len(data_list) < 3:
-                        continue
-
-                    result = get(data_list)
-                    count = count + 1
-                    points_num += result[0]
-                    bend_num += result[1]
-                    total_bend_area += result[2]
-                    ave_bend_base_line_len += result[3]
-                    ave_bend_height += result[4]
-                    ave_bend_length += result[5]
-                else:
-                    for part in geom.parts():
-                        data_list = [(v.x(), v.y()) for v in part.vertices()]
-
-                        if len(data_list) < 3:
-                            continue
-
-                        result = get(data_list)
-                        count = count + 1
-                        points_num += result[0]
-                        bend_num += result[1]
-                        total_bend_area += result[2]
-                        ave_bend_base_line_len += result[3]
-                        ave_bend_height += result[4]
-                        ave_bend_length += result[5]
-            elif geom.type() == QgsWkbTypes.PolygonGeometry:
-                total_length += geom.length()
-
-                if is_single_type:
-                    data_list = [(v.x(), v.y()) for v in geom.vertices()]
-
-                    if len(data_list) < 3:
-                        continue
-
-                    result = get(data_list)
-                    count = count+1
-                    points_num += result[0]
-                    bend_num += result[1]
-                    total_bend_area += result[2]
-                    ave_bend_base_line_len += result[3]
-                    ave_bend_height += result[4]
-                    ave_bend_length += result[5]
-                    total_polygon_area += geom.area()
-                else:
-                    for part in geom.parts():
-                        data_list = [(v.x(), v.y()) for v in part.vertices()]
-
-                        if len(data_list) < 3:
-                            continue
-
-                        result = get(data_list)
-                        count = count + 1
-                        points_num += result[0]
-                        bend_num += result[1]
-                        total_bend_area += result[2]
-                        ave_bend_base_line_len += result[3]
-                        ave_bend_height += result[4]
-                        ave_bend_length += result[5]
-                    total_polygon_area += geom.area()
+        if bends_sink is not None:
+            if BENDS not in groups or sampling != NO_SAMPLING:
+                feedback.pushInfo(tr('Bends of all features are not computed, the bends of the features are not written'))
             else:
-                break
-
-            self.progress = int(current * total)
-            feedback.setProgress(self.progress)
-
-        uniq_values_number = get_unique_values_ratio(unique_values_per_field, features_count)
-        ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, len(fields))
-
-        feedback.pushInfo('Total intersections:')
-        filtered_layers = filter_layers([layer])
-
-        if filtered_layers:
-            total_intersections = len(get_total_intersection(filtered_layers[0], feedback))
-
-        header = [
-            'layer',
-            'field_count',
-            'features_count',
-            'uniq_values_number',
-            'average_uniq_values',
-            'total_length',
-            'number_of_points',
-            'number_of_bends',
-            'average_area_of_bends',
-            'average_length_of_bends_baseline',
-            'average_height_of_bends',
-            'average_length_of_the_bends',
-            'total_polygons_area',
-            'average_polygons_area',
-            'average_length',
-            'layer_type',
-            'total_bends_area',
-            'total_intersections',
-        ]
-        row = [{
-            header[0]: layer.name(),
-            header[1]: len(fields),
-            header[2]: features_count,
-            header[3]: uniq_values_number,
-            header[4]: ave_uniq_values_number,
-            header[5]: get_formatted_result(total_length),
-            header[6]: points_num,
-            header[7]: bend_num,
-            header[8]: get_formatted_result(total_bend_area / bend_num) if bend_num > 0 else 0.0,
-            header[9]: get_formatted_result(ave_bend_base_line_len / bend_num) if bend_num > 0 else 0.0,
-            header[10]: get_formatted_result(ave_bend_height / bend_num) if bend_num > 0 else 0.0,
-            header[11]: get_formatted_result(ave_bend_length / bend_num) if bend_num > 0 else 0.0,
-            header[12]: get_formatted_result(total_polygon_area),
-            header[13]: get_formatted_result(total_polygon_area / count) if count > 0 else 0.0,
-            header[14]: get_formatted_result(total_length / count) if count > 0 else 0.0,
-            header[15]: QgsWkbTypes.geometryDisplayString(int(layer.geometryType())),
-            header[16]: get_formatted_result(total_bend_area),
-            header[17]: get_formatted_result(total_intersections),
-        }]
+                bends_writer = FeatureBendsWriter(bends_sink, get_bends_fields())
+
+        read_geometry = LENGTH_AREA in read_groups or BENDS in read_groups
+        cache = None
+
+        if use_cache and read_geometry:
+            cache = MetricsCache(get_cache_path(output), layer.source())
+
+        if geometry_cache_root and read_geometry and not get_layer_file(layer):
+            feedback.pushInfo(tr('The layer has no file, the geometry cache is not used'))
+            geometry_cache_root = None
+
+        if geometry_cache_root and read_geometry and cache is None and bends_writer is None:
+            geometry_cache = GeometryCache.open(geometry_cache_root, layer, float32, feedback)
+            characteristics = compute_cached_characteristics(geometry_cache, read_groups, feedback, extent)
+
+            if collect_unique_values:
+                compute_characteristics(
+                    layer, get_feature_request([ATTRIBUTES], extent, indexes), [ATTRIBUTES],
+                    unique_values_per_field, feedback)
+        else:
+            request = get_feature_request(read_groups, extent, indexes if collect_unique_values else None)
+            characteristics = compute_characteristics(
+                layer, request, read_groups,
+                unique_values_per_field if collect_unique_values else None,
+                feedback, feature_ids, bends_writer, cache)
+
+        if cache is not None:
+            cache.close(not feedback.isCanceled() and extent.contains(layer.extent()))
+            feedback.pushInfo(tr('Cache hit ratio: {:.1%} ({} of {} features)').format(
+                cache.hit_ratio(), cache.hits, cache.hits + cache.misses))
+
+        if sampling != NO_SAMPLING:
+            feedback.pushInfo(tr('Computing bends, length and area on a sample'))
+            strata = get_sample_strata(layer, extent, feature_ids, sampling, sample_size, seed)
+            features_count = characteristics.features_count
+            characteristics, intervals = estimate_characteristics(
+                compute_sample_characteristics(layer, strata, groups, feedback))
+            characteristics.features_count = features_count
+            sample_size = sum(len(ids) for _, ids in strata)
+
+        uniq_values_number = None
+        ave_uniq_values_number = None
+
+        if unique_values_per_field is not None:
+            uniq_values_number = get_unique_values_ratio(unique_values_per_field, characteristics.features_count)
+            ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, len(fields))
+
+        if INTERSECTIONS in groups:
+            feedback.pushInfo('Total intersections:')
+            filtered_layers = get_intersection_layers([layer])
+            total_intersections = 0
+
+            if filtered_layers:
+                total_intersections = get_total_intersection_count(filtered_layers[0], feedback)
+
+        header = HEADER
+        row = [get_characteristics_row(
+            layer, len(fields), characteristics, groups,
+            uniq_values_number, ave_uniq_values_number, total_intersections)]
 
         if output:
             feedback.pushInfo(tr('Writing to file'))
             write_to_file(output, header, row, ';')
 
+        if intervals:
+            self.write_confidence_intervals(
+                get_confidence_path(output), row[0], intervals,
+                sample_size, characteristics.features_count, feedback)
+
+        if bends_sink is not None:
+            row[0][self.BENDS_OUTPUT] = bends_dest_id
+
         return row[0]
 
 
+    def write_confidence_intervals(self, path, row, intervals, sample_size, features_count, feedback):
+        """
+        Logs and writes the confidence intervals of the sample estimates
+
+        :param path: Path to the file
+        :param row: Output row
+        :param intervals: dictionary {characteristic: (estimate, low, high)}
+        :param sample_size: the number of sampled features
+        :param features_count: the number of features in the extent
+        :param feedback: Feedback from a processing algorithm
+        """
+
+        feedback.pushInfo(tr('95% confidence intervals (sample of {} from {} features):').format(
+            sample_size, features_count))
+        rows = []
+
+        for characteristic, (estimate, low, high) in intervals.items():
+            if row[characteristic] is None:
+                continue
+
+            feedback.pushInfo('{}: {} [{}, {}]'.format(
+                characteristic,
+                get_formatted_result(estimate),
+                get_formatted_result(low),
+                get_formatted_result(high)))
+            rows.append({
+                'layer': row['layer'],
+                'characteristic': characteristic,
+                'estimate': get_formatted_result(estimate),
+                'ci_low': get_formatted_result(low),
+                'ci_high': get_formatted_result(high),
+                'sample_size': sample_size,
+                'features_count': features_count,
+            })
+
+        if rows:
+            write_to_file(path, CONFIDENCE_HEADER, rows, ';')
+
+
     def name(self):
         """
         Returns the algorithm name, used for identifying the algorithm. This
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ LayerCharacteristics
+                                 A QGIS plugin
+ This plugin computes layer characteristics
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-08-21
+        copyright            : (C) 2020 by Potemkin D.A., Yakimova O.P., Samsonov T.E.
+        email                : daniilpot@yandex.ru
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P., Samsonov T.E.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+
+from .layer_characteristics_gpkg_algorithm import LayerCharacteristicsGpkgAlgorithm
+from ..batch import BatchAlgorithm
+from ..utils import tr, define_help_info
+
+
+class LayerCharacteristicsBatchAlgorithm(BatchAlgorithm):
+    """
+    This is a class that calculates the characteristics of the layers
+    of many workspaces in a pool of processes
+    """
+
+    WORKSPACE_ALGORITHM = LayerCharacteristicsGpkgAlgorithm
+    HELP_FILE = 'layer_characteristics_batch_help.txt'
+
+    def __init__(self):
+        super().__init__()
+        directory = os.path.dirname(__file__)
+        file_name = os.path.join(directory, self.HELP_FILE)
+        self._shortHelp = define_help_info(file_name)
+
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'Compute layers characteristics of many workspaces'
+
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return tr(self.name())
+
+
+    def shortHelpString(self):
+        return self._shortHelp
+
+
+    def createInstance(self):
+        return LayerCharacteristicsBatchAlgorithm()
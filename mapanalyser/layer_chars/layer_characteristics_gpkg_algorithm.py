@@ -32,23 +32,35 @@ __revision__ = '$Format:%H$'
 
 import os
 
-from random import randrange
 
 from PyQt5.QtCore import QCoreApplication
 from qgis.core import (QgsFeatureRequest,
                        QgsProcessing,
-                       QgsVectorLayer,
                        QgsProcessingAlgorithm,
                        QgsProcessingException,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
                        QgsProcessingParameterExtent,
+                       QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterFileDestination,
                        QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
                        QgsProcessingParameterVectorLayer,
                        QgsWkbTypes)
 from qgis.utils import iface
 
-from .utils import get, get_formatted_ratios_result, update_unique_values, get_formatted_result, get_unique_values_ratio, get_ave_unique_values_ratio
-from ..utils import tr, raise_exception, write_to_file, define_help_info, filter_layers, get_total_intersection
+from .characteristics import (METRIC_GROUPS, HEADER, ATTRIBUTES, LENGTH_AREA, BENDS, INTERSECTIONS,
+                              FeatureBendsWriter, get_bends_fields, get_feature_request,
+                              compute_characteristics, get_characteristics_row)
+from .geometry_cache import GeometryCache, compute_cached_characteristics
+from .gpkg_reader import UnsupportedGeometryError, get_gpkg_table, compute_gpkg_characteristics
+from .metrics_cache import MetricsCache, get_cache_path
+from .pipeline import LockedSink, ordered_map, get_default_threads
+from .unique_values import UNIQUE_VALUES_METHODS, EXACT, create_unique_values_per_field
+from .utils import get_unique_values_ratio, get_ave_unique_values_ratio, get_formatted_result
+from ..total_intersections.segment_intersection import get_intersection_layers
+from ..utils import tr, raise_exception, write_to_file, define_help_info, get_total_intersection_count
+from ..workspace import get_sublayers, use_layer, has_lines
 
 
 class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
@@ -68,7 +80,15 @@ class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
     # calling from the QGIS console.
 
     OUTPUT = 'OUTPUT'
+    BENDS_OUTPUT = 'BENDS_OUTPUT'
     INPUT = 'INPUT'
+    METRICS = 'METRICS'
+    UNIQUE_VALUES_METHOD = 'UNIQUE_VALUES_METHOD'
+    USE_CACHE = 'USE_CACHE'
+    THREADS = 'THREADS'
+    DIRECT_READER = 'DIRECT_READER'
+    GEOMETRY_CACHE = 'GEOMETRY_CACHE'
+    GEOMETRY_CACHE_FLOAT32 = 'GEOMETRY_CACHE_FLOAT32'
     # EXTENT = 'EXTENT'
     HELP_FILE = 'layer_characteristics_help.txt'
 
@@ -113,6 +133,53 @@ class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
         #         tr('Minimum extent to render'),
         #         defaultValue=str(default_extent_value)))
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METRICS,
+                tr('Metric groups'),
+                options=[tr(option) for option in METRIC_GROUPS],
+                allowMultiple=True,
+                defaultValue=list(range(len(METRIC_GROUPS)))))
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.UNIQUE_VALUES_METHOD,
+                tr('Unique values counting method'),
+                options=[tr(option) for option in UNIQUE_VALUES_METHODS],
+                defaultValue=EXACT))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.USE_CACHE,
+                tr('Cache the characteristics of the features next to the output file'),
+                defaultValue=False))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                tr('Number of reader threads'),
+                minValue=1,
+                defaultValue=get_default_threads()))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.DIRECT_READER,
+                tr('Read GeoPackage geometries directly with SQLite'),
+                defaultValue=True))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GEOMETRY_CACHE,
+                tr('Geometry cache directory'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.GEOMETRY_CACHE_FLOAT32,
+                tr('Store the cached coordinates as float32'),
+                defaultValue=False))
+
         self.addParameter(
             QgsProcessingParameterFileDestination(
                 self.OUTPUT,
@@ -121,6 +188,15 @@ class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.BENDS_OUTPUT,
+                tr('Bends of the features'),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -130,6 +206,14 @@ class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
         # extent = self.parameterAsExtent(parameters, self.EXTENT, context)
         workspace = self.parameterAsFile(parameters, self.INPUT, context)
         output = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        groups = self.parameterAsEnums(parameters, self.METRICS, context)
+        unique_values_method = self.parameterAsEnum(parameters, self.UNIQUE_VALUES_METHOD, context)
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE, context)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        direct_reader = self.parameterAsBoolean(parameters, self.DIRECT_READER, context)
+        geometry_cache_root = self.parameterAsFile(parameters, self.GEOMETRY_CACHE, context)
+        float32 = self.parameterAsBoolean(parameters, self.GEOMETRY_CACHE_FLOAT32, context)
+        geometry_cache = (geometry_cache_root, float32) if geometry_cache_root else None
 
         # if not extent:
         #     raise_exception('can\'t read extent')
@@ -142,173 +226,188 @@ class LayerCharacteristicsGpkgAlgorithm(QgsProcessingAlgorithm):
 
         feedback.pushInfo(tr('The algorithm is running'))
 
-        dummy = QgsVectorLayer(workspace, "dummy", "ogr")
-        sublyrs = dummy.dataProvider().subLayers()
+        sublayers = get_sublayers(workspace)
+        names = [sublayer.name for sublayer in sublayers]
+        line_names = {sublayer.name for sublayer in sublayers if has_lines(sublayer)}
+        workspace_name = os.path.basename(os.path.normpath(workspace))
+
+        (bends_sink, bends_dest_id) = self.parameterAsSink(
+            parameters, self.BENDS_OUTPUT,
+            context, get_bends_fields(True),
+            QgsWkbTypes.NoGeometry
+        )
+
+        if bends_sink is not None and BENDS not in groups:
+            feedback.pushInfo(tr('Bends are not selected, the bends of the features are not written'))
+
+        shared_bends_sink = LockedSink(bends_sink) if bends_sink is not None and BENDS in groups else None
+        cache_path = get_cache_path(output) if use_cache and (LENGTH_AREA in groups or BENDS in groups) else None
+
+        def compute_layer(name, worker_feedback):
+            return self.compute_layer_characteristics(
+                workspace, name, groups, unique_values_method,
+                cache_path, shared_bends_sink, direct_reader, geometry_cache, worker_feedback)
+
+        header = ['workspace'] + HEADER
+        rows = []
+        total = 100.0 / len(names) if names else 0
+
+        for current, (name, row, worker_feedback) in enumerate(ordered_map(compute_layer, names, threads, feedback)):
+            if feedback.isCanceled():
+                break
+
+            worker_feedback.flush()
+
+            if INTERSECTIONS in groups:
+                feedback.pushInfo('Total intersections:')
+                total_intersections = 0
+
+                # the layers without lines and polygons are not opened again
+                if name in line_names:
+                    with use_layer(workspace, name) as layer:
+                        filtered_layers = get_intersection_layers([layer])
+
+                        if filtered_layers:
+                            total_intersections = get_total_intersection_count(filtered_layers[0], feedback)
+
+                row['total_intersections'] = get_formatted_result(total_intersections)
 
-        layers = []
-        for sublyr in sublyrs:
-            name = sublyr.split('!!::!!')[1]
-            uri = "%s|layername=%s" % (workspace, name)
-            layer = QgsVectorLayer(uri, name, "ogr")
-            layers.append(layer)
+            rows.append(dict(workspace=workspace_name, **row))
+            feedback.setProgress(int((current + 1) * total))
 
-        for layer in layers:
-            features = list(layer.getFeatures())
-            features_count = len(features)
+        if output and rows:
+            feedback.pushInfo(tr('Writing to file'))
+            write_to_file(output, header, rows, ';')
+
+        result = dict(rows[-1]) if rows else {}
+
+        if bends_sink is not None:
+            result[self.BENDS_OUTPUT] = bends_dest_id
+
+        return result
+
+
+    def compute_layer_characteristics(self, workspace, name, groups, unique_values_method,
+                                      cache_path, bends_sink, direct_reader, geometry_cache, feedback):
+        """
+        Computes the characteristics of a layer of the workspace (without the
+        intersections), runs in a reader thread.
+        Returns the output row
+
+        :param workspace: Path to the workspace
+        :param name: Layer name
+        :param groups: selected metric groups
+        :param unique_values_method: EXACT, PROVIDER or APPROXIMATE
+        :param cache_path: path of the metrics cache or None
+        :param bends_sink: LockedSink for the bends of the features or None
+        :param direct_reader: read the geometries of GeoPackage layers with sqlite
+        :param geometry_cache: (directory, float32) of the geometry cache or None
+        :param feedback: WorkerFeedback
+        """
+
+        with use_layer(workspace, name) as layer:
             fields = layer.dataProvider().fields()
             indexes = [fields.indexFromName(field.name()) for field in fields]
+            unique_values_per_field = None
+            collect_unique_values = False
+            bends_writer = None
+
+            if bends_sink is not None:
+                bends_writer = FeatureBendsWriter(bends_sink, get_bends_fields(True), False)
+                bends_writer.values = [os.path.basename(os.path.normpath(workspace)), name]
+
+            direct = None
+            read_geometry = LENGTH_AREA in groups or BENDS in groups
+
+            if geometry_cache and read_geometry and bends_writer is None and not cache_path:
+                characteristics = compute_cached_characteristics(
+                    GeometryCache.open(geometry_cache[0], layer, geometry_cache[1], feedback), groups, feedback)
+                unique_values_per_field = None
+
+                if ATTRIBUTES in groups:
+                    unique_values_per_field, collect_unique_values = create_unique_values_per_field(
+                        layer, indexes, unique_values_method, None, feedback)
+
+                    if collect_unique_values:
+                        compute_characteristics(
+                            layer, get_feature_request([ATTRIBUTES], None, indexes), [ATTRIBUTES],
+                            unique_values_per_field, feedback)
+
+                direct = characteristics, unique_values_per_field
+            elif direct_reader and bends_writer is None and not cache_path:
+                direct = self.compute_direct_characteristics(layer, groups, indexes, unique_values_method, feedback)
+
+            if direct is not None:
+                characteristics, unique_values_per_field = direct
+            else:
+                if ATTRIBUTES in groups:
+                    unique_values_per_field, collect_unique_values = create_unique_values_per_field(
+                        layer, indexes, unique_values_method, None, feedback)
+
+                request = get_feature_request(groups, None, indexes if collect_unique_values else None)
+                cache = MetricsCache(cache_path, layer.source()) if cache_path else None
+
+                characteristics = compute_characteristics(
+                    layer, request, groups,
+                    unique_values_per_field if collect_unique_values else None,
+                    feedback, None, bends_writer, cache)
+
+                if cache is not None:
+                    cache.close(not feedback.isCanceled())
+                    feedback.pushInfo(tr('Cache hit ratio of {}: {:.1%} ({} of {} features)').format(
+                        name, cache.hit_ratio(), cache.hits, cache.hits + cache.misses))
+
+            uniq_values_number = None
+            ave_uniq_values_number = None
+
+            if unique_values_per_field is not None:
+                uniq_values_number = get_unique_values_ratio(unique_values_per_field, characteristics.features_count)
+                ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, len(fields))
+
+            return get_characteristics_row(
+                layer, len(fields), characteristics, groups,
+                uniq_values_number, ave_uniq_values_number)
+
+
+    def compute_direct_characteristics(self, layer, groups, indexes, unique_values_method, feedback):
+        """
+        Computes the characteristics of a GeoPackage layer with the direct sqlite reader,
+        the unique values are counted with the selected method
+        (the values the method collects from the features are read through QGIS).
+        Returns (LayerCharacteristics, number of unique values per field)
+        or None if the layer can't be read directly
+
+        :param layer: Vector layer
+        :param groups: selected metric groups
+        :param indexes: field indexes
+        :param unique_values_method: EXACT, PROVIDER or APPROXIMATE
+        :param feedback: WorkerFeedback
+        """
+
+        table = get_gpkg_table(layer)
+
+        if table is None:
+            return None
+
+        try:
+            characteristics = compute_gpkg_characteristics(
+                *table, groups, feedback, features_count=layer.featureCount())
+        except UnsupportedGeometryError as error:
+            feedback.pushInfo(tr('{} is read through QGIS: {}').format(layer.name(), error))
+            return None
+
+        unique_values_per_field = None
+
+        if ATTRIBUTES in groups:
+            unique_values_per_field, collect_unique_values = create_unique_values_per_field(
+                layer, indexes, unique_values_method, None, feedback)
+
+            if collect_unique_values:
+                compute_characteristics(
+                    layer, get_feature_request([ATTRIBUTES], None, indexes), [ATTRIBUTES],
+                    unique_values_per_field, feedback)
 
-            unique_values_per_field = {key: set() for key in indexes}
-            points_num = 0
-            total_length = 0
-            bend_num = 0
-            total_bend_area = 0.0
-            ave_bend_base_line_len = 0.0
-            ave_bend_height = 0.0
-            ave_bend_length = 0.0
-            total_polygon_area = 0.0
-            count = 0.0
-            total_intersections = 0
-
-            total = 100.0 / features_count if features_count > 0 else 0
-
-            for current, feature in enumerate(features):
-                if feedback.isCanceled():
-                    break
-
-                update_unique_values(feature, indexes, unique_values_per_field)
-                geom = feature.geometry()
-                is_single_type = QgsWkbTypes.isSingleType(geom.wkbType())
-
-                if geom.type() == QgsWkbTypes.LineGeometry:
-                    total_length += geom.length()
-
-                    if is_single_type:
-                        data_list = [(v.x(), v.y()) for v in geom.vertices()]
-
-                        if len(data_list) < 3:
-                            continue
-
-                        result = get(data_list)
-                        count = count + 1
-                        points_num += result[0]
-                        bend_num += result[1]
-                        total_bend_area += result[2]
-                        ave_bend_base_line_len += result[3]
-                        ave_bend_height += result[4]
-                        ave_bend_length += result[5]
-                    else:
-                        for part in geom.parts():
-                            data_list = [(v.x(), v.y()) for v in part.vertices()]
-
-                            if len(data_list) < 3:
-                                continue
-
-                            result = get(data_list)
-                            count = count + 1
-                            points_num += result[0]
-                            bend_num += result[1]
-                            total_bend_area += result[2]
-                            ave_bend_base_line_len += result[3]
-                            ave_bend_height += result[4]
-                            ave_bend_length += result[5]
-                elif geom.type() == QgsWkbTypes.PolygonGeometry:
-                    total_length += geom.length()
-
-                    if is_single_type:
-                        data_list = [(v.x(), v.y()) for v in geom.vertices()]
-
-                        if len(data_list) < 3:
-                            continue
-
-                        result = get(data_list)
-                        count = count+1
-                        points_num += result[0]
-                        bend_num += result[1]
-                        total_bend_area += result[2]
-                        ave_bend_base_line_len += result[3]
-                        ave_bend_height += result[4]
-                        ave_bend_length += result[5]
-                        total_polygon_area += geom.area()
-                    else:
-                        for part in geom.parts():
-                            data_list = [(v.x(), v.y()) for v in part.vertices()]
-
-                            if len(data_list) < 3:
-                                continue
-
-                            result = get(data_list)
-                            count = count + 1
-                            points_num += result[0]
-                            bend_num += result[1]
-                            total_bend_area += result[2]
-                            ave_bend_base_line_len += result[3]
-                            ave_bend_height += result[4]
-                            ave_bend_length += result[5]
-                        total_polygon_area += geom.area()
-                else:
-                    break
-
-                self.progress = int(current * total)
-                feedback.setProgress(self.progress)
-
-            uniq_values_number = get_unique_values_ratio(unique_values_per_field, features_count)
-            ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, len(fields))
-
-            feedback.pushInfo('Total intersections:')
-            filtered_layers = filter_layers([layer])
-
-            if filtered_layers:
-                total_intersections = len(get_total_intersection(filtered_layers[0], feedback))
-
-            header = [
-                'workspace',
-                'layer',
-                'field_count',
-                'features_count',
-                'uniq_values_number',
-                'average_uniq_values',
-                'total_length',
-                'number_of_points',
-                'number_of_bends',
-                'average_area_of_bends',
-                'average_length_of_bends_baseline',
-                'average_height_of_bends',
-                'average_length_of_the_bends',
-                'total_polygons_area',
-                'average_polygons_area',
-                'average_length',
-                'layer_type',
-                'total_bends_area',
-                'total_intersections',
-            ]
-            row = [{
-                header[0]: os.path.basename(os.path.normpath(workspace)),
-                header[1]: layer.name(),
-                header[2]: len(fields),
-                header[3]: features_count,
-                header[4]: uniq_values_number,
-                header[5]: ave_uniq_values_number,
-                header[6]: get_formatted_result(total_length),
-                header[7]: points_num,
-                header[8]: bend_num,
-                header[9]: get_formatted_result(total_bend_area / bend_num) if bend_num > 0 else 0.0,
-                header[10]: get_formatted_result(ave_bend_base_line_len / bend_num) if bend_num > 0 else 0.0,
-                header[11]: get_formatted_result(ave_bend_height / bend_num) if bend_num > 0 else 0.0,
-                header[12]: get_formatted_result(ave_bend_length / bend_num) if bend_num > 0 else 0.0,
-                header[13]: get_formatted_result(total_polygon_area),
-                header[14]: get_formatted_result(total_polygon_area / count) if count > 0 else 0.0,
-                header[15]: get_formatted_result(total_length / count) if count > 0 else 0.0,
-                header[16]: QgsWkbTypes.geometryDisplayString(int(layer.geometryType())),
-                header[17]: get_formatted_result(total_bend_area),
-                header[18]: get_formatted_result(total_intersections),
-            }]
-
-            if output:
-                feedback.pushInfo(tr('Writing to file'))
-                write_to_file(output, header, row, ';')
-
-        return row[0]
+        return characteristics, unique_values_per_field
 
 
     def name(self):
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ LayerCharacteristics
+                                 A QGIS plugin
+ This plugin computes layer characteristics
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-08-21
+        copyright            : (C) 2020 by Potemkin D.A., Yakimova O.P.
+        email                : daniilpot@yandex.ru
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+
+from PyQt5.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureRequest,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterExtent,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterVectorLayer,
+                       QgsWkbTypes)
+
+from .characteristics import (METRIC_GROUPS, HEADER, ATTRIBUTES, LENGTH_AREA, BENDS, INTERSECTIONS, BATCH_SIZE,
+                              LayerCharacteristics, get_characteristics_row)
+from .unique_values import HyperLogLog
+from .utils import get_unique_values_ratio, get_ave_unique_values_ratio
+from .zones import GridZones, PolygonZones
+from ..utils import tr, raise_exception, define_help_info
+
+# HyperLogLog precision of the per-zone sketches: 1 KB per field and zone,
+# the relative standard error is about 3.3%
+ZONE_PRECISION = 10
+
+ZONE_FIELD = 'zone_id'
+
+INTEGER_COLUMNS = ('field_count', 'features_count', 'number_of_points', 'number_of_bends')
+
+STRING_COLUMNS = ('layer', 'layer_type')
+
+
+def get_zone_fields():
+    """
+    Returns the fields of the per-zone output
+    """
+
+    fields = QgsFields()
+    fields.append(QgsField(ZONE_FIELD, QVariant.LongLong))
+
+    for name in HEADER:
+        if name in STRING_COLUMNS:
+            field_type = QVariant.String
+        elif name in INTEGER_COLUMNS:
+            field_type = QVariant.LongLong
+        else:
+            field_type = QVariant.Double
+
+        fields.append(QgsField(name, field_type))
+
+    return fields
+
+
+class LayerCharacteristicsZonesAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is a class that calculates the characteristics of a layer
+    per zone (a cell of a regular grid or a polygon of a zones layer,
+    e.g. map sheets) in one pass over the features of the layer
+    """
+
+    OUTPUT = 'OUTPUT'
+    INPUT = 'INPUT'
+    ZONES = 'ZONES'
+    EXTENT = 'EXTENT'
+    CELL_SIZE = 'CELL_SIZE'
+    METRICS = 'METRICS'
+    APPROXIMATE_UNIQUE_VALUES = 'APPROXIMATE_UNIQUE_VALUES'
+    HELP_FILE = 'layer_characteristics_zones_help.txt'
+
+    def __init__(self):
+        super().__init__()
+        directory = os.path.dirname(__file__)
+        file_name = os.path.join(directory, self.HELP_FILE)
+        self._shortHelp = define_help_info(file_name)
+
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.INPUT,
+                tr('Input layer')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.ZONES,
+                tr('Zones (the grid is used if not set)'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                tr('Grid extent (the layer extent if not set)'),
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CELL_SIZE,
+                tr('Grid cell size'),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.000001,
+                defaultValue=1000.0))
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METRICS,
+                tr('Metric groups'),
+                options=[tr(option) for option in METRIC_GROUPS[:INTERSECTIONS]],
+                allowMultiple=True,
+                defaultValue=list(range(INTERSECTIONS))))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.APPROXIMATE_UNIQUE_VALUES,
+                tr('Approximate unique values (fixed memory per zone)'),
+                defaultValue=False))
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                tr('Characteristics of the zones'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
+        zones_source = self.parameterAsSource(parameters, self.ZONES, context)
+        cell_size = self.parameterAsDouble(parameters, self.CELL_SIZE, context)
+        groups = self.parameterAsEnums(parameters, self.METRICS, context)
+        approximate = self.parameterAsBoolean(parameters, self.APPROXIMATE_UNIQUE_VALUES, context)
+
+        if not layer:
+            raise_exception('can\'t get a layer')
+
+        if zones_source is not None:
+            # the zones are transformed to the layer, the features are measured in the layer CRS
+            feedback.pushInfo(tr('Reading the zones'))
+            zones = PolygonZones(zones_source, layer.crs(), context.transformContext(), feedback)
+        else:
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context, layer.crs())
+            zones = GridZones(layer.extent() if extent.isNull() else extent, cell_size)
+
+        request = QgsFeatureRequest().setFilterRect(zones.extent())
+        fields = layer.dataProvider().fields()
+        indexes = [fields.indexFromName(field.name()) for field in fields] if ATTRIBUTES in groups else []
+        request.setSubsetOfAttributes(indexes)
+
+        (sink, dest_id) = self.parameterAsSink(
+            parameters, self.OUTPUT,
+            context, get_zone_fields(),
+            QgsWkbTypes.Polygon, layer.crs()
+        )
+
+        if sink is None:
+            raise_exception('can\'t get an output')
+
+        feedback.pushInfo(tr('The algorithm is running'))
+        per_zone = self.compute_zones_characteristics(
+            layer, request, zones, groups, indexes, approximate, feedback)
+
+        if feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo(tr('Writing the zones'))
+        self.write_zones(sink, layer, len(fields), zones, per_zone, groups)
+
+        return {self.OUTPUT: dest_id}
+
+
+    def compute_zones_characteristics(self, layer, request, zones, groups, indexes, approximate, feedback):
+        """
+        Reads the features of the layer once, computes the characteristics
+        of every feature once and adds them to all zones of the feature.
+        Returns a dictionary {zone id: (LayerCharacteristics, unique values per field)}
+
+        :param layer: Vector layer
+        :param request: Feature request
+        :param zones: GridZones or PolygonZones
+        :param groups: selected metric groups
+        :param indexes: field indexes for the unique values
+        :param approximate: count the unique values with sketches
+        :param feedback: Feedback from a processing algorithm
+        """
+
+        per_zone = {}
+        read_geometry = LENGTH_AREA in groups or BENDS in groups
+        layer_features_count = layer.featureCount()
+        total = 100.0 / layer_features_count if layer_features_count > 0 else 0
+
+        for current, feature in enumerate(layer.getFeatures(request)):
+            if feedback.isCanceled():
+                break
+
+            feedback.setProgress(min(int(current * total), 100))
+
+            if not feature.hasGeometry():
+                continue
+
+            geom = feature.geometry()
+            zone_ids = zones.get_zones(geom)
+
+            if not zone_ids:
+                continue
+
+            characteristics = LayerCharacteristics()
+            characteristics.features_count = 1
+
+            if read_geometry:
+                characteristics.add_geometry(geom, groups)
+
+            attributes = feature.attributes() if indexes else None
+
+            for zone_id in zone_ids:
+                zone = per_zone.get(zone_id)
+
+                if zone is None:
+                    zone = (LayerCharacteristics(),
+                            {index: HyperLogLog(ZONE_PRECISION) if approximate else set() for index in indexes})
+                    per_zone[zone_id] = zone
+
+                zone[0].merge(characteristics)
+
+                for index in indexes:
+                    zone[1][index].add(attributes[index])
+
+        return per_zone
+
+
+    def write_zones(self, sink, layer, fields_count, zones, per_zone, groups):
+        """
+        Writes a feature with the characteristics of every zone
+
+        :param sink: Feature sink
+        :param layer: Vector layer
+        :param fields_count: the number of fields in the layer data provider
+        :param zones: GridZones or PolygonZones
+        :param per_zone: dictionary {zone id: (LayerCharacteristics, unique values per field)}
+        :param groups: selected metric groups
+        """
+
+        output_fields = get_zone_fields()
+        batch = []
+
+        for zone_id, geom in zones.zones():
+            characteristics, unique_values_per_field = per_zone.get(zone_id, (LayerCharacteristics(), {}))
+            uniq_values_number = None
+            ave_uniq_values_number = None
+
+            if ATTRIBUTES in groups:
+                uniq_values_number = get_unique_values_ratio(unique_values_per_field, characteristics.features_count)
+                ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, fields_count)
+
+            row = get_characteristics_row(
+                layer, fields_count, characteristics, groups,
+                uniq_values_number, ave_uniq_values_number)
+            feature = QgsFeature(output_fields)
+            feature.setGeometry(geom)
+            feature.setAttributes([zone_id] + [row[name] for name in HEADER])
+            batch.append(feature)
+
+            if len(batch) >= BATCH_SIZE:
+                sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                batch = []
+
+        if batch:
+            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'Compute layer characteristics by zones'
+
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return tr(self.name())
+
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return tr(self.groupId())
+
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'Map characteristics'
+
+
+    def shortHelpString(self):
+        return self._shortHelp
+
+
+    def createInstance(self):
+        return LayerCharacteristicsZonesAlgorithm()
@@ -0,0 +1,183 @@
+"""
+    Persistent cache of the per-feature characteristics for incremental re-runs
+"""
+import json
+import os
+import sqlite3
+
+from hashlib import blake2b
+
+from .characteristics import LENGTH_AREA, BENDS, LayerCharacteristics
+from ..utils import raise_exception
+
+METRICS = [
+    'count',
+    'points_num',
+    'total_length',
+    'total_polygon_area',
+    'bend_num',
+    'total_bend_area',
+    'bend_base_line_len',
+    'bend_height',
+    'bend_length',
+]
+
+INTEGER_METRICS = ('count', 'points_num', 'bend_num')
+
+# the number of changed features written to the cache at once
+WRITE_BATCH_SIZE = 10000
+
+# seconds to wait for the cache locked by another layer being written
+LOCK_TIMEOUT = 60
+
+# version of the cached metrics, caches of other versions are cleared
+VERSION = 2
+
+
+def get_cache_path(output):
+    """
+    Returns the path of the cache next to the output file
+
+    :param output: path of the output file
+    """
+
+    return '{}_cache.sqlite'.format(os.path.splitext(output)[0])
+
+
+def get_groups_mask(groups):
+    """
+    Returns the bit mask of the geometric metric groups
+
+    :param groups: selected metric groups
+    """
+
+    return sum(1 << group for group in (LENGTH_AREA, BENDS) if group in groups)
+
+
+def get_geometry_hash(geom):
+    """
+    Returns the hash of the geometry, the cached metrics depend only on it
+
+    :param geom: feature geometry
+    """
+
+    return blake2b(bytes(geom.asWkb()), digest_size=16).digest()
+
+
+class MetricsCache:
+    """
+    SQLite cache of the per-feature partial characteristics,
+    keyed by layer source, feature id and geometry hash
+    """
+
+    def __init__(self, path, source):
+        if not path:
+            raise_exception('cache path is empty')
+
+        self.source = source
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS features')
+            self.connection.execute('PRAGMA user_version = {}'.format(VERSION))
+            self.connection.commit()
+
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS features ('
+            'source TEXT NOT NULL, fid INTEGER NOT NULL, hash BLOB NOT NULL, groups INTEGER NOT NULL, '
+            '{}, parts TEXT, PRIMARY KEY (source, fid))'.format(
+                ', '.join('{} {}'.format(name, 'INTEGER' if name in INTEGER_METRICS else 'REAL')
+                          for name in METRICS)))
+        self.rows = {
+            row[0]: row[1:]
+            for row in self.connection.execute(
+                'SELECT fid, hash, groups, {}, parts FROM features WHERE source = ?'.format(', '.join(METRICS)),
+                (source,))
+            }
+        self.seen = set()
+        self.changed = []
+        self.hits = 0
+        self.misses = 0
+
+    def get_characteristics(self, feature_id, geom, groups):
+        """
+        Returns the characteristics of a feature and the bends of its parts
+        (see LayerCharacteristics.add_geometry), computes them only for
+        new or changed features
+
+        :param feature_id: feature id
+        :param geom: feature geometry
+        :param groups: selected metric groups
+        """
+
+        self.seen.add(feature_id)
+        digest = get_geometry_hash(geom)
+        mask = get_groups_mask(groups)
+        row = self.rows.get(feature_id)
+        characteristics = LayerCharacteristics()
+
+        if row is not None and row[0] == digest and row[1] & mask == mask:
+            self.hits += 1
+
+            for name, value in zip(METRICS, row[2:-1]):
+                setattr(characteristics, name, value)
+
+            parts = []
+
+            if BENDS in groups and row[-1]:
+                geometry_parts = list(geom.parts())
+                parts = [(number, geometry_parts[number], tuple(result))
+                         for number, result in json.loads(row[-1])]
+
+            return characteristics, parts
+
+        self.misses += 1
+        parts = characteristics.add_geometry(geom, groups)
+        bends = json.dumps([[number, list(result)] for number, _, result in parts]) if BENDS in groups else None
+        self.changed.append(
+            (self.source, feature_id, digest, mask) +
+            tuple(getattr(characteristics, name) for name in METRICS) +
+            (bends,))
+
+        if len(self.changed) >= WRITE_BATCH_SIZE:
+            self.write()
+
+        return characteristics, parts
+
+    def write(self):
+        """
+        Writes the new and changed features
+        """
+
+        if self.changed:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO features VALUES ({})'.format(', '.join('?' * (len(METRICS) + 5))),
+                self.changed)
+            self.connection.commit()
+            self.changed = []
+
+    def close(self, remove_missing=True):
+        """
+        Writes the changes, drops the deleted features and closes the cache
+
+        :param remove_missing: drop the cached features that were not read
+            (only when the whole layer was read)
+        """
+
+        self.write()
+
+        if remove_missing:
+            deleted = [(self.source, fid) for fid in self.rows if fid not in self.seen]
+            self.connection.executemany('DELETE FROM features WHERE source = ? AND fid = ?', deleted)
+
+        self.connection.commit()
+        self.connection.close()
+
+    def hit_ratio(self):
+        """
+        Returns the share of features taken from the cache
+        """
+
+        total = self.hits + self.misses
+
+        return self.hits / total if total else 0.0
@@ -0,0 +1,248 @@
+"""
+    Live characteristics of a layer being edited: the sums are kept per feature
+    and only the features touched by the edits are read again
+"""
+from collections import Counter
+
+from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+from qgis.core import QgsFeatureRequest
+from .attribute_stats import is_null
+from .characteristics import ATTRIBUTES, LENGTH_AREA, BENDS, LayerCharacteristics, get_characteristics_row
+from .utils import get_unique_values_ratio, get_ave_unique_values_ratio
+from ..utils import raise_exception
+
+# milliseconds without edits before the characteristics are updated
+DEBOUNCE_INTERVAL = 500
+
+
+class ValueCounter:
+    """
+    Numbers of the features with every value of a field,
+    the length is the number of distinct values
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, value):
+        self.counts[value] += 1
+
+    def remove(self, value):
+        self.counts[value] -= 1
+
+        if self.counts[value] <= 0:
+            del self.counts[value]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class LayerMonitor(QObject):
+    """
+    Keeps the characteristics of a layer up to date with its edits.
+    The edit signals only mark the features as changed, the changed features
+    are read once the edits pause for the debounce interval
+    """
+
+    changed = pyqtSignal()
+
+    def __init__(self, layer, groups=(ATTRIBUTES, LENGTH_AREA, BENDS), interval=DEBOUNCE_INTERVAL, parent=None):
+        super().__init__(parent)
+
+        if not layer:
+            raise_exception('layer is empty')
+
+        self.layer = layer
+        self.groups = [group for group in groups if group in (ATTRIBUTES, LENGTH_AREA, BENDS)]
+        self.dirty = set()
+        self.rebuild_needed = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.update)
+        self.connections = [
+            (layer.featureAdded, self.mark),
+            (layer.featureDeleted, self.mark),
+            (layer.geometryChanged, self.on_geometry_changed),
+            (layer.committedFeaturesAdded, self.on_committed_features_added),
+            (layer.afterCommitChanges, self.on_commit),
+            (layer.afterRollBack, self.schedule_rebuild),
+            (layer.subsetStringChanged, self.schedule_rebuild),
+            (layer.dataSourceChanged, self.schedule_rebuild),
+            (layer.attributeAdded, self.schedule_rebuild),
+            (layer.attributeDeleted, self.schedule_rebuild),
+            (layer.willBeDeleted, self.stop),
+        ]
+
+        if ATTRIBUTES in self.groups:
+            self.connections.append((layer.attributeValueChanged, self.on_attribute_value_changed))
+
+        for signal, slot in self.connections:
+            signal.connect(slot)
+
+        self.rebuild()
+
+    def mark(self, feature_id):
+        """
+        Marks a feature as changed and restarts the debounce timer
+
+        :param feature_id: feature id
+        """
+
+        self.dirty.add(feature_id)
+        self.timer.start()
+
+    def on_geometry_changed(self, feature_id, geometry):
+        self.mark(feature_id)
+
+    def on_attribute_value_changed(self, feature_id, index, value):
+        self.mark(feature_id)
+
+    def on_committed_features_added(self, layer_id, features):
+        for feature in features:
+            self.mark(feature.id())
+
+    def on_commit(self):
+        # the features added in the edit session had temporary negative ids
+        for feature_id in self.features:
+            if feature_id < 0:
+                self.mark(feature_id)
+
+    def schedule_rebuild(self):
+        self.rebuild_needed = True
+        self.timer.start()
+
+    def get_indexes(self):
+        """
+        Returns the indexes of the fields whose values are counted
+        """
+
+        return list(range(len(self.layer.fields()))) if ATTRIBUTES in self.groups else []
+
+    def get_request(self):
+        """
+        Returns the feature request of the selected groups
+        """
+
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes(self.indexes)
+
+        if LENGTH_AREA not in self.groups and BENDS not in self.groups:
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+
+        return request
+
+    def rebuild(self):
+        """
+        Reads all features of the layer again
+        """
+
+        self.timer.stop()
+        self.dirty = set()
+        self.rebuild_needed = False
+        self.indexes = self.get_indexes()
+        # {feature id: (LayerCharacteristics of the feature, values of the fields)}
+        self.features = {}
+        self.characteristics = LayerCharacteristics()
+        self.values = {index: ValueCounter() for index in self.indexes}
+
+        for feature in self.layer.getFeatures(self.get_request()):
+            self.add(feature)
+
+        self.changed.emit()
+
+    def update(self):
+        """
+        Reads again the features changed since the last update
+        """
+
+        if self.rebuild_needed:
+            self.rebuild()
+            return
+
+        feature_ids, self.dirty = self.dirty, set()
+
+        if not feature_ids:
+            return
+
+        for feature_id in feature_ids:
+            self.remove(feature_id)
+
+        # the deleted features are not found, the others are added back with their new state
+        for feature in self.layer.getFeatures(self.get_request().setFilterFids(list(feature_ids))):
+            self.add(feature)
+
+        self.changed.emit()
+
+    def add(self, feature):
+        """
+        Adds a feature to the sums
+
+        :param feature: feature of the layer
+        """
+
+        characteristics = LayerCharacteristics()
+        characteristics.features_count = 1
+
+        if (LENGTH_AREA in self.groups or BENDS in self.groups) and feature.hasGeometry():
+            characteristics.add_geometry(feature.geometry(), self.groups)
+
+        attributes = feature.attributes()
+        # NULL values are unhashable QVariants, they are counted as None
+        values = [None if is_null(attributes[index]) else attributes[index] for index in self.indexes]
+
+        for index, value in zip(self.indexes, values):
+            self.values[index].add(value)
+
+        self.characteristics.merge(characteristics)
+        self.features[feature.id()] = (characteristics, values)
+
+    def remove(self, feature_id):
+        """
+        Removes a feature from the sums
+
+        :param feature_id: feature id
+        """
+
+        stored = self.features.pop(feature_id, None)
+
+        if stored is None:
+            return
+
+        characteristics, values = stored
+        self.characteristics.subtract(characteristics)
+
+        for index, value in zip(self.indexes, values):
+            self.values[index].remove(value)
+
+    def get_row(self):
+        """
+        Returns the row of the characteristics like the layer characteristics algorithm
+        """
+
+        uniq_values_number = None
+        ave_uniq_values_number = None
+        fields_count = len(self.layer.fields())
+
+        if ATTRIBUTES in self.groups:
+            uniq_values_number = get_unique_values_ratio(self.values, self.characteristics.features_count)
+            ave_uniq_values_number = get_ave_unique_values_ratio(uniq_values_number, fields_count)
+
+        return get_characteristics_row(
+            self.layer, fields_count, self.characteristics, self.groups,
+            uniq_values_number, ave_uniq_values_number)
+
+    def stop(self):
+        """
+        Disconnects from the layer
+        """
+
+        self.timer.stop()
+
+        for signal, slot in self.connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+
+        self.connections = []
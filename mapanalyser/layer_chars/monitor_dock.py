@@ -0,0 +1,78 @@
+"""
+    Dock with the live characteristics of the selected vector layer
+"""
+from qgis.PyQt.QtWidgets import QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget, QHeaderView
+from qgis.core import QgsMapLayerProxyModel
+from qgis.gui import QgsDockWidget, QgsMapLayerComboBox
+from .characteristics import HEADER
+from .monitor import LayerMonitor
+from ..utils import tr
+
+
+class LayerMonitorDock(QgsDockWidget):
+    """
+    Shows the characteristics of a layer updated as the layer is edited
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(tr('Layer characteristics monitor'), parent)
+        self.setObjectName('MapAnalyserLayerMonitor')
+        self.monitor = None
+        self.layer_box = QgsMapLayerComboBox()
+        self.layer_box.setFilters(QgsMapLayerProxyModel.VectorLayer)
+        self.layer_box.setAllowEmptyLayer(True)
+        self.layer_box.setLayer(None)
+        self.table = QTableWidget(len(HEADER), 1)
+        self.table.setVerticalHeaderLabels(HEADER)
+        self.table.horizontalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.addWidget(self.layer_box)
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+        self.layer_box.layerChanged.connect(self.set_layer)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def set_layer(self, layer):
+        """
+        Starts monitoring the layer
+
+        :param layer: vector layer or None
+        """
+
+        self.stop()
+
+        if layer is not None and self.isVisible():
+            self.monitor = LayerMonitor(layer, parent=self)
+            self.monitor.changed.connect(self.refresh)
+
+        self.refresh()
+
+    def on_visibility_changed(self, visible):
+        # a hidden dock doesn't follow the edits
+        if visible and self.monitor is None:
+            self.set_layer(self.layer_box.currentLayer())
+        elif not visible:
+            self.stop()
+
+    def refresh(self):
+        """
+        Shows the current characteristics
+        """
+
+        row = self.monitor.get_row() if self.monitor is not None else {}
+
+        for number, name in enumerate(HEADER):
+            value = row.get(name)
+            self.table.setItem(number, 0, QTableWidgetItem('' if value is None else str(value)))
+
+    def stop(self):
+        """
+        Stops monitoring the current layer
+        """
+
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor.deleteLater()
+            self.monitor = None
@@ -0,0 +1,116 @@
+"""
+    Pipelined processing of the layers of a workspace: reader threads compute
+    the characteristics of the next layers while the current one is finished
+"""
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from ..utils import raise_exception
+
+
+def get_default_threads():
+    """
+    Returns the default number of reader threads
+    """
+
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class WorkerFeedback:
+    """
+    Feedback of a reader thread: forwards the cancellation and keeps the
+    messages, they are pushed to the algorithm log in the order of the layers
+    """
+
+    def __init__(self, feedback):
+        self.feedback = feedback
+        self.messages = []
+        self.progress = 0
+
+    def isCanceled(self):
+        return self.feedback.isCanceled()
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+    def pushInfo(self, info):
+        self.messages.append(info)
+
+    def flush(self):
+        """
+        Pushes the collected messages to the algorithm log
+        """
+
+        for message in self.messages:
+            self.feedback.pushInfo(message)
+
+        self.messages = []
+
+
+class LockedSink:
+    """
+    Feature sink shared by the reader threads
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.lock = Lock()
+
+    def addFeatures(self, features, flags=None):
+        with self.lock:
+            if flags is None:
+                return self.sink.addFeatures(features)
+
+            return self.sink.addFeatures(features, flags)
+
+
+def ordered_map(function, items, threads, feedback):
+    """
+    Applies the function to the items in a bounded pool of threads.
+    Yields (item, result, WorkerFeedback) in the order of the items,
+    at most 2 * threads items are read ahead of the consumer
+
+    :param function: function(item, feedback) run in a reader thread
+    :param items: list of items (e.g. layer names)
+    :param threads: the number of reader threads
+    :param feedback: Feedback from a processing algorithm
+    """
+
+    if threads < 1:
+        raise_exception('the number of threads must be positive')
+
+    items = list(items)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        def submit(item):
+            worker_feedback = WorkerFeedback(feedback)
+            pending.append((item, executor.submit(function, item, worker_feedback), worker_feedback))
+
+        queue = iter(items)
+
+        for item in queue:
+            submit(item)
+
+            if len(pending) >= 2 * threads:
+                break
+
+        while pending:
+            item, future, worker_feedback = pending.popleft()
+
+            try:
+                result = future.result()
+            except Exception:
+                for _, other, _ in pending:
+                    other.cancel()
+                raise
+
+            if not feedback.isCanceled():
+                for next_item in queue:
+                    submit(next_item)
+                    break
+
+            yield item, result, worker_feedback
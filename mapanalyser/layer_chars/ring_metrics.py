@@ -0,0 +1,138 @@
+"""
+    Vectorized length, area and bends of geometries stored as ragged arrays:
+    coordinates of all rings one after another and the offsets of rings and parts
+"""
+import numpy
+
+from .characteristics import LENGTH_AREA, BENDS, sum_bends
+from .utils import get
+
+
+def pack_parts(features_parts):
+    """
+    Packs the parts of features into ragged arrays.
+    Returns (coords, ring_offsets, part_offsets, part_polygons)
+
+    :param features_parts: list of lists of (is polygon, list of rings)
+    """
+
+    rings = []
+    ring_offsets = [0]
+    part_offsets = [0]
+    part_polygons = []
+
+    for parts in features_parts:
+        for is_polygon, part_rings in parts:
+            for ring in part_rings:
+                rings.append(ring)
+                ring_offsets.append(ring_offsets[-1] + len(ring))
+
+            part_offsets.append(len(ring_offsets) - 1)
+            part_polygons.append(is_polygon)
+
+    coords = numpy.concatenate(rings) if rings else numpy.empty((0, 2))
+
+    return (coords,
+            numpy.array(ring_offsets, numpy.int64),
+            numpy.array(part_offsets, numpy.int64),
+            numpy.array(part_polygons, numpy.bool_))
+
+
+def get_ring_metrics(coords, ring_offsets):
+    """
+    Returns the lengths and the signed shoelace areas of all rings
+
+    :param coords: (n, 2) coordinates of the rings
+    :param ring_offsets: the first point of every ring and the end
+    """
+
+    coords = numpy.asarray(coords, numpy.float64)
+    x = coords[:, 0]
+    y = coords[:, 1]
+    # the segments between the last point of a ring and the first point of the next one are dropped
+    valid = numpy.ones(max(len(coords) - 1, 0), numpy.bool_)
+    boundaries = ring_offsets[1:-1] - 1
+    valid[boundaries[(boundaries >= 0) & (boundaries < len(valid))]] = False
+    segments = numpy.where(valid, numpy.hypot(numpy.diff(x), numpy.diff(y)), 0.0)
+    cross = numpy.where(valid, x[:-1] * y[1:] - x[1:] * y[:-1], 0.0)
+    cumulative_length = numpy.concatenate(([0.0], numpy.cumsum(segments)))
+    cumulative_cross = numpy.concatenate(([0.0], numpy.cumsum(cross)))
+    last = len(cumulative_length) - 1
+    starts = numpy.minimum(ring_offsets[:-1], last)
+    # the last segment of a ring ends at its last point
+    ends = numpy.clip(ring_offsets[1:] - 1, starts, last)
+
+    return (cumulative_length[ends] - cumulative_length[starts],
+            (cumulative_cross[ends] - cumulative_cross[starts]) / 2)
+
+
+def get_part_metrics(coords, ring_offsets, part_offsets, part_polygons):
+    """
+    Returns the lengths (perimeters of polygons), the areas
+    (the exterior ring without the holes) and the numbers of points of all parts
+
+    :param coords: (n, 2) coordinates of the rings
+    :param ring_offsets: the first point of every ring and the end
+    :param part_offsets: the first ring of every part and the end
+    :param part_polygons: the part is a polygon
+    """
+
+    ring_lengths, ring_areas = get_ring_metrics(coords, ring_offsets)
+    ring_areas = numpy.abs(ring_areas)
+    parts_number = len(part_offsets) - 1
+    ring_parts = numpy.repeat(numpy.arange(parts_number), numpy.diff(part_offsets))
+    exterior = numpy.zeros(len(ring_areas), numpy.bool_)
+    exterior[part_offsets[:-1][numpy.diff(part_offsets) > 0]] = True
+    lengths = numpy.bincount(ring_parts, ring_lengths, parts_number)
+    areas = numpy.bincount(ring_parts, numpy.where(exterior, ring_areas, -ring_areas), parts_number)
+    areas = numpy.where(part_polygons, areas, 0.0)
+    points = ring_offsets[part_offsets[1:]] - ring_offsets[part_offsets[:-1]]
+
+    return lengths, areas, points
+
+
+def get_rings_bends(coords, ring_offsets, first_ring, end_ring):
+    """
+    Returns the bends of a part as the sum of the bends of its rings,
+    the rings are not joined into one line
+
+    :param coords: (n, 2) coordinates of the rings
+    :param ring_offsets: the first point of every ring and the end
+    :param first_ring: the first ring of the part
+    :param end_ring: the ring after the last ring of the part
+    """
+
+    return sum_bends(get(coords[ring_offsets[ring]:ring_offsets[ring + 1]].tolist())
+                     for ring in range(first_ring, end_ring))
+
+
+def add_ragged(characteristics, coords, ring_offsets, part_offsets, part_polygons, groups, parts=None):
+    """
+    Adds the parts stored as ragged arrays the same way LayerCharacteristics.add_geometry does
+
+    :param characteristics: LayerCharacteristics
+    :param coords: (n, 2) coordinates of the rings
+    :param ring_offsets: the first point of every ring and the end
+    :param part_offsets: the first ring of every part and the end
+    :param part_polygons: the part is a polygon
+    :param groups: selected metric groups
+    :param parts: optional array of the indexes of the parts to add
+    """
+
+    lengths, areas, points = get_part_metrics(coords, ring_offsets, part_offsets, part_polygons)
+
+    if parts is None:
+        parts = numpy.arange(len(points))
+
+    if LENGTH_AREA in groups:
+        characteristics.total_length += float(lengths[parts].sum())
+        characteristics.total_polygon_area += float(areas[parts].sum())
+
+    counted = parts[points[parts] >= 3]
+    characteristics.count += len(counted)
+    characteristics.points_num += int(points[counted].sum())
+
+    if BENDS in groups:
+        for part in counted:
+            characteristics.add_part(
+                get_rings_bends(coords, ring_offsets, part_offsets[part], part_offsets[part + 1]))
@@ -0,0 +1,274 @@
+"""
+    Sampling of features for approximate layer characteristics
+"""
+import os
+
+from math import sqrt
+from random import Random
+
+from qgis.core import QgsFeatureRequest, QgsRectangle
+from .characteristics import LayerCharacteristics
+from ..utils import raise_exception
+
+NO_SAMPLING = 0
+RANDOM = 1
+STRATIFIED = 2
+
+SAMPLING_METHODS = [
+    'No sampling (all features)',
+    'Random sample',
+    'Spatially stratified sample',
+]
+
+# 95 % confidence intervals
+Z_SCORE = 1.96
+
+TOTALS = [
+    ('total_length', 'total_length'),
+    ('number_of_points', 'points_num'),
+    ('number_of_bends', 'bend_num'),
+    ('total_polygons_area', 'total_polygon_area'),
+    ('total_bends_area', 'total_bend_area'),
+]
+
+RATIOS = [
+    ('average_area_of_bends', 'total_bend_area', 'bend_num'),
+    ('average_length_of_bends_baseline', 'bend_base_line_len', 'bend_num'),
+    ('average_height_of_bends', 'bend_height', 'bend_num'),
+    ('average_length_of_the_bends', 'bend_length', 'bend_num'),
+    ('average_polygons_area', 'total_polygon_area', 'count'),
+    ('average_length', 'total_length', 'count'),
+]
+
+CONFIDENCE_HEADER = ['layer', 'characteristic', 'estimate', 'ci_low', 'ci_high', 'sample_size', 'features_count']
+
+
+def get_random_strata(feature_ids, sample_size, seed):
+    """
+    Draws a reproducible simple random sample of feature ids.
+    Returns a list with one stratum: (population ids, sample ids)
+
+    :param feature_ids: ids of all features
+    :param sample_size: the number of features in the sample
+    :param seed: random seed
+    """
+
+    sample = Random(seed).sample(feature_ids, min(sample_size, len(feature_ids)))
+
+    return [(feature_ids, sample)]
+
+
+def get_stratified_strata(layer, extent, sample_size, seed):
+    """
+    Draws a reproducible spatially stratified sample of feature ids.
+    The extent is split into a regular grid, each cell is a stratum and
+    gets a share of the sample proportional to the number of its features
+
+    :param layer: Vector layer
+    :param extent: extent of the sample
+    :param sample_size: the number of features in the sample
+    :param seed: random seed
+    """
+
+    if not layer:
+        raise_exception('layer is empty')
+
+    extent = extent if extent is not None else layer.extent()
+    cells_number = min(10, max(1, int(sqrt(sample_size / 10))))
+    width = extent.width() / cells_number
+    height = extent.height() / cells_number
+    seen = set()
+    strata = []
+
+    for row in range(cells_number):
+        for column in range(cells_number):
+            cell = QgsRectangle(
+                extent.xMinimum() + column * width,
+                extent.yMinimum() + row * height,
+                extent.xMinimum() + (column + 1) * width,
+                extent.yMinimum() + (row + 1) * height)
+            request = QgsFeatureRequest().setFilterRect(cell)
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setNoAttributes()
+            ids = [feature.id() for feature in layer.getFeatures(request) if feature.id() not in seen]
+            seen.update(ids)
+
+            if ids:
+                strata.append(ids)
+
+    population = len(seen)
+    rng = Random(seed)
+    result = []
+
+    if not population:
+        return result
+
+    for ids in strata:
+        size = max(min(2, len(ids)), int(round(sample_size * len(ids) / population)))
+        result.append((ids, rng.sample(ids, min(size, len(ids)))))
+
+    return result
+
+
+def get_sample_strata(layer, extent, feature_ids, method, sample_size, seed):
+    """
+    Draws the sample for the sampling method
+
+    :param layer: Vector layer
+    :param extent: extent of the sample or None for the whole layer
+    :param feature_ids: ids of all features in the extent
+    :param method: RANDOM or STRATIFIED
+    :param sample_size: the number of features in the sample
+    :param seed: random seed
+    """
+
+    if method == STRATIFIED:
+        return get_stratified_strata(layer, extent, sample_size, seed)
+
+    return get_random_strata(feature_ids, sample_size, seed)
+
+
+def compute_sample_characteristics(layer, strata, groups, feedback):
+    """
+    Computes the characteristics of every sampled feature.
+    Returns a list of (population size, list of LayerCharacteristics) per stratum
+
+    :param layer: Vector layer
+    :param strata: list of (population ids, sample ids)
+    :param groups: selected metric groups
+    :param feedback: Feedback from a processing algorithm
+    """
+
+    sample = {}
+
+    for index, (_, ids) in enumerate(strata):
+        for fid in ids:
+            sample[fid] = index
+
+    per_stratum = [[] for _ in strata]
+    request = QgsFeatureRequest().setFilterFids(list(sample))
+    request.setNoAttributes()
+    total = 100.0 / len(sample) if sample else 0
+
+    for current, feature in enumerate(layer.getFeatures(request)):
+        if feedback.isCanceled():
+            break
+
+        characteristics = LayerCharacteristics()
+        characteristics.features_count = 1
+
+        if feature.hasGeometry():
+            characteristics.add_geometry(feature.geometry(), groups)
+
+        per_stratum[sample[feature.id()]].append(characteristics)
+        feedback.setProgress(int(current * total))
+
+    return [(len(ids), values) for (ids, _), values in zip(strata, per_stratum)]
+
+
+def get_variance(samples, value):
+    """
+    Returns the variance of the stratified estimate of a total
+
+    :param samples: list of (population size, list of LayerCharacteristics)
+    :param value: function of LayerCharacteristics
+    """
+
+    variance = 0.0
+
+    for population, values in samples:
+        size = len(values)
+
+        if size < 2 or population <= size:
+            continue
+
+        numbers = [value(v) for v in values]
+        mean = sum(numbers) / size
+        s2 = sum((number - mean) ** 2 for number in numbers) / (size - 1)
+        variance += population * population * (1 - size / population) * s2 / size
+
+    return variance
+
+
+def estimate_total(samples, name):
+    """
+    Returns the stratified estimate of a total and its confidence interval
+
+    :param samples: list of (population size, list of LayerCharacteristics)
+    :param name: name of the LayerCharacteristics sum
+    """
+
+    total = sum(population * sum(getattr(v, name) for v in values) / len(values)
+                for population, values in samples if values)
+    margin = Z_SCORE * sqrt(get_variance(samples, lambda v: getattr(v, name)))
+
+    return total, total - margin, total + margin
+
+
+def estimate_ratio(samples, numerator, denominator):
+    """
+    Returns the ratio estimate of two totals and its (linearized) confidence interval
+
+    :param samples: list of (population size, list of LayerCharacteristics)
+    :param numerator: name of the numerator sum
+    :param denominator: name of the denominator sum
+    """
+
+    total_x = estimate_total(samples, denominator)[0]
+
+    if not total_x:
+        return 0.0, 0.0, 0.0
+
+    ratio = estimate_total(samples, numerator)[0] / total_x
+    variance = get_variance(samples, lambda v: getattr(v, numerator) - ratio * getattr(v, denominator))
+    margin = Z_SCORE * sqrt(variance) / total_x
+
+    return ratio, ratio - margin, ratio + margin
+
+
+def estimate_characteristics(samples):
+    """
+    Builds the estimated characteristics of the whole layer
+    and the confidence intervals of the estimates.
+    Returns LayerCharacteristics and a dictionary {characteristic: (estimate, low, high)}
+
+    :param samples: list of (population size, list of LayerCharacteristics)
+    """
+
+    characteristics = LayerCharacteristics()
+    characteristics.features_count = sum(population for population, _ in samples)
+    samples = [(population, values) for population, values in samples if values]
+    intervals = {}
+
+    for name in vars(characteristics):
+        if name == 'features_count':
+            continue
+
+        estimate = estimate_total(samples, name)[0] if samples else 0.0
+        setattr(characteristics, name, estimate)
+
+    for name in ('count', 'points_num', 'bend_num'):
+        setattr(characteristics, name, int(round(getattr(characteristics, name))))
+
+    if not samples:
+        return characteristics, intervals
+
+    for characteristic, name in TOTALS:
+        intervals[characteristic] = estimate_total(samples, name)
+
+    for characteristic, numerator, denominator in RATIOS:
+        intervals[characteristic] = estimate_ratio(samples, numerator, denominator)
+
+    return characteristics, intervals
+
+
+def get_confidence_path(output):
+    """
+    Returns the path of the file with the confidence intervals
+
+    :param output: path of the output file
+    """
+
+    base, extension = os.path.splitext(output)
+
+    return '{}_confidence{}'.format(base, extension or '.csv')
@@ -0,0 +1,276 @@
+"""
+    Methods of counting unique attribute values of the layer
+"""
+import os
+import sqlite3
+
+from hashlib import blake2b
+from math import log, sqrt
+
+from qgis.core import QgsDataSourceUri, QgsProviderRegistry
+from .attribute_stats import compute_field_statistics
+from .utils import quote_identifier
+from ..utils import raise_exception, tr
+
+EXACT = 0
+PROVIDER = 1
+APPROXIMATE = 2
+COLUMNAR = 3
+
+UNIQUE_VALUES_METHODS = [
+    'Exact (all values in memory)',
+    'Data provider (SQL COUNT(DISTINCT) or provider query)',
+    'Approximate (HyperLogLog sketch)',
+    'Columnar (numpy, with NULL ratio and entropy per field)',
+]
+
+
+class HyperLogLog:
+    """
+    Fixed-memory cardinality sketch (HyperLogLog)
+
+    Uses 2 ** precision one-byte registers per field, the relative
+    standard error of the estimate is 1.04 / sqrt(2 ** precision)
+    """
+
+    def __init__(self, precision=14):
+        if precision < 4 or precision > 16:
+            raise_exception('precision must be between 4 and 16')
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+
+    def add(self, value):
+        """
+        Adds a value to the sketch
+
+        :param value: attribute value
+        """
+
+        digest = blake2b(repr(value).encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        """
+        Returns the estimated number of distinct values
+        """
+
+        raw = self.alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+
+        if raw <= 2.5 * self.size and zeros:
+            return self.size * log(self.size / zeros)
+
+        return raw
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+
+def get_standard_error(precision=14):
+    """
+    Returns the relative standard error of the HyperLogLog estimate
+
+    :param precision: the number of index bits of the sketch
+    """
+
+    return 1.04 / sqrt(1 << precision)
+
+
+def get_distinct_counts_sql(table, names, where=''):
+    """
+    Builds a query counting distinct values per column,
+    NULL is counted as one more value the same way the exact method does
+
+    :param table: quoted table name
+    :param names: column names
+    :param where: optional WHERE clause
+    """
+
+    columns = [
+        'COUNT(DISTINCT {0}) + CASE WHEN COUNT(*) > COUNT({0}) THEN 1 ELSE 0 END'.format(quote_identifier(name))
+        for name in names
+        ]
+
+    return 'SELECT {} FROM {}{}'.format(', '.join(columns), table, where)
+
+
+def get_gpkg_distinct_counts(layer, names, extent):
+    """
+    Counts distinct values in a GeoPackage table with sqlite,
+    the extent is filtered through the GPKG R-tree index
+
+    :param layer: Vector layer
+    :param names: field names
+    :param extent: extent or None
+    """
+
+    parts = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())
+    path = parts.get('path')
+    table = parts.get('layerName')
+
+    if not path or not table or not path.lower().endswith('.gpkg') or not os.path.isfile(path):
+        return None
+
+    subset = layer.subsetString()
+
+    if subset.strip().lower().startswith('select'):
+        return None
+
+    conditions = ['({})'.format(subset)] if subset else []
+    connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+
+    try:
+        if extent is not None:
+            row = connection.execute(
+                'SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?',
+                (table,)).fetchone()
+
+            if not row:
+                return None
+
+            rtree = 'rtree_{}_{}'.format(table, row[0])
+            exists = connection.execute(
+                'SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = ?',
+                (rtree,)).fetchone()
+
+            if not exists:
+                return None
+
+            conditions.append(
+                'rowid IN (SELECT id FROM {} WHERE minx <= {!r} AND maxx >= {!r} '
+                'AND miny <= {!r} AND maxy >= {!r})'.format(
+                    quote_identifier(rtree),
+                    extent.xMaximum(), extent.xMinimum(),
+                    extent.yMaximum(), extent.yMinimum()))
+
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        sql = get_distinct_counts_sql(quote_identifier(table), names, where)
+
+        return list(connection.execute(sql).fetchone())
+    finally:
+        connection.close()
+
+
+def get_postgres_distinct_counts(layer, names, extent):
+    """
+    Counts distinct values in a PostGIS table with SQL COUNT(DISTINCT)
+
+    :param layer: Vector layer
+    :param names: field names
+    :param extent: extent or None
+    """
+
+    uri = QgsDataSourceUri(layer.source())
+
+    if not uri.table() or uri.table().startswith('('):
+        return None
+
+    table = '{}.{}'.format(quote_identifier(uri.schema() or 'public'), quote_identifier(uri.table()))
+    conditions = ['({})'.format(uri.sql())] if uri.sql() else []
+
+    if layer.subsetString() and layer.subsetString() != uri.sql():
+        conditions.append('({})'.format(layer.subsetString()))
+
+    if extent is not None:
+        if not uri.geometryColumn():
+            return None
+
+        conditions.append('{} && ST_MakeEnvelope({!r}, {!r}, {!r}, {!r}, {})'.format(
+            quote_identifier(uri.geometryColumn()),
+            extent.xMinimum(), extent.yMinimum(),
+            extent.xMaximum(), extent.yMaximum(),
+            layer.crs().postgisSrid()))
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    metadata = QgsProviderRegistry.instance().providerMetadata('postgres')
+    connection = metadata.createConnection(uri.uri(False), {})
+    rows = connection.executeSql(get_distinct_counts_sql(table, names, where))
+
+    return [int(value) for value in rows[0]] if rows else None
+
+
+def get_provider_unique_values(layer, indexes, extent=None):
+    """
+    Pushes the distinct counts down to the data source.
+    Returns a dictionary {field index: number of unique values}
+    or None if the counts can't be computed for this layer and extent
+
+    :param layer: Vector layer
+    :param indexes: field indexes
+    :param extent: filter extent or None for the whole layer
+    """
+
+    if not layer:
+        raise_exception('layer is empty')
+
+    fields = layer.dataProvider().fields()
+    names = [fields.at(index).name() for index in indexes]
+
+    if extent is not None and extent.contains(layer.extent()):
+        extent = None
+
+    counts = None
+
+    try:
+        if layer.providerType() == 'ogr':
+            counts = get_gpkg_distinct_counts(layer, names, extent)
+        elif layer.providerType() == 'postgres':
+            counts = get_postgres_distinct_counts(layer, names, extent)
+    except Exception:
+        counts = None
+
+    if counts is not None:
+        return {index: int(count) for index, count in zip(indexes, counts)}
+
+    if extent is None and not layer.subsetString():
+        provider = layer.dataProvider()
+        return {index: len(provider.uniqueValues(index)) for index in indexes}
+
+    return None
+
+
+def create_unique_values_per_field(layer, indexes, method, extent=None, feedback=None):
+    """
+    Prepares the unique values of the fields for the chosen method.
+    Returns a dictionary with per-field sets, sketches or ready distinct counts
+    and a flag telling whether the values must be collected from the features
+
+    :param layer: Vector layer
+    :param indexes: field indexes
+    :param method: EXACT, PROVIDER, APPROXIMATE or COLUMNAR
+    :param extent: filter extent or None for the whole layer
+    :param feedback: Feedback from a processing algorithm
+    """
+
+    if method == PROVIDER:
+        counts = get_provider_unique_values(layer, indexes, extent)
+
+        if counts is not None:
+            return counts, False
+
+        if feedback:
+            feedback.pushInfo(tr('Distinct counts can\'t be pushed down to the data provider, '
+                                 'counting unique values exactly'))
+
+    if method == COLUMNAR:
+        statistics = compute_field_statistics(layer, indexes, extent, feedback)
+
+        return {index: field_statistics.distinct for index, field_statistics in statistics.items()}, False
+
+    if method == APPROXIMATE:
+        if feedback:
+            feedback.pushInfo(tr('Approximate unique values, relative standard error {:.2%}').format(
+                get_standard_error()))
+
+        return {key: HyperLogLog() for key in indexes}, True
+
+    return {key: set() for key in indexes}, True
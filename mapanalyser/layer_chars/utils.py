@@ -118,36 +118,40 @@ def base_line_length(bend):
             (bend[count - 1][1] - bend[0][1]) ** 2)
 
 
-def peak_index(bend):
+def peak_index(bend, start=0, end=None):
     """
     Finds the peak of a bend
 
     :param bend: point representation of a bend
+        (or a line, then the bend is line[start:end + 1])
+    :param start: index of the first point of the bend
+    :param end: index of the last point of the bend
     """
 
-    count = len(bend)
+    end = len(bend) - 1 if end is None else end
+    count = end - start + 1
 
     if count < 3:
         return 0
 
-    begin = bend[0]
-    end = bend[count - 1]
+    begin = bend[start]
+    last = bend[end]
     index = 0
     max_sum = 0
-    i = 0
+    i = start
 
-    while i < count - 1:
+    while i < end:
         temp_sum = (sqrt(pow((bend[i][0] - begin[0]), 2) +
                         pow((bend[i][1] - begin[1]), 2)) +
-                    sqrt(pow((bend[i][0] - end[0]), 2) +
-                        pow((bend[i][1] - end[1]), 2)))
+                    sqrt(pow((bend[i][0] - last[0]), 2) +
+                        pow((bend[i][1] - last[1]), 2)))
         i = i + 1
 
         if not temp_sum > max_sum:
             continue
 
         max_sum = temp_sum
-        index = i - 1
+        index = i - 1 - start
 
     return index
 
@@ -168,31 +172,35 @@ def cos_angle(u, v, w):
     return cos
 
 
-def height(bend):
+def height(bend, start=0, end=None):
     """
     Returns the height of the bend
 
     :param bend: point representation of a bend
+        (or a line, then the bend is line[start:end + 1])
+    :param start: index of the first point of the bend
+    :param end: index of the last point of the bend
     """
 
-    count = len(bend)
+    end = len(bend) - 1 if end is None else end
+    count = end - start + 1
 
     if count < 3:
         return 0
 
-    a = bend[count - 1][1] - bend[0][1]
-    b = bend[0][0] - bend[count - 1][0]
+    a = bend[end][1] - bend[start][1]
+    b = bend[start][0] - bend[end][0]
     epsilon = 0.001
 
     if fabs(a) < epsilon and fabs(b) < epsilon:
         if count ==3:
             return 0
 
-        a = bend[count - 2][1] - bend[0][1]
-        b = bend[0][0] - bend[count - 2][0]
+        a = bend[end - 1][1] - bend[start][1]
+        b = bend[start][0] - bend[end - 1][0]
 
-    c = bend[0][1] * (-1) * b - bend[0][0] * a
-    peakIndex = peak_index(bend)
+    c = bend[start][1] * (-1) * b - bend[start][0] * a
+    peakIndex = start + peak_index(bend, start, end)
 
     return fabs(a * bend[peakIndex][0] +
                 b * bend[peakIndex][1] + c) / sqrt(a * a + b * b)
@@ -205,6 +213,13 @@ def get(line):
     the average area of bends, the average length of baselines,
     the average height of bends, the average length of the bends
 
+    A bend is a run of points turning to the same side, extended while the
+    line goes on almost straight and moves away from the start of the bend.
+    The bends are walked in one pass over the line: the length, the area
+    (shoelace sum) and the baseline of a bend are updated as it grows and
+    consecutive bends share only their last segment, so the line is
+    processed in linear time
+
     :param line: a feature with a type equal to QgsWkbTypes.LineGeometry
     """
 
@@ -222,43 +237,48 @@ def get(line):
     i = 0
 
     while i < points_number - 2:
-        bend =[]
+        begin = line[i]
         bend_orient = orientation(line[i], line[i + 1], line[i + 2])
-        bend.append(line[i])
-        bend.append(line[i + 1])
-        bend.append(line[i + 2])
+        length = distance(line[i], line[i + 1]) + distance(line[i + 1], line[i + 2])
+        shoelace = ((line[i][0] + line[i + 1][0]) * (line[i][1] - line[i + 1][1]) +
+                    (line[i + 1][0] + line[i + 2][0]) * (line[i + 1][1] - line[i + 2][1]))
         index = i + 3
 
         while index < points_number:
-            count = len(bend)
+            p0 = line[index - 1]
             p1 = line[index]
-            orient = orientation(bend[count - 2],bend[count - 1], p1)
 
-            if orient != bend_orient:
+            if orientation(line[index - 2], p0, p1) != bend_orient:
                 break
 
-            bend.append(p1)
+            length += distance(p0, p1)
+            shoelace += (p0[0] + p1[0]) * (p0[1] - p1[1])
             index += 1
 
         index -= 1
+        base_line = sqrt((line[index][0] - begin[0]) ** 2 + (line[index][1] - begin[1]) ** 2)
 
         while index < points_number - 1 :
-            if (cos_angle(line[index - 1], line[index], line[index + 1]) > 0.9 and
-                    pow(base_line_length(bend), 2) < pow(line[i][0] - line[index + 1][0], 2) +
-                        pow(line[i][1] - line[index + 1][1], 2)):
+            p0 = line[index]
+            p1 = line[index + 1]
+            next_base_line = pow(begin[0] - p1[0], 2) + pow(begin[1] - p1[1], 2)
+
+            if (cos_angle(line[index - 1], p0, p1) > 0.9 and
+                    pow(base_line, 2) < next_base_line):
                 index += 1
-                bend.append(line[index])
+                length += distance(p0, p1)
+                shoelace += (p0[0] + p1[0]) * (p0[1] - p1[1])
+                base_line = sqrt(next_base_line)
             else:
                 break
 
-        index -= 1
-        i = index
+        shoelace += (line[index][0] + begin[0]) * (line[index][1] - begin[1])
         bend_number += 1
-        ave_bend_length += bend_length(bend)
-        ave_bend_base_line_length += base_line_length(bend)
-        ave_bend_height += height(bend)
-        ave_bend_area += bend_area(bend)
-        bend.clear()
+        ave_bend_length += length
+        ave_bend_base_line_length += base_line
+        ave_bend_height += height(line, i, index)
+        ave_bend_area += fabs(shoelace / 2)
+        i = index - 1
 
     if bend_number > 0 :
         return (
@@ -308,7 +328,7 @@ def update_unique_values(feature, indexes, unique_values_per_field):
 
     :param feature: the feature of the layer
     :param indexes: field indexes
-    :param unique_values_per_field: dictionary of sets with unique values
+    :param unique_values_per_field: dictionary of sets (or sketches) with unique values
     """
 
     if not feature:
@@ -330,7 +350,8 @@ def get_unique_values_ratio(unique_values_per_field, feature_count):
     """
     This method calculates the ratio of unique values
 
-    :param unique_values_per_field: dictionary of sets with unique values
+    :param unique_values_per_field: dictionary of sets (or sketches) with unique values
+        or of the numbers of unique values
     :param feature_count: the number of features in the layer
     """
 
@@ -338,7 +359,7 @@ def get_unique_values_ratio(unique_values_per_field, feature_count):
 
     if feature_count:
         for value in unique_values_per_field.values():
-            unique_values_ratio += len(value)
+            unique_values_ratio += value if isinstance(value, int) else len(value)
 
         unique_values_ratio = round(unique_values_ratio / feature_count, 3)
 
@@ -359,3 +380,13 @@ def get_ave_unique_values_ratio(unique_values_ratio, fields_count):
         unique_values_ratio_by_fields_count = round(unique_values_ratio / fields_count, 3)
 
     return unique_values_ratio_by_fields_count
+
+
+def quote_identifier(name):
+    """
+    Quotes a SQL identifier
+
+    :param name: identifier
+    """
+
+    return '"{}"'.format(name.replace('"', '""'))
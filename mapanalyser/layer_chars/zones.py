@@ -0,0 +1,139 @@
+"""
+    Zones (map sheets, grid cells) for the per-zone layer characteristics
+"""
+from math import ceil, floor
+
+from qgis.core import QgsFeatureRequest, QgsGeometry, QgsProject, QgsRectangle, QgsSpatialIndex
+from ..utils import raise_exception
+
+
+class GridZones:
+    """
+    Regular grid of square cells, a feature belongs to the cells its
+    bounding box intersects (the same rule as a request filtered by extent)
+    """
+
+    def __init__(self, extent, cell_size):
+        if cell_size <= 0:
+            raise_exception('grid cell size must be positive')
+
+        self.x_min = extent.xMinimum()
+        self.y_min = extent.yMinimum()
+        self.cell_size = cell_size
+        self.columns = max(1, int(ceil(extent.width() / cell_size)))
+        self.rows = max(1, int(ceil(extent.height() / cell_size)))
+
+    def extent(self):
+        """
+        Returns the extent of the grid
+        """
+
+        return QgsRectangle(
+            self.x_min, self.y_min,
+            self.x_min + self.columns * self.cell_size,
+            self.y_min + self.rows * self.cell_size)
+
+    def zones(self):
+        """
+        Returns the list of (zone id, zone geometry)
+        """
+
+        result = []
+
+        for row in range(self.rows):
+            for column in range(self.columns):
+                x = self.x_min + column * self.cell_size
+                y = self.y_min + row * self.cell_size
+                rect = QgsRectangle(x, y, x + self.cell_size, y + self.cell_size)
+                result.append((row * self.columns + column, QgsGeometry.fromRect(rect)))
+
+        return result
+
+    def get_zones(self, geom):
+        """
+        Returns the ids of the cells of a geometry
+
+        :param geom: feature geometry
+        """
+
+        box = geom.boundingBox()
+        first_column = max(0, int(floor((box.xMinimum() - self.x_min) / self.cell_size)))
+        last_column = min(self.columns - 1, int(floor((box.xMaximum() - self.x_min) / self.cell_size)))
+        first_row = max(0, int(floor((box.yMinimum() - self.y_min) / self.cell_size)))
+        last_row = min(self.rows - 1, int(floor((box.yMaximum() - self.y_min) / self.cell_size)))
+
+        return [row * self.columns + column
+                for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+
+class PolygonZones:
+    """
+    Zones from a polygon layer, a feature belongs to the zones it intersects.
+    The zones are transformed to the coordinate system of the layer, so the
+    features are measured in their own coordinate system
+    """
+
+    def __init__(self, source, crs=None, transform_context=None, feedback=None):
+        if not source:
+            raise_exception('zones source is empty')
+
+        self.index = QgsSpatialIndex()
+        self.geometries = {}
+        self.engines = {}
+        request = QgsFeatureRequest().setNoAttributes()
+
+        if crs is not None and source.sourceCrs() != crs:
+            request.setDestinationCrs(crs, transform_context or QgsProject.instance().transformContext())
+
+        for feature in source.getFeatures(request):
+            if feedback and feedback.isCanceled():
+                break
+
+            if not feature.hasGeometry():
+                continue
+
+            self.geometries[feature.id()] = feature.geometry()
+            self.index.addFeature(feature)
+
+    def extent(self):
+        """
+        Returns the extent of the zones
+        """
+
+        extent = QgsRectangle()
+        extent.setMinimal()
+
+        for geom in self.geometries.values():
+            extent.combineExtentWith(geom.boundingBox())
+
+        return extent
+
+    def zones(self):
+        """
+        Returns the list of (zone id, zone geometry)
+        """
+
+        return sorted(self.geometries.items(), key=lambda item: item[0])
+
+    def get_zones(self, geom):
+        """
+        Returns the ids of the zones a geometry intersects
+
+        :param geom: feature geometry
+        """
+
+        result = []
+
+        for zone_id in self.index.intersects(geom.boundingBox()):
+            engine = self.engines.get(zone_id)
+
+            if engine is None:
+                engine = QgsGeometry.createGeometryEngine(self.geometries[zone_id].constGet())
+                engine.prepareGeometry()
+                self.engines[zone_id] = engine
+
+            if engine.intersects(geom.constGet()):
+                result.append(zone_id)
+
+        return result
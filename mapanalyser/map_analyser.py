@@ -34,8 +34,10 @@ import os
 import sys
 import inspect
 
+from qgis.PyQt.QtCore import Qt
 from qgis.core import QgsProcessingAlgorithm, QgsApplication
 from .map_analyser_provider import MapAnalyserProvider
+from .layer_chars.monitor_dock import LayerMonitorDock
 
 cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]
 
@@ -45,11 +47,26 @@ if cmd_folder not in sys.path:
 
 class MapAnalyserPlugin(object):
 
-    def __init__(self):
+    def __init__(self, iface=None):
+        self.iface = iface
         self.provider = MapAnalyserProvider()
+        self.monitor_dock = None
 
     def initGui(self):
         QgsApplication.processingRegistry().addProvider(self.provider)
 
+        if self.iface is not None:
+            self.monitor_dock = LayerMonitorDock(self.iface.mainWindow())
+            self.iface.addDockWidget(Qt.RightDockWidgetArea, self.monitor_dock)
+            self.monitor_dock.hide()
+            self.iface.addPluginToVectorMenu('Map Analyser', self.monitor_dock.toggleViewAction())
+
     def unload(self):
         QgsApplication.processingRegistry().removeProvider(self.provider)
+
+        if self.monitor_dock is not None:
+            self.iface.removePluginVectorMenu('Map Analyser', self.monitor_dock.toggleViewAction())
+            self.monitor_dock.stop()
+            self.iface.removeDockWidget(self.monitor_dock)
+            self.monitor_dock.deleteLater()
+            self.monitor_dock = None
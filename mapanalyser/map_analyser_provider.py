@@ -35,8 +35,12 @@ from .rle_map.rle_ratio_map_algorithm import RLERatioOfMapAlgorithm
 from .rle_image.rle_ratio_image_algorithm import RLERatioOfImageAlgorithm
 from .layer_chars.layer_characteristics_algorithm import LayerCharacteristicsAlgorithm
 from .layer_chars.layer_characteristics_gpkg_algorithm import LayerCharacteristicsGpkgAlgorithm
+from .layer_chars.layer_characteristics_zones_algorithm import LayerCharacteristicsZonesAlgorithm
+from .layer_chars.layer_characteristics_batch_algorithm import LayerCharacteristicsBatchAlgorithm
 from .total_intersections.common_line_intersection_algorithm import CommonIntersectionAlgorithm
 from .total_intersections.common_line_intersection_gpkg_algorithm import CommonIntersectionAlgorithmGpkg
+from .total_intersections.common_line_intersection_batch_algorithm import CommonIntersectionAlgorithmBatch
+from .workspace import close_all
 
 
 class MapAnalyserProvider(QgsProcessingProvider):
@@ -49,15 +53,18 @@ class MapAnalyserProvider(QgsProcessingProvider):
                         RLERatioOfImageAlgorithm(),
                         LayerCharacteristicsAlgorithm(),
                         LayerCharacteristicsGpkgAlgorithm(),
+                        LayerCharacteristicsZonesAlgorithm(),
+                        LayerCharacteristicsBatchAlgorithm(),
                         CommonIntersectionAlgorithm(),
-                        CommonIntersectionAlgorithmGpkg()]
+                        CommonIntersectionAlgorithmGpkg(),
+                        CommonIntersectionAlgorithmBatch()]
 
     def unload(self):
         """
         Unloads the provider. Any tear-down steps required by the provider
         should be implemented here.
         """
-        pass
+        close_all()
 
     def loadAlgorithms(self):
         """
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Batch checkpoint and resume tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..batch import (append_rows, get_checkpoint_path, get_workspace_key, get_workspaces, read_checkpoint,
+                     read_rows, remove_unfinished_rows, write_durably)
+
+HEADER = ['workspace', 'total_intersections']
+
+
+class BatchTest(unittest.TestCase):
+    """Test the checkpoint of the batch algorithms."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'result.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_workspaces(self):
+        """GeoPackages of a directory and paths of a list file."""
+        for name in ('b.gpkg', 'a.gpkg', 'notes.txt'):
+            open(os.path.join(self.directory, name), 'w').close()
+        self.assertEqual([os.path.basename(path) for path in get_workspaces(self.directory)],
+                         ['a.gpkg', 'b.gpkg'])
+        list_file = os.path.join(self.directory, 'list.txt')
+        write_durably(list_file, '# generalized\na.gpkg\n\nb.gpkg\n', 'w')
+        self.assertEqual(get_workspaces(list_file),
+                         [os.path.join(self.directory, 'a.gpkg'), os.path.join(self.directory, 'b.gpkg')])
+
+    def test_resume(self):
+        """Rows of workspaces missing in the checkpoint and truncated rows are removed."""
+        checkpoint = get_checkpoint_path(self.output)
+        first, second, third = (get_workspace_key(os.path.join(self.directory, name))
+                                for name in ('a.gpkg', 'b.gpkg', 'c.gpkg'))
+        append_rows(self.output, HEADER, [{'workspace': first, 'total_intersections': 3}])
+        write_durably(checkpoint, '{}\n'.format(first))
+        append_rows(self.output, HEADER, [{'workspace': second, 'total_intersections': 5}])
+        write_durably(self.output, third)
+        write_durably(checkpoint, third)
+
+        self.assertEqual(read_checkpoint(checkpoint), {first})
+        remove_unfinished_rows(self.output, {second, third})
+        header, rows = read_rows(self.output)
+        self.assertEqual(header, HEADER)
+        self.assertEqual([row['workspace'] for row in rows], [first])
+
+    def test_same_names(self):
+        """Workspaces with the same name in different directories are kept apart."""
+        first = get_workspace_key(os.path.join(self.directory, 'exp1', 'roads.gpkg'))
+        second = get_workspace_key(os.path.join(self.directory, 'exp2', 'roads.gpkg'))
+        self.assertNotEqual(first, second)
+        append_rows(self.output, HEADER, [{'workspace': first, 'total_intersections': 3},
+                                          {'workspace': second, 'total_intersections': 5}])
+        write_durably(get_checkpoint_path(self.output), '{}\n'.format(first))
+
+        self.assertEqual(read_checkpoint(get_checkpoint_path(self.output)), {first})
+        remove_unfinished_rows(self.output, {second})
+        _, rows = read_rows(self.output)
+        self.assertEqual([row['workspace'] for row in rows], [first])
+
+
+if __name__ == '__main__':
+    unittest.main()
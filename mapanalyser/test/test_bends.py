@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Bend segmentation tests and benchmarks.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import math
+import os
+import time
+import unittest
+
+from ..layer_chars.utils import get
+
+# the wall-clock benchmarks run only on request: MAPANALYSER_BENCHMARK=1
+RUN_BENCHMARKS = bool(os.environ.get('MAPANALYSER_BENCHMARK'))
+
+
+def densified_straight_line(points_number):
+    """Near-straight road with a tiny wobble on every vertex."""
+    return [(float(i), 0.001 * math.sin(0.7 * i)) for i in range(points_number)]
+
+
+def zigzag(points_number):
+    """Every vertex turns to the other side."""
+    return [(float(i), float(i % 2)) for i in range(points_number)]
+
+
+def spiral(points_number):
+    """One long bend turning to the same side."""
+    return [((1 + 0.01 * i) * math.cos(0.05 * i),
+             (1 + 0.01 * i) * math.sin(0.05 * i)) for i in range(points_number)]
+
+
+def best_time(line, repeat=3):
+    """Best of several runs of the bend segmentation."""
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        get(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+class BendsTest(unittest.TestCase):
+    """Test the bend segmentation of lines."""
+
+    def test_zigzag(self):
+        """Every three points of a zigzag make a bend."""
+        result = get(zigzag(100))
+        self.assertEqual(result[0], 100)
+        self.assertEqual(result[1], 98)
+
+    def test_spiral(self):
+        """A spiral is a single bend."""
+        self.assertEqual(get(spiral(500))[1], 1)
+
+    def test_densified_straight_line(self):
+        """A wobbling straight line is merged into one bend."""
+        result = get(densified_straight_line(1000))
+        self.assertEqual(result[1], 1)
+        self.assertEqual(result[5], 999)
+
+    def test_short_line(self):
+        """Three points on a vertical line have no bends."""
+        self.assertEqual(get([(0, 0), (1, 1), (0, 2)]), (3, 0, 0.0, 0.0, 0.0, 0.0))
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set MAPANALYSER_BENCHMARK=1 to run the benchmarks')
+class BendsBenchmark(unittest.TestCase):
+    """The bend segmentation must scale linearly with the number of points."""
+
+    SIZES = (10000, 80000)
+
+    def assert_linear(self, make_line):
+        small, large = self.SIZES
+        small_time = best_time(make_line(small))
+        large_time = best_time(make_line(large))
+        ratio = large_time / small_time
+        # quadratic growth would give a ratio of 64
+        self.assertLess(ratio, 2 * large / small, '{}: {} points {:.3f} s, {} points {:.3f} s, ratio {:.1f}'.format(
+            make_line.__name__, small, small_time, large, large_time, ratio))
+
+    def test_densified_straight_line(self):
+        self.assert_linear(densified_straight_line)
+
+    def test_zigzag(self):
+        self.assert_linear(zigzag)
+
+    def test_spiral(self):
+        self.assert_linear(spiral)
+
+
+if __name__ == '__main__':
+    unittest.main()
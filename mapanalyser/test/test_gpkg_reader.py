@@ -0,0 +1,86 @@
+# coding=utf-8
+"""Direct GeoPackage geometry reader tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import struct
+import unittest
+
+from ..layer_chars.characteristics import LENGTH_AREA, BENDS, LayerCharacteristics
+from ..layer_chars.gpkg_reader import UnsupportedGeometryError, get_header_size, read_wkb, add_parts
+
+
+def line_wkb(points, byte_order='<'):
+    """Line string (XYZ) WKB."""
+    data = struct.pack(byte_order + 'BII', 1 if byte_order == '<' else 0, 1002, len(points))
+    for x, y in points:
+        data += struct.pack(byte_order + 'ddd', x, y, 0.0)
+    return data
+
+
+def polygon_wkb(rings):
+    """Polygon WKB."""
+    data = struct.pack('<BII', 1, 3, len(rings))
+    for ring in rings:
+        data += struct.pack('<I', len(ring))
+        for x, y in ring:
+            data += struct.pack('<dd', x, y)
+    return data
+
+
+def gpkg_blob(wkb):
+    """GPKG geometry with an XY envelope."""
+    return b'GP\x00\x03' + struct.pack('<i4d', 4326, 0, 0, 0, 0) + wkb
+
+
+SQUARE = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+HOLE = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+
+
+class GpkgReaderTest(unittest.TestCase):
+    """Test the parsing of GPKG geometries."""
+
+    def test_header(self):
+        """The envelope is skipped, empty geometries are reported."""
+        self.assertEqual(get_header_size(gpkg_blob(b'')), 40)
+        self.assertIsNone(get_header_size(b'GP\x00\x11' + bytes(4)))
+
+    def test_invalid_codes(self):
+        """Invalid envelope codes and unknown geometry types are unsupported."""
+        for envelope in (5, 6, 7):
+            with self.assertRaises(UnsupportedGeometryError):
+                get_header_size(b'GP\x00' + bytes([envelope << 1]) + bytes(4))
+        with self.assertRaises(UnsupportedGeometryError):
+            read_wkb(struct.pack('<BII', 1, 4002, 0))
+
+    def test_line(self):
+        """Z values are dropped, both byte orders are read."""
+        points = [(0.0, 0.0), (1.0, 1.0), (2.0, 0.0)]
+        for byte_order in '<>':
+            parts, offset = read_wkb(line_wkb(points, byte_order))
+            self.assertEqual(parts[0][1][0].tolist(), [list(point) for point in points])
+            self.assertEqual(offset, 9 + 3 * 24)
+
+    def test_multi_polygon(self):
+        """Polygon area excludes the holes, the length is the perimeter of all rings."""
+        wkb = struct.pack('<BII', 1, 6, 2) + polygon_wkb([SQUARE, HOLE]) + polygon_wkb([SQUARE])
+        parts = read_wkb(memoryview(gpkg_blob(wkb)), 40)[0]
+        characteristics = LayerCharacteristics()
+        add_parts(characteristics, parts, [LENGTH_AREA, BENDS])
+        self.assertEqual(characteristics.count, 2)
+        self.assertEqual(characteristics.points_num, 15)
+        self.assertAlmostEqual(characteristics.total_polygon_area, 196.0)
+        self.assertAlmostEqual(characteristics.total_length, 88.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
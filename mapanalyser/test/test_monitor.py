@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Live layer monitor tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import unittest
+
+from qgis.core import NULL, QgsFeature, QgsGeometry, QgsVectorLayer
+from .utilities import get_qgis_app
+from ..layer_chars.monitor import LayerMonitor, ValueCounter
+
+QGIS_APP = get_qgis_app()
+
+
+def create_feature(layer, wkt, name):
+    """Feature of the test layer."""
+    feature = QgsFeature(layer.fields())
+    feature.setGeometry(QgsGeometry.fromWkt(wkt))
+    feature.setAttributes([name])
+    return feature
+
+
+class LayerMonitorTest(unittest.TestCase):
+    """Test the incremental updates of the monitor."""
+
+    def setUp(self):
+        self.layer = QgsVectorLayer('LineString?field=name:string', 'lines', 'memory')
+        self.layer.dataProvider().addFeatures([
+            create_feature(self.layer, 'LINESTRING(0 0, 3 4)', 'a'),
+            create_feature(self.layer, 'LINESTRING(0 0, 0 10)', 'b'),
+        ])
+        self.monitor = LayerMonitor(self.layer)
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_value_counter(self):
+        """A value is distinct until its last feature is removed."""
+        counter = ValueCounter()
+        counter.add('a')
+        counter.add('a')
+        counter.remove('a')
+        self.assertEqual(len(counter), 1)
+        counter.remove('a')
+        self.assertEqual(len(counter), 0)
+
+    def test_edits(self):
+        """Only the marked features are read again."""
+        self.assertEqual(self.monitor.characteristics.features_count, 2)
+        self.assertAlmostEqual(self.monitor.characteristics.total_length, 15.0)
+        self.layer.startEditing()
+        self.layer.addFeature(create_feature(self.layer, 'LINESTRING(0 0, 6 8)', 'a'))
+        self.layer.changeGeometry(2, QgsGeometry.fromWkt('LINESTRING(0 0, 0 1)'))
+        self.assertEqual(len(self.monitor.dirty), 2)
+        self.monitor.update()
+        self.assertEqual(self.monitor.characteristics.features_count, 3)
+        self.assertAlmostEqual(self.monitor.characteristics.total_length, 16.0)
+        self.assertEqual(len(self.monitor.values[0]), 2)
+        self.layer.deleteFeature(2)
+        self.monitor.update()
+        self.assertEqual(self.monitor.characteristics.features_count, 2)
+        self.assertEqual(len(self.monitor.values[0]), 1)
+        self.layer.rollBack()
+        self.monitor.update()
+        self.assertAlmostEqual(self.monitor.characteristics.total_length, 15.0)
+
+    def test_null_values(self):
+        """The features with NULL values share one distinct value."""
+        self.layer.startEditing()
+        self.layer.addFeature(create_feature(self.layer, 'LINESTRING(0 0, 1 0)', NULL))
+        self.layer.addFeature(create_feature(self.layer, 'LINESTRING(0 0, 0 1)', NULL))
+        self.monitor.update()
+        self.assertEqual(self.monitor.characteristics.features_count, 4)
+        self.assertEqual(len(self.monitor.values[0]), 3)
+        self.layer.rollBack()
+        self.monitor.update()
+        self.assertEqual(len(self.monitor.values[0]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
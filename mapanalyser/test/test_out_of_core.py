@@ -0,0 +1,93 @@
+# coding=utf-8
+"""Out of core intersection tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from qgis.core import QgsProcessingException
+
+from ..total_intersections import out_of_core
+from ..total_intersections.segment_intersection import (find_intersections, get_end_points, get_lines_segments,
+                                                       get_true_intersections)
+
+
+def count_in_memory(coords, line_offsets, tolerance):
+    """The true intersections of all segments in memory."""
+    segments = get_lines_segments(coords, line_offsets, numpy.arange(1, len(line_offsets)))
+    points, _ = find_intersections(segments)
+    return len(get_true_intersections(points, get_end_points(coords, line_offsets), tolerance))
+
+
+def count_out_of_core(coords, line_offsets, tolerance, budget_segments):
+    """The true intersections of the segments spilled to disk."""
+    lines = [[coords[line_offsets[i]:line_offsets[i + 1]]] for i in range(len(line_offsets) - 1)]
+    with tempfile.TemporaryDirectory() as directory:
+        partition = out_of_core.spill_lines(lines, directory)
+        count = out_of_core.count_partitioned_intersections(
+            partition, budget_segments * out_of_core.BYTES_PER_SEGMENT, tolerance=tolerance)
+        remaining = os.listdir(directory)
+    return count, remaining
+
+
+class CanceledFeedback:
+    """Feedback of a canceled algorithm."""
+
+    def isCanceled(self):
+        return True
+
+
+class OutOfCoreTest(unittest.TestCase):
+    """The partitions count the same intersections as one search in memory."""
+
+    def setUp(self):
+        self.chunk_size = out_of_core.CHUNK_SIZE
+        out_of_core.CHUNK_SIZE = 1000
+
+    def tearDown(self):
+        out_of_core.CHUNK_SIZE = self.chunk_size
+
+    def test_short_segments(self):
+        """Short lines are split into many partitions."""
+        generator = numpy.random.default_rng(3)
+        starts = numpy.round(generator.uniform(0, 100, (2000, 1, 2)), 1)
+        steps = numpy.round(numpy.cumsum(generator.uniform(-2, 2, (2000, 5, 2)), axis=1), 1)
+        coords = (starts + steps).reshape(-1, 2)
+        line_offsets = numpy.arange(0, len(coords) + 1, 5)
+        for tolerance in (0.0, 0.5):
+            count, remaining = count_out_of_core(coords, line_offsets, tolerance, 300)
+            self.assertEqual(count, count_in_memory(coords, line_offsets, tolerance))
+            self.assertEqual(remaining, [])
+
+    def test_long_segments(self):
+        """The segments crossing all quarters are searched over the budget."""
+        generator = numpy.random.default_rng(4)
+        coords = numpy.round(generator.uniform(0, 100, (1000, 2)), 1)
+        line_offsets = numpy.arange(0, len(coords) + 1, 5)
+        count, _ = count_out_of_core(coords, line_offsets, 0.0, 100)
+        self.assertEqual(count, count_in_memory(coords, line_offsets, 0.0))
+
+    def test_canceled(self):
+        """A canceled count raises instead of returning a part of the count."""
+        coords = numpy.array([[0.0, 0.0], [10.0, 10.0], [0.0, 10.0], [10.0, 0.0]])
+        with tempfile.TemporaryDirectory() as directory:
+            partition = out_of_core.spill_lines([[coords[:2]], [coords[2:]]], directory)
+            with self.assertRaises(QgsProcessingException):
+                out_of_core.count_partitioned_intersections(partition, 0, CanceledFeedback())
+
+
+if __name__ == '__main__':
+    unittest.main()
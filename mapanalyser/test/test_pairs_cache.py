@@ -0,0 +1,122 @@
+# coding=utf-8
+"""Layer pairs intersection cache tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from qgis.core import QgsProcessingException
+
+from ..total_intersections.pairs_cache import LayerLines, PairsCache, get_lines_intersections
+from ..total_intersections.segment_intersection import (find_intersections, get_end_points, get_lines_segments,
+                                                       get_true_intersections)
+
+
+def random_layer(seed, lines_number=60, points_number=5, size=20):
+    """Random lines on a small grid, every line is a feature."""
+    generator = numpy.random.default_rng(seed)
+    coords = numpy.round(generator.uniform(0, size, (lines_number * points_number, 2)))
+    line_offsets = numpy.arange(0, lines_number * points_number + 1, points_number)
+    return LayerLines(coords, line_offsets, numpy.arange(lines_number), 'layer {}'.format(seed))
+
+
+def search_all(layers, tolerance):
+    """One search over the lines of all layers."""
+    coords = numpy.concatenate([layer.coords for layer in layers])
+    line_offsets = numpy.concatenate([[0]] + [
+        layer.line_offsets[1:] + sum(len(other.coords) for other in layers[:number])
+        for number, layer in enumerate(layers)])
+    segments = get_lines_segments(coords, line_offsets, numpy.arange(len(line_offsets) - 1))
+    points, _ = find_intersections(segments)
+    return get_true_intersections(points, get_end_points(coords, line_offsets), tolerance)
+
+
+class CanceledFeedback:
+    """Feedback of a canceled algorithm."""
+
+    def isCanceled(self):
+        return True
+
+
+class PairsCacheTest(unittest.TestCase):
+    """Test the intersections of the layers joined from the pairs."""
+
+    def test_incremental(self):
+        """Adding a layer searches only its pairs, the total doesn't change."""
+        layers = [random_layer(seed) for seed in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            for tolerance in (0.0, 0.5):
+                cache = PairsCache(directory)
+                points = get_lines_intersections(layers[:2], cache, tolerance=tolerance)
+                self.assertEqual(len(points), len(search_all(layers[:2], tolerance)))
+
+                cache = PairsCache(directory)
+                points = get_lines_intersections(layers, cache, tolerance=tolerance)
+                self.assertEqual(len(points), len(search_all(layers, tolerance)))
+                self.assertEqual(cache.hits, 3 if tolerance == 0 else 6)
+
+                cache = PairsCache(directory)
+                get_lines_intersections(layers, cache, tolerance=tolerance)
+                self.assertEqual(cache.searched, 0)
+
+    def test_changed_layer(self):
+        """Only the segments near a changed layer are searched, the unchanged pairs are not."""
+        layers = [random_layer(seed, 75, 5, 100) for seed in range(5)]
+        with tempfile.TemporaryDirectory() as directory:
+            get_lines_intersections(layers, PairsCache(directory))
+            layers[2] = random_layer(10, 10, 5, 10)
+            cache = PairsCache(directory)
+            points = get_lines_intersections(layers, cache)
+            self.assertEqual(len(points), len(search_all(layers, 0.0)))
+            self.assertEqual(cache.misses, 5)
+            segments_number = sum(len(layer.coords) - len(layer.line_offsets) + 1 for layer in layers)
+            self.assertLess(cache.searched, segments_number / 2)
+
+    def test_same_layers(self):
+        """The points of a layer and of a pair of copies of it are kept apart."""
+        layer = random_layer(1)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PairsCache(directory)
+            points = get_lines_intersections([layer, layer._replace(line_groups=layer.line_groups + 100)], cache)
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(len(points), len(search_all([layer, layer], 0.0)))
+
+    def test_canceled(self):
+        """A canceled search raises and caches nothing."""
+        layers = [random_layer(seed) for seed in range(2)]
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(QgsProcessingException):
+                get_lines_intersections(layers, PairsCache(directory), CanceledFeedback())
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_evict(self):
+        """The points of the previous contents of a source are removed."""
+        layers = [random_layer(seed) for seed in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PairsCache(directory)
+            get_lines_intersections(layers[:2], cache)
+            cache.evict({'first': layers[0].fingerprint, 'second': layers[1].fingerprint})
+
+            get_lines_intersections([layers[0], layers[2]], cache)
+            cache.evict({'first': layers[0].fingerprint, 'second': layers[2].fingerprint})
+            self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith('.npy')), sorted(
+                os.path.basename(cache.get_path(*pair)) for pair in
+                [(layers[0].fingerprint,), (layers[2].fingerprint,), (layers[0].fingerprint, layers[2].fingerprint)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# coding=utf-8
+"""Planar graph tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from ..total_intersections.planar_graph import (build_planar_graph, get_graph_statistics, load_planar_graph,
+                                                save_planar_graph)
+from ..total_intersections.segment_intersection import (count_true_intersections, find_intersections,
+                                                       get_end_points, get_lines_segments)
+
+
+def get_graph(lines, tolerance=0.0):
+    """The graph of the lines, every line is a feature."""
+    coords = numpy.concatenate([numpy.array(line, float) for line in lines])
+    line_offsets = numpy.concatenate([[0], numpy.cumsum([len(line) for line in lines])])
+    segments = get_lines_segments(coords, line_offsets, numpy.arange(len(lines)))
+    points, pairs = find_intersections(segments)
+    return build_planar_graph(segments, points, pairs, tolerance)
+
+
+class PlanarGraphTest(unittest.TestCase):
+    """Test the planar graph of the lines."""
+
+    def test_ring_crossed_by_line(self):
+        """A ring crossed by a line has two faces."""
+        graph = get_graph([[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]], [[-1, 1], [3, 1]]])
+        statistics = get_graph_statistics(graph)
+        self.assertEqual((statistics['nodes'], statistics['edges']), (5, 6))
+        self.assertEqual(statistics['dangles'], 2)
+        self.assertEqual(statistics['components'], 1)
+        self.assertEqual(statistics['cyclomatic_number'], 2)
+        self.assertEqual(statistics['intersections'], 2)
+        self.assertEqual(statistics['degree_histogram'], [0, 2, 1, 0, 2])
+
+    def test_loops_and_components(self):
+        """A free ring is a loop, a crossing at a vertex is one node."""
+        graph = get_graph([[[0, 0], [1, 0], [1, 1], [0, 0]], [[5, 0], [6, 0], [7, 0]], [[6, -1], [6, 1]]])
+        statistics = get_graph_statistics(graph)
+        self.assertEqual((statistics['nodes'], statistics['edges']), (6, 5))
+        self.assertEqual(statistics['components'], 2)
+        self.assertEqual(statistics['cyclomatic_number'], 1)
+        self.assertEqual(statistics['dangles'], 4)
+        degrees = numpy.diff(graph.indptr)
+        self.assertEqual(degrees.sum(), 2 * len(graph.edges))
+
+    def test_intersections(self):
+        """The graph counts the same true intersections as the engine."""
+        generator = numpy.random.default_rng(2)
+        coords = numpy.round(generator.uniform(0, 30, (1000, 2)))
+        line_offsets = numpy.arange(0, 1001, 5)
+        segments = get_lines_segments(coords, line_offsets, numpy.arange(200))
+        end_points = get_end_points(coords, line_offsets)
+        points, pairs = find_intersections(segments)
+        for tolerance in (0.0, 0.5):
+            statistics = get_graph_statistics(build_planar_graph(segments, points, pairs, tolerance))
+            self.assertEqual(statistics['intersections'], count_true_intersections(segments, end_points, tolerance))
+            self.assertEqual(statistics['components'], 1)
+
+    def test_save(self):
+        """A saved graph is loaded only with its fingerprint."""
+        graph = get_graph([[[0, 0], [2, 2]], [[0, 2], [2, 0]]])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.npz')
+            save_planar_graph(path, graph, 'layers')
+            loaded = load_planar_graph(path, 'layers')
+            self.assertIsNone(load_planar_graph(path, 'other layers'))
+        for expected, value in zip(graph, loaded):
+            self.assertTrue(numpy.array_equal(expected, value))
+
+
+if __name__ == '__main__':
+    unittest.main()
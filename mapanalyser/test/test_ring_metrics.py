@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Ragged ring metrics tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import unittest
+
+import numpy
+
+from ..layer_chars.characteristics import sum_bends
+from ..layer_chars.ring_metrics import pack_parts, get_ring_metrics, get_part_metrics, get_rings_bends
+from ..layer_chars.utils import get
+
+SQUARE = numpy.array([(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)], float)
+HOLE = numpy.array([(2, 2), (2, 4), (4, 4), (4, 2), (2, 2)], float)
+LINE = numpy.array([(0, 0), (1, 1), (2, 0), (3, 1), (4, 0)], float)
+
+
+class RingMetricsTest(unittest.TestCase):
+    """Test the vectorized metrics of ragged rings."""
+
+    def setUp(self):
+        self.arrays = pack_parts([[(True, [SQUARE, HOLE])], [(False, [LINE]), (True, [SQUARE])]])
+
+    def test_rings(self):
+        """The segments between the rings are not measured."""
+        coords, ring_offsets = self.arrays[:2]
+        lengths, areas = get_ring_metrics(coords, ring_offsets)
+        numpy.testing.assert_allclose(lengths, [40, 8, 4 * 2 ** 0.5, 40])
+        numpy.testing.assert_allclose(areas[[0, 1, 3]], [100, -4, 100])
+
+    def test_parts(self):
+        """The holes are subtracted from the exterior, lines have no area."""
+        lengths, areas, points = get_part_metrics(*self.arrays)
+        numpy.testing.assert_allclose(lengths, [48, 4 * 2 ** 0.5, 40])
+        numpy.testing.assert_allclose(areas, [96, 0, 100])
+        self.assertEqual(points.tolist(), [10, 5, 5])
+
+    def test_bends(self):
+        """The bends of a polygon are the sums of the bends of its rings."""
+        coords, ring_offsets = self.arrays[:2]
+        self.assertEqual(get_rings_bends(coords, ring_offsets, 0, 2),
+                         sum_bends([get(SQUARE.tolist()), get(HOLE.tolist())]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+# coding=utf-8
+"""Segment intersection engine tests and benchmarks.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from ..total_intersections.segment_intersection import (Segments, count_true_intersections, find_intersections, get_end_points, get_grid,
+                                                       get_intersection_nodes, get_layer_pairs_matrix, get_lines_segments,
+                                                       get_node_degrees, get_tiles, get_true_intersections)
+from ..total_intersections.segment_intersection_core import intersect_segments
+from ..layer_chars.geometry_cache import META_FILE, GeometryCache
+
+# the wall-clock benchmark runs only on request: MAPANALYSER_BENCHMARK=1
+# or larger benchmark sizes, e.g. MAPANALYSER_BENCHMARK_SEGMENTS=1000000,10000000
+RUN_BENCHMARKS = bool(os.environ.get('MAPANALYSER_BENCHMARK') or os.environ.get('MAPANALYSER_BENCHMARK_SEGMENTS'))
+BENCHMARK_SIZES = os.environ.get('MAPANALYSER_BENCHMARK_SEGMENTS', '100000,800000')
+
+
+def random_segments(segments_number, seed=0):
+    """Short random segments with about one crossing per segment."""
+    generator = numpy.random.default_rng(seed)
+    side = segments_number ** 0.5
+    start = generator.uniform(0, side, (segments_number, 2))
+    end = start + generator.uniform(-1, 1, (segments_number, 2))
+    return Segments(start[:, 0], start[:, 1], end[:, 0], end[:, 1], numpy.arange(segments_number))
+
+
+def brute_force(segments):
+    """All pairs of segments of different groups."""
+    points = set()
+    for i in range(len(segments.x0)):
+        for j in range(i + 1, len(segments.x0)):
+            if segments.groups[i] == segments.groups[j]:
+                continue
+            found, x, y = intersect_segments(
+                segments.x0[i], segments.y0[i], segments.x1[i], segments.y1[i],
+                segments.x0[j], segments.y0[j], segments.x1[j], segments.y1[j])
+            if found:
+                points.add((i, j, x, y))
+    return points
+
+
+class SegmentIntersectionTest(unittest.TestCase):
+    """Test the intersections of segments."""
+
+    def test_cases(self):
+        """Crossings, touches and collinear segments."""
+        self.assertEqual(intersect_segments(0, 0, 2, 2, 0, 2, 2, 0), (True, 1.0, 1.0))
+        self.assertEqual(intersect_segments(0, 0, 2, 0, 1, 0, 1, 5), (True, 1.0, 0.0))
+        self.assertEqual(intersect_segments(0, 0, 2, 0, 2, 0, 3, 0), (True, 2.0, 0.0))
+        self.assertFalse(intersect_segments(0, 0, 2, 0, 1, 0, 3, 0)[0])
+        self.assertFalse(intersect_segments(0, 0, 2, 0, 0, 1, 2, 1)[0])
+
+    def test_groups(self):
+        """The segments of a feature don't intersect each other."""
+        segments = get_lines_segments(
+            numpy.array([(0, 0), (2, 2), (0, 2), (2, 0), (0, 1), (2, 1)], float), [0, 4, 6], [0, 1])
+        points, pairs = find_intersections(segments)
+        self.assertEqual(sorted(map(tuple, points.tolist())), [(1.0, 1.0), (1.0, 1.0)])
+        self.assertEqual(sorted(map(tuple, pairs.tolist())), [(0, 3), (2, 3)])
+
+    def test_lines(self):
+        """Lines are split into segments, the layers and the ends are kept."""
+        coords = numpy.array([(0, 0), (1, 0), (2, 0), (0, 0), (0, 1), (1, 1), (0, 0)], float)
+        segments = get_lines_segments(coords, [0, 3, 7], [1, 2], [0, 1])
+        self.assertEqual(segments.x1.tolist(), [1, 2, 0, 1, 0])
+        self.assertEqual(segments.layers.tolist(), [0, 0, 1, 1, 1])
+        end_points = get_end_points(coords, numpy.array([0, 3, 7]))
+        self.assertEqual(get_node_degrees([(0, 0), (2, 0), (1, 0)], end_points).tolist(), [3, 1, 0])
+
+    def test_true_intersections(self):
+        """Two ends meeting are a continuation, the tolerance snaps the ends."""
+        end_points = numpy.array([(0, 0), (1, 0), (1, 0), (2, 0), (1, 1e-9), (5, 5)])
+        points = numpy.array([(1, 0), (1, 0), (3, 3)], float)
+        self.assertEqual(get_true_intersections(points, end_points).tolist(), [[3, 3]])
+        self.assertEqual(get_true_intersections(points, end_points, 1e-6).tolist(), [[1, 0], [3, 3]])
+        self.assertEqual(len(get_true_intersections(numpy.empty((0, 2)), end_points)), 0)
+
+    def test_brute_force(self):
+        """The grid finds every intersection once."""
+        segments = random_segments(400)
+        points, pairs = find_intersections(segments, 1.5)
+        found = {(i, j, x, y) for (i, j), (x, y) in zip(pairs.tolist(), points.tolist())}
+        self.assertEqual(len(found), len(points))
+        self.assertEqual(found, brute_force(segments))
+
+    def test_tiles(self):
+        """The tiles cover every cell once and give the serial result."""
+        segments = random_segments(5000)
+        grid = get_grid(segments)
+        cells = sum((end_column - first_column) * (end_row - first_row)
+                    for first_column, end_column, first_row, end_row in get_tiles(grid, 16))
+        self.assertEqual(cells, grid.columns * grid.rows)
+        points, pairs = find_intersections(segments)
+        tiled_points, tiled_pairs = find_intersections(segments, threads=4)
+        self.assertEqual(points.tolist(), tiled_points.tolist())
+        self.assertEqual(pairs.tolist(), tiled_pairs.tolist())
+
+    def test_count(self):
+        """The count without the points is the number of true intersections."""
+        generator = numpy.random.default_rng(1)
+        coords = numpy.round(generator.uniform(0, 30, (1000, 2)))
+        line_offsets = numpy.arange(0, 1001, 5)
+        segments = get_lines_segments(coords, line_offsets, numpy.arange(200))
+        end_points = get_end_points(coords, line_offsets)
+        points, _ = find_intersections(segments)
+        for tolerance in (0.0, 0.5):
+            expected = len(get_true_intersections(points, end_points, tolerance))
+            self.assertEqual(count_true_intersections(segments, end_points, tolerance), expected)
+            self.assertEqual(count_true_intersections(segments, end_points, tolerance, threads=3), expected)
+
+    def test_nodes(self):
+        """The nodes keep the features of a pair, the degrees and the line ends."""
+        # a crossing at a vertex, a junction and two lines continuing each other
+        coords = numpy.array([[0, 0], [1, 0], [2, 0], [1, -1], [1, 1], [2, -1], [2, 0], [2, 0], [3, 0], [4, 0]],
+                             float)
+        line_offsets = numpy.array([0, 3, 5, 7, 10])
+        segments = get_lines_segments(coords, line_offsets, [1, 2, 3, 4], [0, 1, 1, 0], [10, 20, 30, 40])
+        end_points = get_end_points(coords, line_offsets)
+        points, pairs = find_intersections(segments)
+        nodes = get_intersection_nodes(points, pairs, segments, end_points)
+        order = numpy.lexsort((nodes.points[:, 1], nodes.points[:, 0]))
+        self.assertEqual(nodes.points[order].tolist(), [[1, 0], [2, 0]])
+        self.assertEqual(nodes.degrees[order].tolist(), [4, 3])
+        self.assertEqual(nodes.ends[order].tolist(), [0, 3])
+        self.assertEqual(sorted(segments.features[nodes.pairs[order[0]]].tolist()), [10, 20])
+        self.assertEqual(segments.layers[nodes.pairs[order[0]]].tolist(), [0, 1])
+
+    def test_layer_pairs(self):
+        """A point of the lines of three layers is counted for every pair of them."""
+        coords = numpy.array([[0, 0], [4, 0], [1, -1], [1, 1], [3, -1], [3, 1], [2, -1], [4, 1], [0, -0.5], [2, -0.5]])
+        line_offsets = numpy.arange(0, 11, 2)
+        segments = get_lines_segments(coords, line_offsets, numpy.arange(5), [0, 1, 1, 2, 1])
+        points, pairs = find_intersections(segments)
+        matrix = get_layer_pairs_matrix(points, pairs, segments, get_end_points(coords, line_offsets), 3)
+        self.assertEqual(matrix.tolist(), [[0, 2, 1], [2, 1, 1], [1, 1, 0]])
+
+    def test_cached_lines(self):
+        """The lines of the geometry cache keep their features, one-point rings are dropped."""
+        arrays = {
+            'coords': numpy.array([[0, 0], [1, 0], [1, 1], [0, 0], [5, 5], [2, 2], [3, 3]], numpy.float32),
+            'ring_offsets': numpy.array([0, 4, 5, 7]),
+            'part_offsets': numpy.array([0, 1, 2, 3]),
+            'part_polygons': numpy.array([True, False, False]),
+            'feature_offsets': numpy.array([0, 1, 1, 3]),
+            'fids': numpy.array([10, 11, 12]),
+            'bbox': numpy.zeros((3, 4)),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, array in arrays.items():
+                numpy.save(os.path.join(directory, name + '.npy'), array)
+            with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as meta_file:
+                json.dump({'origin': [100.0, 0.0]}, meta_file)
+            coords, lengths, features = GeometryCache(directory).get_lines()
+        self.assertEqual(coords[:, 0].tolist(), [100, 101, 101, 100, 102, 103])
+        self.assertEqual(lengths.tolist(), [4, 2])
+        self.assertEqual(features.tolist(), [0, 2])
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set MAPANALYSER_BENCHMARK=1 to run the benchmark')
+class SegmentIntersectionBenchmark(unittest.TestCase):
+    """The intersections must be found in about linear time."""
+
+    def test_scaling(self):
+        sizes = [int(size) for size in BENCHMARK_SIZES.split(',')]
+        find_intersections(random_segments(1000))
+        times = []
+        report = []
+
+        for size in sizes:
+            segments = random_segments(size)
+            start = time.perf_counter()
+            points, _ = find_intersections(segments)
+            times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            find_intersections(segments, threads=os.cpu_count() or 1)
+            report.append('{} segments: {} intersections {:.3f} s, {:.3f} s in {} threads'.format(
+                size, len(points), times[-1], time.perf_counter() - start, os.cpu_count()))
+
+        ratio = times[-1] / times[0]
+        # all pairs would grow by the square of the sizes ratio
+        self.assertLess(ratio, 2 * sizes[-1] / sizes[0], '; '.join(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Zone assignment tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Potemkin D.A., Yakimova O.P.'
+__date__ = '2020-08-21'
+__copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
+
+import unittest
+
+from qgis.core import (QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsProcessingException,
+                       QgsRectangle, QgsVectorLayer)
+
+from ..layer_chars.zones import GridZones, PolygonZones
+
+
+class GridZonesTest(unittest.TestCase):
+    """Test the assignment of features to grid cells."""
+
+    def setUp(self):
+        self.grid = GridZones(QgsRectangle(0, 0, 25, 20), 10)
+
+    def test_size(self):
+        """A partial cell is added on the right."""
+        self.assertEqual((self.grid.columns, self.grid.rows), (3, 2))
+        self.assertEqual(len(self.grid.zones()), 6)
+
+    def test_inner_feature(self):
+        """A feature inside a cell belongs to it only."""
+        geom = QgsGeometry.fromWkt('LINESTRING (11 11, 12 15, 14 12)')
+        self.assertEqual(self.grid.get_zones(geom), [4])
+
+    def test_crossing_feature(self):
+        """A feature crossing cells belongs to every cell of its bounding box."""
+        geom = QgsGeometry.fromWkt('LINESTRING (5 5, 15 15, 22 5)')
+        self.assertEqual(self.grid.get_zones(geom), [0, 1, 2, 3, 4, 5])
+
+    def test_outside_feature(self):
+        """A feature outside the grid belongs to no cell."""
+        geom = QgsGeometry.fromWkt('LINESTRING (30 30, 40 40)')
+        self.assertEqual(self.grid.get_zones(geom), [])
+
+    def test_cell_size(self):
+        """A cell size that is not positive is rejected."""
+        for cell_size in (0.0, -10.0):
+            with self.assertRaises(QgsProcessingException):
+                GridZones(QgsRectangle(0, 0, 25, 20), cell_size)
+
+
+class PolygonZonesTest(unittest.TestCase):
+    """Test the zones of a polygon layer in another coordinate system."""
+
+    def setUp(self):
+        self.source = QgsVectorLayer('Polygon?crs=EPSG:4326', 'zones', 'memory')
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt('POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))'))
+        self.source.dataProvider().addFeatures([feature])
+
+    def test_layer_crs(self):
+        """The zones are transformed to the coordinate system of the layer."""
+        zones = PolygonZones(self.source, QgsCoordinateReferenceSystem('EPSG:3857'))
+        extent = zones.extent()
+        self.assertAlmostEqual(extent.xMaximum(), 111319.49, 1)
+        self.assertAlmostEqual(extent.yMaximum(), 111325.14, 1)
+
+        geom = QgsGeometry.fromWkt('LINESTRING (50000 50000, 60000 60000)')
+        self.assertEqual(len(zones.get_zones(geom)), 1)
+
+    def test_same_crs(self):
+        """The zones in the coordinate system of the layer are not changed."""
+        zones = PolygonZones(self.source, QgsCoordinateReferenceSystem('EPSG:4326'))
+        self.assertEqual(zones.extent(), QgsRectangle(0, 0, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
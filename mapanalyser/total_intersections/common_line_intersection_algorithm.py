@@ -31,22 +31,55 @@ __copyright__ = '(C) 2020 by Potemkin D.A., Yakimova O.P.'
 __revision__ = '$Format:%H$'
 
 import os
-import processing
 
-from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsFeatureSink,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingUtils,
                        QgsWkbTypes,
                        QgsProcessingException,
                        QgsGeometry,
                        QgsFeature,
                        QgsPointXY,
+                       QgsField,
                        QgsFields)
 
-from ..utils import tr, raise_exception, define_help_info, filter_layers, get_total_intersection, merge_layers
+from .segment_intersection import get_intersection_layers
+from .planar_graph import get_graph_statistics
+from ..utils import tr, define_help_info, get_layers_intersection_nodes, write_matrix_to_file
+
+# the number of points written to the sink at once
+BATCH_SIZE = 10000
+
+INTERSECTION_FIELDS = [
+    ('layer_1', QVariant.String),
+    ('feature_1', QVariant.LongLong),
+    ('layer_2', QVariant.String),
+    ('feature_2', QVariant.LongLong),
+    ('degree', QVariant.Int),
+    ('type', QVariant.String),
+]
+
+
+def get_intersection_fields():
+    """
+    Returns the fields of the intersection points: the layer ids and the feature ids
+    of the two intersecting segments, the node degree and the type of the node
+    (crossing or junction - a line ends at the point)
+    """
+
+    fields = QgsFields()
+
+    for name, field_type in INTERSECTION_FIELDS:
+        fields.append(QgsField(name, field_type))
+
+    return fields
 
 
 class CommonIntersectionAlgorithm(QgsProcessingAlgorithm):
@@ -61,11 +94,18 @@ class CommonIntersectionAlgorithm(QgsProcessingAlgorithm):
 
     OUTPUT = 'OUTPUT'
     INPUT = 'INPUT'
+    THREADS = 'THREADS'
+    TOLERANCE = 'TOLERANCE'
+    GRAPH_DIRECTORY = 'GRAPH_DIRECTORY'
+    MATRIX_OUTPUT = 'MATRIX_OUTPUT'
+    GEOMETRY_CACHE = 'GEOMETRY_CACHE'
     HELP_FILE = 'total_intersections_help.txt'
 
 
     def __init__(self):
         super().__init__()
+        self.dest_id = None
+        self.spatial_index = False
         directory = os.path.dirname(__file__)
         file_name = os.path.join(directory, self.HELP_FILE)
         self._shortHelp = define_help_info(file_name)
@@ -85,6 +125,35 @@ class CommonIntersectionAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                tr('Number of threads'),
+                minValue=1,
+                defaultValue=os.cpu_count() or 1))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TOLERANCE,
+                tr('Snapping tolerance of the line ends (0 - exact coordinates)'),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.0))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GRAPH_DIRECTORY,
+                tr('Directory to save the planar graph'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GEOMETRY_CACHE,
+                tr('Geometry cache directory'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -92,12 +161,22 @@ class CommonIntersectionAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.MATRIX_OUTPUT,
+                tr('Intersections of the layer pairs'),
+                'csv(*.csv)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        layers = filter_layers(self.parameterAsLayerList(parameters, self.INPUT, context))
+        layers = get_intersection_layers(self.parameterAsLayerList(parameters, self.INPUT, context))
         result = {
             'Layers': 'missing layers with the right geometry',
             'The number of intersections': 0
@@ -107,35 +186,117 @@ class CommonIntersectionAlgorithm(QgsProcessingAlgorithm):
             return result
 
         feedback.setProgress(10)
-        feedback.pushInfo(tr('Merging layers'))
-        merged_layer = merge_layers(layers)
-        feedback.setProgress(20)
-
-        intersections = get_total_intersection(merged_layer, feedback)
-        feedback.setProgress(90)
-
-        (sink, dest_id) = self.parameterAsSink(
-            parameters, self.OUTPUT,
-            context, QgsFields(),
-            QgsWkbTypes.Point,
-            merged_layer.sourceCrs()
-        )
+        matrix_output = self.parameterAsFileOutput(parameters, self.MATRIX_OUTPUT, context)
+        nodes, segments, graph, matrix = get_layers_intersection_nodes(
+            layers, feedback, self.parameterAsInt(parameters, self.THREADS, context),
+            context.transformContext(), self.parameterAsDouble(parameters, self.TOLERANCE, context),
+            self.parameterAsFile(parameters, self.GRAPH_DIRECTORY, context),
+            self.parameterAsFile(parameters, self.GEOMETRY_CACHE, context), bool(matrix_output))
+        feedback.setProgress(70)
+
+        statistics = get_graph_statistics(graph)
+
+        if matrix_output:
+            feedback.pushInfo(tr('Writing the intersections of the layer pairs to file'))
+            write_matrix_to_file(matrix_output, [layer.name() for layer in layers], matrix, ';')
+        feedback.pushInfo(tr('Nodes by degree: {}').format(', '.join(
+            '{}: {}'.format(degree, count) for degree, count in enumerate(statistics['degree_histogram']) if count)))
+
+        fields = get_intersection_fields()
+        (sink, self.dest_id) = self.create_sink(parameters, context, fields, layers[0].crs())
+
+        feedback.pushInfo(tr('Creating a layer'))
+
+        layer_ids = [layer.id() for layer in layers]
+        points = nodes.points.tolist()
+        first = nodes.pairs[:, 0]
+        second = nodes.pairs[:, 1]
+        first_layers = segments.layers[first].tolist()
+        first_features = segments.features[first].tolist()
+        second_layers = segments.layers[second].tolist()
+        second_features = segments.features[second].tolist()
+        degrees = nodes.degrees.tolist()
+        ends = nodes.ends.tolist()
+        batch = []
+
+        for number, (x, y) in enumerate(points):
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feature.setAttributes([
+                layer_ids[first_layers[number]],
+                first_features[number],
+                layer_ids[second_layers[number]],
+                second_features[number],
+                degrees[number],
+                'junction' if ends[number] else 'crossing',
+            ])
+            batch.append(feature)
+
+            if len(batch) >= BATCH_SIZE:
+                if feedback.isCanceled():
+                    break
+
+                sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                batch = []
+                feedback.setProgress(70 + 30 * number / len(points))
+
+        if batch and not feedback.isCanceled():
+            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+
+        # the features are flushed before the spatial index is built
+        del sink
+
+        result[self.OUTPUT] = self.dest_id
+        result[self.MATRIX_OUTPUT] = matrix_output
+        result['Layers'] = ' '.join([layer.name() for layer in layers])
+        result['The number of intersections'] = len(points)
+        result['Dangles'] = statistics['dangles']
+        result['Connected components'] = statistics['components']
+        result['Cyclomatic number'] = statistics['cyclomatic_number']
+        feedback.setProgress(100)
 
-        feedback.pushInfo('Creating a layer')
+        return result
 
-        for point in intersections:
-            if feedback.isCanceled():
-                break
 
-            feature = QgsFeature()
-            feature.setGeometry(QgsGeometry().fromPointXY(QgsPointXY(point[0], point[1])))
-            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+    def create_sink(self, parameters, context, fields, crs):
+        """
+        Creates the point sink, a GeoPackage sink is created without the spatial index
+        that would be updated by every insert, the index is built in postProcessAlgorithm
 
-        result['Layers'] = ' '.join([layer.name() for layer in layers])
-        result['The number of intersections'] = len(intersections)
-        feedback.setProgress(100)
+        :param parameters: parameters of the algorithm
+        :param context: processing context
+        :param fields: fields of the points
+        :param crs: coordinate reference system of the points
+        """
 
-        return result
+        destination = self.parameterAsOutputLayer(parameters, self.OUTPUT, context) or ''
+        self.spatial_index = os.path.splitext(destination.split('|')[0])[1].lower() == '.gpkg'
+
+        if self.spatial_index:
+            try:
+                return self.parameterAsSink(
+                    parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point, crs,
+                    layerOptions=['SPATIAL_INDEX=NO'])
+            except TypeError:
+                # the layer options of a sink appeared in QGIS 3.20, the index is updated by the inserts there
+                self.spatial_index = False
+
+        return self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point, crs)
+
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Builds the spatial index of a GeoPackage output once all points are written
+        """
+
+        if self.spatial_index and self.dest_id:
+            layer = QgsProcessingUtils.mapLayerFromString(self.dest_id, context)
+
+            if layer is not None:
+                feedback.pushInfo(tr('Building the spatial index'))
+                layer.dataProvider().createSpatialIndex()
+
+        return {}
 
 
     def name(self):
@@ -36,13 +36,14 @@ import processing
 from PyQt5.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing,
                        QgsFeatureSink,
-                       QgsVectorLayer,
                        QgsVectorDataProvider,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFile,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingUtils,
                        QgsProcessingParameterFileDestination,
                        QgsWkbTypes,
                        QgsProcessingException,
@@ -51,7 +52,12 @@ from qgis.core import (QgsProcessing,
                        QgsPointXY,
                        QgsFields)
 
-from ..utils import tr, raise_exception, write_to_file, define_help_info, filter_layers, get_total_intersection, merge_layers
+from .segment_intersection import get_intersection_layers
+from .planar_graph import GRAPH_HEADER, get_graph_statistics
+from ..utils import (tr, raise_exception, write_to_file, define_help_info, get_layers_intersection_count,
+                     get_layers_planar_graph, get_layers_cached_intersection_count,
+                     get_layers_out_of_core_intersection_count)
+from ..workspace import use_layers, has_lines
 
 
 class CommonIntersectionAlgorithmGpkg(QgsProcessingAlgorithm):
@@ -66,6 +72,12 @@ class CommonIntersectionAlgorithmGpkg(QgsProcessingAlgorithm):
 
     OUTPUT = 'OUTPUT'
     INPUT = 'INPUT'
+    THREADS = 'THREADS'
+    TOLERANCE = 'TOLERANCE'
+    GRAPH_DIRECTORY = 'GRAPH_DIRECTORY'
+    INTERSECTIONS_CACHE = 'INTERSECTIONS_CACHE'
+    MEMORY_BUDGET = 'MEMORY_BUDGET'
+    GEOMETRY_CACHE = 'GEOMETRY_CACHE'
     HELP_FILE = 'total_intersections_help.txt'
 
 
@@ -89,6 +101,49 @@ class CommonIntersectionAlgorithmGpkg(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                tr('Number of threads'),
+                minValue=1,
+                defaultValue=os.cpu_count() or 1))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TOLERANCE,
+                tr('Snapping tolerance of the line ends (0 - exact coordinates)'),
+                QgsProcessingParameterNumber.Double,
+                minValue=0.0,
+                defaultValue=0.0))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GRAPH_DIRECTORY,
+                tr('Directory of the saved planar graphs'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INTERSECTIONS_CACHE,
+                tr('Directory of the cached intersections of the layer pairs'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MEMORY_BUDGET,
+                tr('Memory budget of the intersection search, MB (0 - all segments in memory)'),
+                minValue=0,
+                defaultValue=0))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.GEOMETRY_CACHE,
+                tr('Geometry cache directory'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True))
+
         self.addParameter(
             QgsProcessingParameterFileDestination(
                 self.OUTPUT,
@@ -105,40 +160,61 @@ class CommonIntersectionAlgorithmGpkg(QgsProcessingAlgorithm):
 
         geopackage = self.parameterAsFile(parameters, self.INPUT, context)
         output = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        graph_root = self.parameterAsFile(parameters, self.GRAPH_DIRECTORY, context)
+        cache_root = self.parameterAsFile(parameters, self.INTERSECTIONS_CACHE, context)
+        memory_budget = self.parameterAsInt(parameters, self.MEMORY_BUDGET, context) * 1024 * 1024
+        geometry_cache = self.parameterAsFile(parameters, self.GEOMETRY_CACHE, context)
+        statistics = {}
 
-        dummy = QgsVectorLayer(geopackage, "dummy", "ogr")
-        sublyrs = dummy.dataProvider().subLayers()
-
-        all_layers = []
-        for sublyr in sublyrs:
-            name = sublyr.split('!!::!!')[1]
-            uri = "%s|layername=%s" % (geopackage, name)
-            layer = QgsVectorLayer(uri, name, "ogr")
-            all_layers.append(layer)
+        # the saved graph, the cache and the out of core search are different ways to count
+        if sum(bool(option) for option in (graph_root, cache_root, memory_budget)) > 1:
+            raise_exception('choose only one of the graph directory, the intersection cache '
+                            'and the memory budget')
 
+        if memory_budget and geometry_cache:
+            raise_exception('the out of core count reads the features, '
+                            'the geometry cache can\'t be used with the memory budget')
 
-        layers = filter_layers(all_layers)
         result = {
             'Layers': 'missing layers with the right geometry',
             'The number of intersections': 0
             }
 
-        if not layers:
-            return result
+        with use_layers(geopackage, has_lines) as all_layers:
+            layers = get_intersection_layers(all_layers)
+
+            if not layers:
+                return result
+
+            feedback.setProgress(10)
+            threads = self.parameterAsInt(parameters, self.THREADS, context)
+            tolerance = self.parameterAsDouble(parameters, self.TOLERANCE, context)
+
+            if graph_root:
+                # the saved graph of the same layers is reused without searching the intersections
+                statistics = get_graph_statistics(get_layers_planar_graph(
+                    layers, feedback, threads, context.transformContext(), tolerance, graph_root,
+                    geometry_cache))
+                intersections_count = statistics['intersections']
+            elif cache_root:
+                intersections_count = get_layers_cached_intersection_count(
+                    layers, feedback, cache_root, threads, context.transformContext(), tolerance,
+                    geometry_cache)
+            elif memory_budget:
+                intersections_count = get_layers_out_of_core_intersection_count(
+                    layers, feedback, memory_budget, threads, context.transformContext(), tolerance,
+                    QgsProcessingUtils.tempFolder())
+            else:
+                intersections_count = get_layers_intersection_count(
+                    layers, feedback, threads, context.transformContext(), tolerance, geometry_cache)
 
-        feedback.setProgress(10)
-        feedback.pushInfo(tr('Merging layers'))
-        merged_layer = merge_layers(layers)
-        feedback.setProgress(20)
-
-        intersections = get_total_intersection(merged_layer, feedback)
         feedback.setProgress(90)
 
         # (sink, dest_id) = self.parameterAsSink(
         #     parameters, self.OUTPUT,
         #     context, QgsFields(),
         #     QgsWkbTypes.Point,
-        #     merged_layer.sourceCrs()
+        #     layers[0].crs()
         # )
         #
         # feedback.pushInfo('Creating a layer')
@@ -157,15 +233,19 @@ class CommonIntersectionAlgorithmGpkg(QgsProcessingAlgorithm):
         ]
         row = [{
             header[0]: os.path.basename(os.path.normpath(geopackage)),
-            header[1]: len(intersections),
+            header[1]: intersections_count,
         }]
 
+        if statistics:
+            header += [name for name in GRAPH_HEADER if name != 'intersections']
+            row[0].update({name: statistics[name] for name in header[2:]})
+
         if output:
             feedback.pushInfo(tr('Writing to file'))
             write_to_file(output, header, row, ';')
 
         result['Layers'] = ' '.join([layer.name() for layer in layers])
-        result['The number of intersections'] = len(intersections)
+        result['The number of intersections'] = intersections_count
         feedback.setProgress(100)
 
         return result
@@ -0,0 +1,335 @@
+'''
+this module counts the intersections of the lines that don't fit in memory:
+the segments are spilled to disk and split into spatial partitions
+that are searched one by one within a memory budget
+'''
+
+import os
+import shutil
+import tempfile
+
+from collections import namedtuple
+
+import numpy
+
+from .segment_intersection import (Segments, iterate_layers_features, get_lines_segments, get_end_points,
+                                   find_intersections, get_true_intersections)
+from ..utils import tr, raise_exception
+
+SEGMENT_DTYPE = numpy.dtype([('x0', numpy.float64), ('y0', numpy.float64), ('x1', numpy.float64),
+                             ('y1', numpy.float64), ('group', numpy.int64)])
+
+POINT_DTYPE = numpy.dtype([('x', numpy.float64), ('y', numpy.float64)])
+
+# memory used to search the intersections of a segment: the segment, its cells in the grid index and the points
+BYTES_PER_SEGMENT = 256
+
+# the number of points or records kept in memory while the segments are spilled and split
+CHUNK_SIZE = 1000000
+
+# the partitions are not split deeper
+MAX_DEPTH = 12
+
+# a partition is split if its largest quarter gets at most this share of its segments,
+# the long segments crossing all quarters are not separated by splitting
+MAX_QUARTER_SHARE = 0.75
+
+# files of the segments and the line ends of a part of the plane:
+# box - (x min, y min, x max, y max) of the part that is halved by a split,
+# owner - the part owns the points with x min <= x < x max and y min <= y < y max (infinite on the edges)
+Partition = namedtuple('Partition', ['segments_path', 'ends_path', 'box', 'owner', 'depth'])
+
+
+def read_records(path, dtype):
+    '''
+    this function maps the records of the file in memory
+
+    :param path: path of the file
+    :param dtype: dtype of the records
+    '''
+
+    if not os.path.getsize(path):
+        return numpy.empty(0, dtype)
+
+    return numpy.memmap(path, dtype, 'r')
+
+
+def get_locations(points, tolerance=0.0):
+    '''
+    this function returns the points snapped to the grid of the tolerance,
+    the point belongs to the partition of its snapped location
+
+    :param points: (n, 2) array of points
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    if tolerance > 0:
+        return numpy.rint(points / tolerance) * tolerance
+
+    return points
+
+
+def get_owned(points, owner, tolerance=0.0):
+    '''
+    this function returns the mask of the points owned by the partition
+
+    :param points: (n, 2) array of points
+    :param owner: (x min, y min, x max, y max) of the owned points
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    locations = get_locations(points, tolerance)
+
+    return ((locations[:, 0] >= owner[0]) & (locations[:, 0] < owner[2]) &
+            (locations[:, 1] >= owner[1]) & (locations[:, 1] < owner[3]))
+
+
+def spill_lines(features_lines, directory):
+    '''
+    this function writes the segments and the line ends to the files of the first partition,
+    only CHUNK_SIZE points are kept in memory
+
+    :param features_lines: iterable of the lists of the lines of the features
+    :param directory: directory of the partition files
+    '''
+
+    segments_path = os.path.join(directory, 'segments.bin')
+    ends_path = os.path.join(directory, 'ends.bin')
+    box = [numpy.inf, numpy.inf, -numpy.inf, -numpy.inf]
+    lines = []
+    line_groups = []
+    points_number = 0
+
+    with open(segments_path, 'wb') as segments_file, open(ends_path, 'wb') as ends_file:
+        def flush():
+            coords = numpy.concatenate(lines)
+            line_offsets = numpy.concatenate([[0], numpy.cumsum([len(line) for line in lines])])
+            segments = get_lines_segments(coords, line_offsets, line_groups)
+            records = numpy.empty(len(segments.x0), SEGMENT_DTYPE)
+
+            for name, values in zip(SEGMENT_DTYPE.names, segments):
+                records[name] = values
+
+            records.tofile(segments_file)
+            get_end_points(coords, line_offsets).tofile(ends_file)
+            box[:2] = numpy.minimum(box[:2], coords.min(axis=0))
+            box[2:] = numpy.maximum(box[2:], coords.max(axis=0))
+
+        for group, feature_lines in enumerate(features_lines, 1):
+            for line in feature_lines:
+                lines.append(numpy.asarray(line, numpy.float64))
+                line_groups.append(group)
+                points_number += len(line)
+
+            if points_number >= CHUNK_SIZE:
+                flush()
+                lines = []
+                line_groups = []
+                points_number = 0
+
+        if lines:
+            flush()
+
+    return Partition(segments_path, ends_path, [float(value) for value in box],
+                     (-numpy.inf, -numpy.inf, numpy.inf, numpy.inf), 0)
+
+
+def split_partition(partition, tolerance=0.0):
+    '''
+    this function splits the partition into four quarters reading CHUNK_SIZE records at once,
+    a segment goes to every quarter its bounding box (widened by the tolerance) meets,
+    a line end goes to the quarter that owns it. Returns the quarters with segments
+    or None if the largest quarter gets more than MAX_QUARTER_SHARE of the segments
+
+    :param partition: Partition
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    x_min, y_min, x_max, y_max = partition.box
+    middle_x = (x_min + x_max) / 2
+    middle_y = (y_min + y_max) / 2
+    owner = partition.owner
+    quarters = []
+
+    for column, row in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        name = '{}_{}{}'.format(os.path.splitext(partition.segments_path)[0], column, row)
+        quarters.append(Partition(
+            name + '.bin', name + '_ends.bin',
+            (middle_x if column else x_min, middle_y if row else y_min,
+             x_max if column else middle_x, y_max if row else middle_y),
+            (middle_x if column else owner[0], middle_y if row else owner[1],
+             owner[2] if column else middle_x, owner[3] if row else middle_y),
+            partition.depth + 1))
+
+    segments = read_records(partition.segments_path, SEGMENT_DTYPE)
+    ends = read_records(partition.ends_path, POINT_DTYPE)
+    sizes = numpy.zeros(len(quarters), numpy.int64)
+
+    for start in range(0, len(segments), CHUNK_SIZE):
+        for number, mask in enumerate(get_quarters_masks(segments[start:start + CHUNK_SIZE], quarters, tolerance)):
+            sizes[number] += numpy.count_nonzero(mask)
+
+    if sizes.max() > MAX_QUARTER_SHARE * len(segments):
+        return None
+
+    files = [(open(quarter.segments_path, 'wb'), open(quarter.ends_path, 'wb')) for quarter in quarters]
+
+    try:
+        for start in range(0, len(segments), CHUNK_SIZE):
+            chunk = numpy.array(segments[start:start + CHUNK_SIZE])
+
+            for (segments_file, _), mask in zip(files, get_quarters_masks(chunk, quarters, tolerance)):
+                chunk[mask].tofile(segments_file)
+
+        for start in range(0, len(ends), CHUNK_SIZE):
+            chunk = numpy.array(ends[start:start + CHUNK_SIZE])
+            points = chunk.view(numpy.float64).reshape(-1, 2)
+
+            for quarter, (_, ends_file) in zip(quarters, files):
+                chunk[get_owned(points, quarter.owner, tolerance)].tofile(ends_file)
+    finally:
+        for segments_file, ends_file in files:
+            segments_file.close()
+            ends_file.close()
+
+    del segments, ends
+    result = []
+
+    for quarter, size in zip(quarters, sizes):
+        if size:
+            result.append(quarter)
+        else:
+            remove_partition(quarter)
+
+    return result
+
+
+def get_quarters_masks(segments, quarters, tolerance=0.0):
+    '''
+    this function returns the masks of the segments whose bounding boxes (widened by the tolerance)
+    meet the owned parts of the quarters
+
+    :param segments: records of the segments
+    :param quarters: list of Partition
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    left = numpy.minimum(segments['x0'], segments['x1']) - tolerance
+    right = numpy.maximum(segments['x0'], segments['x1']) + tolerance
+    bottom = numpy.minimum(segments['y0'], segments['y1']) - tolerance
+    top = numpy.maximum(segments['y0'], segments['y1']) + tolerance
+
+    return [
+        (left <= quarter.owner[2]) & (right >= quarter.owner[0]) &
+        (bottom <= quarter.owner[3]) & (top >= quarter.owner[1])
+        for quarter in quarters
+    ]
+
+
+def remove_partition(partition):
+    '''
+    this function removes the files of the partition
+
+    :param partition: Partition
+    '''
+
+    for path in (partition.segments_path, partition.ends_path):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def search_partition(partition, threads=1, tolerance=0.0):
+    '''
+    this function returns the true intersections (see get_true_intersections) owned by the partition,
+    the duplicates of a point and the line ends with its key are in the partition of its snapped location
+
+    :param partition: Partition
+    :param threads: the number of threads searching for the intersections
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    records = numpy.array(read_records(partition.segments_path, SEGMENT_DTYPE))
+    ends = numpy.array(read_records(partition.ends_path, POINT_DTYPE)).view(numpy.float64).reshape(-1, 2)
+    segments = Segments(*(numpy.ascontiguousarray(records[name]) for name in SEGMENT_DTYPE.names))
+    points, _ = find_intersections(segments, threads=threads)
+
+    return get_true_intersections(points[get_owned(points, partition.owner, tolerance)], ends, tolerance)
+
+
+def count_partitioned_intersections(partition, memory_budget, feedback=None, threads=1, tolerance=0.0):
+    '''
+    this function counts the true intersections of the segments of the partition:
+    the partitions larger than the memory budget are split into quarters on disk,
+    the others are searched one by one and removed, their counts are summed
+
+    :param partition: Partition with all segments
+    :param memory_budget: bytes of memory to search the intersections of a partition
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    partitions = [partition]
+    count = 0
+    searched = 0
+
+    while partitions:
+        if feedback and feedback.isCanceled():
+            raise_exception('the intersections are not counted, the algorithm was canceled')
+
+        partition = partitions.pop()
+        segments_number = os.path.getsize(partition.segments_path) // SEGMENT_DTYPE.itemsize
+
+        quarters = None
+
+        if segments_number * BYTES_PER_SEGMENT > memory_budget and partition.depth < MAX_DEPTH:
+            quarters = split_partition(partition, tolerance)
+
+            if quarters is None and feedback:
+                feedback.pushInfo(tr('The segments of a partition cross all its quarters, '
+                                     'it is searched over the memory budget'))
+
+        if quarters is not None:
+            partitions.extend(quarters)
+        elif segments_number:
+            points = search_partition(partition, threads, tolerance)
+            count += len(points)
+            searched += 1
+
+            if feedback:
+                feedback.pushInfo(tr('Partition {}: {} segments, {} intersections').format(
+                    searched, segments_number, len(points)))
+
+        remove_partition(partition)
+
+    return count
+
+
+def count_out_of_core_intersections(layers, memory_budget, feedback=None, threads=1, transform_context=None,
+                                    tolerance=0.0, directory=None):
+    '''
+    this function counts the true intersections of the layers (see get_true_intersections)
+    with the segments spilled to disk, the memory depends on the budget and not on the layers
+
+    :param layers: line and polygon layers
+    :param memory_budget: bytes of memory to search the intersections of a partition
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: cell size of the snapping grid
+    :param directory: directory of the temporary partition files or None for the system one
+    '''
+
+    directory = tempfile.mkdtemp(prefix='intersections_', dir=directory)
+
+    try:
+        features_lines = (lines for _, _, lines in iterate_layers_features(layers, feedback, transform_context))
+        partition = spill_lines(features_lines, directory)
+
+        # the reading of the features stops on cancel, the partition has a part of the segments
+        if feedback and feedback.isCanceled():
+            raise_exception('the intersections are not counted, the algorithm was canceled')
+
+        return count_partitioned_intersections(partition, memory_budget, feedback, threads, tolerance)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
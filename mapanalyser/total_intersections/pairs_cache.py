@@ -0,0 +1,336 @@
+'''
+this module keeps the intersection points of every pair of layers on disk,
+keyed by the fingerprints of the layer contents, so a re-run searches
+only the pairs with a new or changed layer
+'''
+
+import json
+import os
+
+from collections import namedtuple
+from hashlib import blake2b
+
+import numpy
+
+from .segment_intersection import (Segments, read_layers_lines, get_lines_segments, get_end_points, find_intersections,
+                                   get_true_intersections)
+from ..utils import raise_exception
+
+# version of the cached points, points of other versions are searched again
+VERSION = 2
+
+# the lines of a layer and the fingerprint of its geometries
+LayerLines = namedtuple('LayerLines', ['coords', 'line_offsets', 'line_groups', 'fingerprint'])
+
+
+def read_layer_lines(layer, crs, feedback=None, transform_context=None, geometry_cache=None):
+    '''
+    this function reads the lines of the layer (see read_layers_lines)
+    and hashes their geometries in the same pass
+
+    :param layer: line or polygon layer
+    :param crs: coordinate system of the lines
+    :param feedback: Feedback from a processing algorithm
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    '''
+
+    digest = blake2b(str(VERSION).encode('utf-8'), digest_size=16)
+    coords, line_offsets, line_groups, _, _ = read_layers_lines(
+        [layer], feedback, transform_context, crs, digest, geometry_cache)
+
+    return LayerLines(coords, line_offsets, line_groups, digest.hexdigest())
+
+
+def get_numbered_segments(lines, numbers, changed):
+    '''
+    this function returns the segments of the layers with the number of the layer of every segment.
+    The groups (features) of the changed layers differ, so their lines are intersected with the lines
+    of the other features of the layer and with the lines of the other layers. All lines of the other
+    layers are in the group 0, the pairs of their segments are not tested
+
+    :param lines: list of LayerLines
+    :param numbers: the numbers of the layers in the list
+    :param changed: the numbers of the changed layers
+    '''
+
+    coords = numpy.concatenate([lines[number].coords for number in numbers] + [numpy.empty((0, 2))])
+    line_offsets = [numpy.zeros(1, numpy.int64)]
+    line_groups = []
+    line_layers = []
+    points_number = 0
+    groups_number = 1
+
+    for number in numbers:
+        layer_lines = lines[number]
+        groups = numpy.asarray(layer_lines.line_groups, numpy.int64)
+        line_offsets.append(numpy.asarray(layer_lines.line_offsets[1:], numpy.int64) + points_number)
+        line_layers.append(numpy.full(len(groups), number, numpy.int32))
+        points_number += len(layer_lines.coords)
+
+        if number not in changed or not len(groups):
+            line_groups.append(numpy.zeros(len(groups), numpy.int64))
+            continue
+
+        line_groups.append(groups - groups.min() + groups_number)
+        groups_number += int(groups.max() - groups.min()) + 1
+
+    return get_lines_segments(coords, numpy.concatenate(line_offsets), numpy.concatenate(line_groups + [[]]),
+                              numpy.concatenate(line_layers + [numpy.empty(0, numpy.int32)]))
+
+
+def get_near_segments(segments, mask, cells=1024):
+    '''
+    this function returns the mask of the segments of the mask and of the other segments whose
+    bounding boxes meet a cell of a coarse grid that a bounding box of a segment of the mask meets,
+    the other segments can't intersect the segments of the mask
+
+    :param segments: Segments
+    :param mask: the mask of the searched segments
+    :param cells: the largest number of the columns and the rows of the grid
+    '''
+
+    x_min = numpy.minimum(segments.x0, segments.x1)
+    x_max = numpy.maximum(segments.x0, segments.x1)
+    y_min = numpy.minimum(segments.y0, segments.y1)
+    y_max = numpy.maximum(segments.y0, segments.y1)
+
+    if mask.all() or not mask.any():
+        return mask.copy()
+
+    size = max(x_max.max() - x_min.min(), y_max.max() - y_min.min()) / min(
+        cells, max(1, int(numpy.sqrt(numpy.count_nonzero(mask)))))
+
+    if size <= 0:
+        return numpy.ones(len(mask), numpy.bool_)
+
+    columns = int((x_max.max() - x_min.min()) // size) + 1
+    rows = int((y_max.max() - y_min.min()) // size) + 1
+    first_columns = ((x_min - x_min.min()) // size).astype(numpy.int64).clip(0, columns - 1)
+    last_columns = ((x_max - x_min.min()) // size).astype(numpy.int64).clip(0, columns - 1)
+    first_rows = ((y_min - y_min.min()) // size).astype(numpy.int64).clip(0, rows - 1)
+    last_rows = ((y_max - y_min.min()) // size).astype(numpy.int64).clip(0, rows - 1)
+
+    # the cells met by the boxes of the mask: the corners of every box are added to a difference grid
+    marks = numpy.zeros((rows + 1, columns + 1), numpy.int64)
+    numpy.add.at(marks, (first_rows[mask], first_columns[mask]), 1)
+    numpy.add.at(marks, (first_rows[mask], last_columns[mask] + 1), -1)
+    numpy.add.at(marks, (last_rows[mask] + 1, first_columns[mask]), -1)
+    numpy.add.at(marks, (last_rows[mask] + 1, last_columns[mask] + 1), 1)
+    occupied = (marks.cumsum(axis=0).cumsum(axis=1)[:rows, :columns] > 0).astype(numpy.int64)
+
+    # the number of the occupied cells in the box of every segment by the summed-area table
+    table = numpy.zeros((rows + 1, columns + 1), numpy.int64)
+    table[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+    counts = (table[last_rows + 1, last_columns + 1] - table[first_rows, last_columns + 1] -
+              table[last_rows + 1, first_columns] + table[first_rows, first_columns])
+
+    return mask | (counts > 0)
+
+
+class PairsCache:
+    '''
+    Directory of the intersection points of the layer pairs:
+        the points of the lines of one layer are keyed by its fingerprint,
+        the points of the lines of two layers by both fingerprints.
+        The index file keeps the last fingerprint of every layer source,
+        the points of the replaced fingerprints are removed
+    '''
+
+    INDEX_NAME = 'sources.json'
+
+    def __init__(self, root):
+        if not root:
+            raise_exception('intersection cache directory is empty')
+
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        # the number of the segments passed to the searches of the missing pairs
+        self.searched = 0
+
+    def get_path(self, first, second=None):
+        '''
+        returns the path of the points of a layer or a pair of layers
+
+        :param first: fingerprint of the first layer
+        :param second: fingerprint of the second layer or None for the layer itself
+        '''
+
+        if second is None:
+            name = 'layer_{}.npy'.format(first)
+        else:
+            name = 'pair_{}_{}.npy'.format(*sorted([first, second]))
+
+        return os.path.join(self.root, name)
+
+    def get(self, first, second=None):
+        '''
+        returns the cached points or None
+
+        :param first: fingerprint of the first layer
+        :param second: fingerprint of the second layer or None for the layer itself
+        '''
+
+        path = self.get_path(first, second)
+
+        if not os.path.isfile(path):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return numpy.load(path)
+
+    def set(self, points, first, second=None):
+        '''
+        stores the points
+
+        :param points: (n, 2) array of the intersection points
+        :param first: fingerprint of the first layer
+        :param second: fingerprint of the second layer or None for the layer itself
+        '''
+
+        path = self.get_path(first, second)
+        temporary = path + '.tmp'
+
+        with open(temporary, 'wb') as points_file:
+            numpy.save(points_file, points)
+
+        os.replace(temporary, path)
+
+    def evict(self, sources):
+        '''
+        removes the points of the fingerprints that the sources had before and no current layer has
+        (and the points of older cache versions), records the current fingerprints of the sources
+
+        :param sources: dict of the current fingerprint of every layer source
+        '''
+
+        index_path = os.path.join(self.root, self.INDEX_NAME)
+        index = {}
+
+        if os.path.isfile(index_path):
+            with open(index_path, encoding='utf-8') as index_file:
+                index = json.load(index_file)
+
+        current = set(sources.values())
+        stale = {fingerprint for source, fingerprint in index.items()
+                 if source in sources and fingerprint not in current}
+
+        for name in os.listdir(self.root):
+            if not name.endswith('.npy'):
+                continue
+
+            kind, _, fingerprints = name[:-len('.npy')].partition('_')
+
+            if kind not in ('layer', 'pair') or stale.intersection(fingerprints.split('_')):
+                os.remove(os.path.join(self.root, name))
+
+        index.update(sources)
+        temporary = index_path + '.tmp'
+
+        with open(temporary, 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file)
+
+        os.replace(temporary, index_path)
+
+
+def get_cached_intersections(layers, cache, feedback, threads=1, transform_context=None, tolerance=0.0,
+                             geometry_cache=None):
+    '''
+    this function returns the true intersections of the layers (see get_true_intersections)
+    searching only the pairs of layers missing in the cache (see get_lines_intersections),
+    the points of the previous contents of the layers are removed from the cache
+
+    :param layers: line and polygon layers
+    :param cache: PairsCache
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    '''
+
+    crs = layers[0].crs()
+    lines = [read_layer_lines(layer, crs, feedback, transform_context, geometry_cache) for layer in layers]
+
+    # the fingerprints of partly read layers are not cached
+    if feedback and feedback.isCanceled():
+        raise_exception('the intersections are not counted, the algorithm was canceled')
+
+    points = get_lines_intersections(lines, cache, feedback, threads, tolerance)
+    cache.evict({layer.source(): layer_lines.fingerprint for layer, layer_lines in zip(layers, lines)})
+
+    return points
+
+
+def get_lines_intersections(lines, cache, feedback=None, threads=1, tolerance=0.0):
+    '''
+    this function returns the true intersections of the lines of the layers.
+    The layers of the pairs missing in the cache are searched at once and the points
+    are split into the pairs by the layers of their segments. Every missing pair has a changed layer
+    (see get_numbered_segments), the segments of the other layers are searched only near the segments
+    of the changed layers and not with each other. The points are cached
+    before the snapping, so the points of all pairs are joined with the ends of all lines
+    as in one search over all layers
+
+    :param lines: list of LayerLines
+    :param cache: PairsCache
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    '''
+
+    # the points of every path, the layers with the same fingerprint share the paths
+    entries = {}
+    missing = []
+
+    for i, first in enumerate(lines):
+        for j in range(i, len(lines)):
+            pair = (first.fingerprint,) if i == j else (first.fingerprint, lines[j].fingerprint)
+            path = cache.get_path(*pair)
+
+            if path in entries:
+                cache.hits += 1
+                continue
+
+            entries[path] = cache.get(*pair)
+
+            if entries[path] is None:
+                missing.append((i, j, pair, path))
+
+    if missing:
+        numbers = sorted({i for i, _, _, _ in missing} | {j for _, j, _, _ in missing})
+        changed = {i for i, j, _, _ in missing if i == j}
+
+        for i, j, _, _ in missing:
+            if i not in changed and j not in changed:
+                changed.add(i)
+
+        segments = get_numbered_segments(lines, numbers, changed)
+        near = get_near_segments(segments, numpy.isin(segments.layers, sorted(changed)))
+        segments = Segments(*(None if values is None else values[near] for values in segments))
+        cache.searched += len(segments.x0)
+        found, segment_pairs = find_intersections(segments, threads=threads)
+
+        if feedback and feedback.isCanceled():
+            raise_exception('the intersections are not counted, the algorithm was canceled')
+
+        first_layers = segments.layers[segment_pairs[:, 0]]
+        second_layers = segments.layers[segment_pairs[:, 1]]
+        low = numpy.minimum(first_layers, second_layers)
+        high = numpy.maximum(first_layers, second_layers)
+
+        for i, j, pair, path in missing:
+            pair_points = found[(low == i) & (high == j)]
+            pair_points = numpy.unique(pair_points, axis=0) if len(pair_points) else pair_points
+            cache.set(pair_points, *pair)
+            entries[path] = pair_points
+
+    end_points = numpy.concatenate([get_end_points(layer_lines.coords, layer_lines.line_offsets)
+                                    for layer_lines in lines] + [numpy.empty((0, 2))])
+    points = [numpy.asarray(points, numpy.float64).reshape(-1, 2) for points in entries.values()]
+
+    return get_true_intersections(numpy.concatenate(points + [numpy.empty((0, 2))]), end_points, tolerance)
@@ -0,0 +1,251 @@
+'''
+this module builds the planar graph of the lines split at their intersections
+and keeps it in compressed sparse row arrays for the other algorithms
+'''
+
+import json
+import os
+
+from collections import namedtuple
+from hashlib import blake2b
+
+import numpy
+from numba import njit
+
+from .segment_intersection import get_point_keys
+from ..layer_chars.geometry_cache import get_layer_fingerprint
+from ..utils import get_safe_name
+
+# version of the saved graphs, graphs of other versions are rebuilt
+VERSION = 1
+
+GRAPH_HEADER = [
+    'nodes',
+    'edges',
+    'dangles',
+    'components',
+    'cyclomatic_number',
+    'intersections',
+]
+
+# the nodes (line ends and intersection points) with the number of line ends at every node
+# and the intersection flag, the edges (pieces of lines between the nodes) and
+# the neighbours of the node i in indices[indptr[i]:indptr[i + 1]]
+PlanarGraph = namedtuple('PlanarGraph', ['node_x', 'node_y', 'ends', 'crossings', 'edges', 'indptr', 'indices'])
+
+
+def get_empty_graph():
+    '''
+    this function returns the graph without nodes
+    '''
+
+    return PlanarGraph(numpy.empty(0), numpy.empty(0), numpy.empty(0, numpy.int64), numpy.empty(0, numpy.bool_),
+                       numpy.empty((0, 2), numpy.int64), numpy.zeros(1, numpy.int64), numpy.empty(0, numpy.int64))
+
+
+def build_planar_graph(segments, points, pairs, tolerance=0.0):
+    '''
+    this function splits the lines at their ends and at the intersection points into edges.
+    The events (line ends and the points on both segments of a pair) are ordered along
+    every line by the segment and the position on it, the next events of a line with
+    different nodes are joined by an edge. A line coming back to the same node makes a loop.
+    The intersections of the lines of one feature are not searched, so they are not nodes
+
+    :param segments: Segments with the lines
+    :param points: (n, 2) array of the intersection points
+    :param pairs: (n, 2) array of the segments of every point
+    :param tolerance: cell size of the snapping grid of the nodes
+    '''
+
+    if not len(segments.x0):
+        return get_empty_graph()
+
+    x0, y0, x1, y1, lines = segments.x0, segments.y0, segments.x1, segments.y1, segments.lines
+    points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+    pairs = numpy.asarray(pairs, numpy.int64).reshape(-1, 2)
+    line_starts = numpy.flatnonzero(numpy.diff(lines)) + 1
+    first_segments = numpy.concatenate([[0], line_starts])
+    last_segments = numpy.concatenate([line_starts - 1, [len(lines) - 1]])
+    event_segments = numpy.concatenate([first_segments, pairs[:, 0], pairs[:, 1], last_segments])
+    event_x = numpy.concatenate([x0[first_segments], points[:, 0], points[:, 0], x1[last_segments]])
+    event_y = numpy.concatenate([y0[first_segments], points[:, 1], points[:, 1], y1[last_segments]])
+    line_ends = numpy.concatenate([
+        numpy.ones(len(first_segments), numpy.bool_),
+        numpy.zeros(2 * len(points), numpy.bool_),
+        numpy.ones(len(last_segments), numpy.bool_)])
+
+    # the position of an event on the line is the segment plus the share of the segment before the event
+    dx = x1[event_segments] - x0[event_segments]
+    dy = y1[event_segments] - y0[event_segments]
+    squares = dx * dx + dy * dy
+    shares = ((event_x - x0[event_segments]) * dx + (event_y - y0[event_segments]) * dy) / numpy.where(
+        squares > 0, squares, 1.0)
+    shares = numpy.clip(shares, 0.0, 1.0)
+    shares[:len(first_segments)] = 0.0
+    shares[len(shares) - len(last_segments):] = 1.0
+    positions = event_segments + shares
+    event_lines = lines[event_segments]
+    order = numpy.lexsort((positions, event_lines))
+    positions = positions[order]
+    event_lines = event_lines[order]
+
+    _, first_events, nodes = numpy.unique(
+        get_point_keys(numpy.column_stack([event_x[order], event_y[order]]), tolerance),
+        return_index=True, return_inverse=True)
+    nodes = nodes.ravel()
+    nodes_number = len(first_events)
+    line_ends = line_ends[order]
+    crossings = numpy.zeros(nodes_number, numpy.bool_)
+    crossings[nodes[~line_ends]] = True
+
+    # a loop goes through more than one segment: the positions of its ends differ by more than 1
+    joined = (event_lines[1:] == event_lines[:-1]) & (
+        (nodes[1:] != nodes[:-1]) | (positions[1:] - positions[:-1] > 1.0))
+    edges = numpy.column_stack([nodes[:-1][joined], nodes[1:][joined]])
+    heads = numpy.concatenate([edges[:, 0], edges[:, 1]])
+    tails = numpy.concatenate([edges[:, 1], edges[:, 0]])
+
+    return PlanarGraph(
+        event_x[order][first_events],
+        event_y[order][first_events],
+        numpy.bincount(nodes[line_ends], minlength=nodes_number),
+        crossings,
+        edges,
+        numpy.concatenate([[0], numpy.cumsum(numpy.bincount(heads, minlength=nodes_number))]),
+        tails[numpy.argsort(heads, kind='stable')])
+
+
+@njit(cache=True)
+def label_components(indptr, indices):
+    '''
+    this function returns the connected component of every node and the number of the components
+
+    :param indptr: the first neighbour of every node in indices (and the end)
+    :param indices: the neighbours of the nodes
+    '''
+
+    nodes_number = len(indptr) - 1
+    labels = numpy.full(nodes_number, -1, numpy.int64)
+    stack = numpy.empty(nodes_number, numpy.int64)
+    count = 0
+
+    for start in range(nodes_number):
+        if labels[start] >= 0:
+            continue
+
+        labels[start] = count
+        stack[0] = start
+        top = 1
+
+        while top > 0:
+            top -= 1
+            node = stack[top]
+
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[k]
+
+                if labels[neighbour] < 0:
+                    labels[neighbour] = count
+                    stack[top] = neighbour
+                    top += 1
+
+        count += 1
+
+    return labels, count
+
+
+def get_graph_statistics(graph):
+    '''
+    this function returns the statistics of the graph: the numbers of nodes, edges,
+    dangles (nodes of degree 1), connected components, the cyclomatic number
+    (the number of independent cycles: edges - nodes + components), the number of
+    true intersections (see get_true_intersections) and the number of nodes of every degree
+
+    :param graph: PlanarGraph
+    '''
+
+    degrees = numpy.diff(graph.indptr)
+    _, components = label_components(graph.indptr, graph.indices)
+    nodes = len(degrees)
+    edges = len(graph.edges)
+
+    return {
+        'nodes': nodes,
+        'edges': edges,
+        'dangles': int((degrees == 1).sum()),
+        'components': int(components),
+        'cyclomatic_number': edges - nodes + int(components),
+        'intersections': int((graph.crossings & (graph.ends != 2)).sum()),
+        'degree_histogram': numpy.bincount(degrees).tolist(),
+    }
+
+
+def get_graph_fingerprint(layers, tolerance=0.0):
+    '''
+    this function returns the fingerprint of the graph of the layers:
+    the fingerprints of the layer data, their coordinate systems and the tolerance.
+    The graph of a layer without a file is not saved, None is returned for it
+
+    :param layers: line and polygon layers
+    :param tolerance: cell size of the snapping grid of the nodes
+    '''
+
+    fingerprints = [get_layer_fingerprint(layer) for layer in layers]
+
+    if None in fingerprints:
+        return None
+
+    return blake2b(json.dumps([
+        [[fingerprint, layer.crs().authid()] for fingerprint, layer in zip(fingerprints, layers)],
+        tolerance,
+        VERSION,
+    ]).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def get_graph_path(root, layers):
+    '''
+    this function returns the path of the saved graph of the layers
+
+    :param root: directory of the saved graphs
+    :param layers: line and polygon layers
+    '''
+
+    name = blake2b('\n'.join(layer.source() for layer in layers).encode('utf-8'), digest_size=8).hexdigest()
+
+    return os.path.join(root, '{}_{}_graph.npz'.format(get_safe_name(layers[0].name()), name))
+
+
+def save_planar_graph(path, graph, fingerprint):
+    '''
+    this function saves the graph with the fingerprint of its layers
+
+    :param path: path of the .npz file
+    :param graph: PlanarGraph
+    :param fingerprint: fingerprint of the layers (see get_graph_fingerprint)
+    '''
+
+    temporary = path + '.tmp'
+
+    with open(temporary, 'wb') as graph_file:
+        numpy.savez(graph_file, fingerprint=numpy.array(fingerprint), **graph._asdict())
+
+    os.replace(temporary, path)
+
+
+def load_planar_graph(path, fingerprint=None):
+    '''
+    this function loads the saved graph, returns None if there is no graph
+    or it was built for other data
+
+    :param path: path of the .npz file
+    :param fingerprint: fingerprint of the layers or None to load any graph
+    '''
+
+    if not os.path.isfile(path):
+        return None
+
+    with numpy.load(path) as data:
+        if fingerprint is not None and str(data['fingerprint']) != fingerprint:
+            return None
+
+        return PlanarGraph(*(data[name] for name in PlanarGraph._fields))
@@ -0,0 +1,483 @@
+'''
+this module finds the intersection points of the lines of a layer
+on numpy arrays of segments
+'''
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+
+import numpy
+
+from qgis.core import QgsFeatureRequest, QgsProject, QgsWkbTypes
+from .segment_intersection_core import find_grid_intersections, count_grid_intersections
+from ..layer_chars.geometry_cache import GeometryCache, get_geometry_parts, get_layer_file
+
+# the grid has at most this number of cells per segment
+MAX_CELLS_PER_SEGMENT = 4
+
+# tiles per thread, smaller tiles balance the load of the threads
+TILES_PER_THREAD = 4
+
+Segments = namedtuple('Segments', ['x0', 'y0', 'x1', 'y1', 'groups', 'layers', 'features', 'lines'],
+                      defaults=[None, None, None])
+
+Grid = namedtuple('Grid', ['origin_x', 'origin_y', 'size', 'columns', 'rows'])
+
+# the intersection points with the pair of segments that found a point first,
+# the number of edges at the point and the number of line ends at the point
+IntersectionNodes = namedtuple('IntersectionNodes', ['points', 'pairs', 'degrees', 'ends'])
+
+
+def get_lines_segments(coords, line_offsets, line_groups, line_layers=None, line_features=None):
+    '''
+    this function splits lines into segments, the segments of a line follow each other
+    and keep the number of the line
+
+    :param coords: (n, 2) coordinates of the lines one after another
+    :param line_offsets: the first point of every line and the end
+    :param line_groups: the group (feature) of every line
+    :param line_layers: optional layer of every line
+    :param line_features: optional feature id of every line
+    '''
+
+    coords = numpy.asarray(coords, numpy.float64)
+    line_offsets = numpy.asarray(line_offsets, numpy.int64)
+    lengths = numpy.diff(line_offsets)
+    # a segment starts at every point but the last point of a line
+    starts = numpy.ones(len(coords), numpy.bool_)
+    starts[line_offsets[1:] - 1] = False
+    starts = numpy.flatnonzero(starts)
+    groups = numpy.repeat(numpy.asarray(line_groups, numpy.int64), lengths)[starts]
+    layers = None
+    features = None
+
+    if line_layers is not None:
+        layers = numpy.repeat(numpy.asarray(line_layers, numpy.int32), lengths)[starts]
+
+    if line_features is not None:
+        features = numpy.repeat(numpy.asarray(line_features, numpy.int64), lengths)[starts]
+
+    lines = numpy.repeat(numpy.arange(len(lengths)), lengths)[starts]
+
+    return Segments(coords[starts, 0], coords[starts, 1], coords[starts + 1, 0], coords[starts + 1, 1],
+                    groups, layers, features, lines)
+
+
+def get_intersection_layers(layers):
+    '''
+    this function returns the line and polygon layers
+
+    :param layers: Vector layers
+    '''
+
+    return [
+        layer for layer in layers
+        if layer.geometryType() in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry)
+    ]
+
+
+def iterate_layers_features(layers, feedback=None, transform_context=None, crs=None):
+    '''
+    this function yields (layer number, feature, lines of the feature) for all features
+    of the layers, the lines and the polygon rings are in the coordinate system
+    of the first layer (or the given one)
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param crs: coordinate system of the lines or None
+    '''
+
+    if crs is None and layers:
+        crs = layers[0].crs()
+
+    for layer_number, layer in enumerate(layers):
+        request = QgsFeatureRequest().setNoAttributes()
+
+        if layer.crs() != crs:
+            request.setDestinationCrs(crs, transform_context or QgsProject.instance().transformContext())
+
+        for feature in layer.getFeatures(request):
+            if feedback and feedback.isCanceled():
+                return
+
+            lines = []
+
+            if feature.hasGeometry():
+                for _, rings in get_geometry_parts(feature.geometry()):
+                    lines.extend(ring for ring in rings if len(ring) > 1)
+
+            yield layer_number, feature, lines
+
+
+def read_layers_lines(layers, feedback=None, transform_context=None, crs=None, digest=None, geometry_cache=None):
+    '''
+    this function reads the lines and the polygon rings of the layers
+    in the coordinate system of the first layer (or the given one),
+    returns (coords, line offsets, line groups, line layers, line feature ids),
+    the lines of a feature have the same group. With the geometry cache the lines
+    of the layers in the coordinate system of the lines are read from the cache
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param crs: coordinate system of the lines or None
+    :param digest: hash object to update with the geometries of the features or None
+    :param geometry_cache: directory of the geometry caches (see GeometryCache) or None
+    '''
+
+    if crs is None and layers:
+        crs = layers[0].crs()
+
+    coords = []
+    line_lengths = []
+    line_groups = []
+    line_layers = []
+    line_features = []
+    groups_number = 0
+
+    for layer_number, layer in enumerate(layers):
+        # the layers without a file are not cached (see get_layer_fingerprint)
+        if geometry_cache and layer.crs() == crs and get_layer_file(layer):
+            cache = GeometryCache.open(geometry_cache, layer, False, feedback)
+            cached_coords, lengths, features = cache.get_lines()
+
+            if digest is not None:
+                for array in (cached_coords, lengths, features):
+                    digest.update(numpy.ascontiguousarray(array).tobytes())
+
+            coords.append(cached_coords)
+            line_lengths.append(lengths)
+            line_groups.append(features + groups_number + 1)
+            line_layers.append(numpy.full(len(lengths), layer_number, numpy.int64))
+            line_features.append(numpy.asarray(cache.fids)[features])
+            groups_number += len(cache)
+            continue
+
+        lines = []
+        groups = []
+        features = []
+
+        for _, feature, feature_lines in iterate_layers_features([layer], feedback, transform_context, crs):
+            groups_number += 1
+
+            if digest is not None:
+                digest.update(bytes(feature.geometry().asWkb()))
+
+            for line in feature_lines:
+                lines.append(line)
+                groups.append(groups_number)
+                features.append(feature.id())
+
+        coords.extend(lines)
+        line_lengths.append([len(line) for line in lines])
+        line_groups.append(groups)
+        line_layers.append([layer_number] * len(lines))
+        line_features.append(features)
+
+    line_lengths = numpy.concatenate(line_lengths + [[]]).astype(numpy.int64)
+
+    return (numpy.concatenate(coords + [numpy.empty((0, 2))]),
+            numpy.concatenate([[0], numpy.cumsum(line_lengths)]).astype(numpy.int64),
+            numpy.concatenate(line_groups + [[]]).astype(numpy.int64),
+            numpy.concatenate(line_layers + [[]]).astype(numpy.int64),
+            numpy.concatenate(line_features + [[]]).astype(numpy.int64))
+
+
+def get_end_points(coords, line_offsets):
+    '''
+    this function returns the first and the last points of all lines
+
+    :param coords: (n, 2) coordinates of the lines one after another
+    :param line_offsets: the first point of every line and the end
+    '''
+
+    if len(line_offsets) < 2:
+        return numpy.empty((0, 2))
+
+    return numpy.concatenate([coords[line_offsets[:-1]], coords[line_offsets[1:] - 1]])
+
+
+def get_point_keys(points, tolerance=0.0):
+    '''
+    this function returns the sortable keys of the points snapped to the grid
+    of the tolerance (the exact coordinates if the tolerance is 0)
+
+    :param points: (n, 2) array of points
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+
+    if tolerance > 0:
+        keys = numpy.rint(points / tolerance).astype(numpy.int64)
+        dtype = [('x', numpy.int64), ('y', numpy.int64)]
+    else:
+        keys = points.copy()
+        dtype = [('x', numpy.float64), ('y', numpy.float64)]
+
+    return numpy.ascontiguousarray(keys).view(dtype).ravel()
+
+
+def get_node_degrees(points, end_points, tolerance=0.0):
+    '''
+    this function returns the number of line ends at every point,
+    the ends are counted with a vectorized unique and matched with a sorted join
+
+    :param points: (n, 2) array of points
+    :param end_points: (m, 2) array of the line ends
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    end_keys, degrees = numpy.unique(get_point_keys(end_points, tolerance), return_counts=True)
+    keys = get_point_keys(points, tolerance)
+
+    if not len(end_keys):
+        return numpy.zeros(len(keys), numpy.int64)
+
+    positions = numpy.minimum(numpy.searchsorted(end_keys, keys), len(end_keys) - 1)
+
+    return numpy.where(end_keys[positions] == keys, degrees[positions], 0)
+
+
+def get_true_intersections(points, end_points, tolerance=0.0):
+    '''
+    this function returns the distinct intersection points without the points
+    where exactly two lines meet end to end (one line continued by another)
+
+    :param points: (n, 2) array of the intersection points
+    :param end_points: (m, 2) array of the line ends
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    _, first = numpy.unique(get_point_keys(points, tolerance), return_index=True)
+    points = numpy.asarray(points, numpy.float64).reshape(-1, 2)[first]
+
+    return points[get_node_degrees(points, end_points, tolerance) != 2]
+
+
+def get_intersection_nodes(points, pairs, segments, end_points, tolerance=0.0):
+    '''
+    this function returns the true intersections (see get_true_intersections) as IntersectionNodes:
+    every point keeps the first pair of segments it was found by, the node degree is the number
+    of edges at the point (a segment passing through the point gives two edges,
+    a segment ending at it gives one) and ends is the number of line ends at the point
+
+    :param points: (n, 2) array of the intersection points ordered by the pairs
+    :param pairs: (n, 2) array of the segments of every point
+    :param segments: Segments
+    :param end_points: (m, 2) array of the line ends
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+    pairs = numpy.asarray(pairs, numpy.int64).reshape(-1, 2)
+    node_keys, first, nodes = numpy.unique(get_point_keys(points, tolerance), return_index=True, return_inverse=True)
+    nodes = nodes.ravel()
+    # every segment is counted once at a node
+    incidences = numpy.unique(numpy.concatenate([nodes, nodes]) * len(segments.x0) + pairs.T.ravel())
+    incidence_nodes = incidences // len(segments.x0)
+    incidence_segments = incidences % len(segments.x0)
+    keys = node_keys[incidence_nodes]
+    start_keys = get_point_keys(
+        numpy.column_stack([segments.x0[incidence_segments], segments.y0[incidence_segments]]), tolerance)
+    end_keys = get_point_keys(
+        numpy.column_stack([segments.x1[incidence_segments], segments.y1[incidence_segments]]), tolerance)
+    edges = numpy.where((start_keys == keys) | (end_keys == keys), 1, 2)
+    degrees = numpy.bincount(incidence_nodes, edges, len(node_keys)).astype(numpy.int64)
+    points = points[first]
+    ends = get_node_degrees(points, end_points, tolerance)
+    true = ends != 2
+
+    return IntersectionNodes(points[true], pairs[first][true], degrees[true], ends[true])
+
+
+def get_layer_pairs_matrix(points, pairs, segments, end_points, layers_number, tolerance=0.0):
+    '''
+    this function counts the true intersections of every pair of layers: the cell (i, j)
+    of the matrix is the number of points where a line of the layer i intersects
+    a line of the layer j (the diagonal - the lines of one layer),
+    a point of the lines of several layers is counted for every pair of them
+
+    :param points: (n, 2) array of the intersection points
+    :param pairs: (n, 2) array of the segments of every point
+    :param segments: Segments with the layers
+    :param end_points: (m, 2) array of the line ends
+    :param layers_number: the number of layers
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+    pairs = numpy.asarray(pairs, numpy.int64).reshape(-1, 2)
+
+    if not len(points):
+        return numpy.zeros((layers_number, layers_number), numpy.int64)
+
+    _, first, nodes = numpy.unique(get_point_keys(points, tolerance), return_index=True, return_inverse=True)
+    nodes = nodes.ravel()
+    true = (get_node_degrees(points[first], end_points, tolerance) != 2)[nodes]
+    first_layers = segments.layers[pairs[:, 0]].astype(numpy.int64)
+    second_layers = segments.layers[pairs[:, 1]].astype(numpy.int64)
+    layer_pairs = (numpy.minimum(first_layers, second_layers) * layers_number +
+                   numpy.maximum(first_layers, second_layers))
+    # every pair of layers is counted once at a point
+    node_pairs = numpy.unique(nodes[true] * layers_number * layers_number + layer_pairs[true])
+    counts = numpy.bincount(node_pairs % (layers_number * layers_number),
+                            minlength=layers_number * layers_number).reshape(layers_number, layers_number)
+
+    return counts + counts.T - numpy.diag(numpy.diag(counts))
+
+
+def get_layers_segments(layers, feedback=None, transform_context=None, geometry_cache=None):
+    '''
+    this function streams the lines and the polygon rings of the layers into segments
+    without intermediate layers, returns (Segments with the layer and the feature id
+    of every segment, end points)
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param geometry_cache: directory of the geometry caches or None
+    '''
+
+    coords, line_offsets, line_groups, line_layers, line_features = read_layers_lines(
+        layers, feedback, transform_context, geometry_cache=geometry_cache)
+
+    return (get_lines_segments(coords, line_offsets, line_groups, line_layers, line_features),
+            get_end_points(coords, line_offsets))
+
+
+def get_grid(segments, cell_size=None):
+    '''
+    this function chooses the grid of the segment index: a cell is
+    about the size of a segment and there are a few segments per cell
+
+    :param segments: Segments
+    :param cell_size: cell size or None to choose it
+    '''
+
+    x_min = min(segments.x0.min(), segments.x1.min())
+    y_min = min(segments.y0.min(), segments.y1.min())
+    width = max(segments.x0.max(), segments.x1.max()) - x_min
+    height = max(segments.y0.max(), segments.y1.max()) - y_min
+    segments_number = len(segments.x0)
+
+    if not cell_size:
+        extents = numpy.maximum(numpy.abs(segments.x1 - segments.x0), numpy.abs(segments.y1 - segments.y0))
+        cell_size = max(float(extents.mean()), (width * height / segments_number) ** 0.5)
+
+    if not cell_size:
+        cell_size = 1.0
+
+    columns = int(width / cell_size) + 1
+    rows = int(height / cell_size) + 1
+    max_cells = MAX_CELLS_PER_SEGMENT * segments_number
+
+    if columns * rows > max_cells:
+        cell_size *= (columns * rows / max_cells) ** 0.5
+        columns = int(width / cell_size) + 1
+        rows = int(height / cell_size) + 1
+
+    return Grid(float(x_min), float(y_min), float(cell_size), columns, rows)
+
+
+def get_tiles(grid, tiles_number):
+    '''
+    this function splits the grid into about tiles_number tiles,
+    returns the windows (first column, end column, first row, end row) of the tiles
+
+    :param grid: Grid
+    :param tiles_number: the number of tiles
+    '''
+
+    tile_columns = max(1, min(grid.columns, round((tiles_number * grid.columns / grid.rows) ** 0.5)))
+    tile_rows = max(1, min(grid.rows, ceil(tiles_number / tile_columns)))
+    column_bounds = numpy.linspace(0, grid.columns, tile_columns + 1).astype(int)
+    row_bounds = numpy.linspace(0, grid.rows, tile_rows + 1).astype(int)
+
+    return [
+        (int(column_bounds[i]), int(column_bounds[i + 1]), int(row_bounds[j]), int(row_bounds[j + 1]))
+        for j in range(tile_rows) for i in range(tile_columns)
+        if column_bounds[i] < column_bounds[i + 1] and row_bounds[j] < row_bounds[j + 1]
+    ]
+
+
+def run_tiles(function, grid, threads):
+    '''
+    this function calls the function for the whole grid or,
+    with several threads, for every tile of the grid in parallel,
+    returns the list of the results
+
+    :param function: function(window)
+    :param grid: Grid
+    :param threads: the number of threads
+    '''
+
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            return list(executor.map(function, get_tiles(grid, threads * TILES_PER_THREAD)))
+
+    return [function((0, grid.columns, 0, grid.rows))]
+
+
+def find_intersections(segments, cell_size=None, threads=1):
+    '''
+    this function finds the intersections of the segments of different groups,
+    returns the points and the pairs of segments of every point ordered by the pairs.
+    Collinear overlaps are lines, they have no points.
+    With several threads the grid is split into tiles processed in parallel,
+    every intersection belongs to the cell (and the tile) that contains it,
+    so the result is the same as in one thread
+
+    :param segments: Segments
+    :param cell_size: cell size of the index or None to choose it
+    :param threads: the number of threads
+    '''
+
+    if not len(segments.x0):
+        return numpy.empty((0, 2)), numpy.empty((0, 2), numpy.int64)
+
+    grid = get_grid(segments, cell_size)
+
+    def find(window):
+        return find_grid_intersections(
+            segments.x0, segments.y0, segments.x1, segments.y1, segments.groups,
+            grid.origin_x, grid.origin_y, grid.size, grid.columns, grid.rows, window)
+
+    results = run_tiles(find, grid, threads)
+    points = numpy.concatenate([result[0] for result in results])
+    pairs = numpy.concatenate([result[1] for result in results])
+    order = numpy.lexsort((pairs[:, 1], pairs[:, 0]))
+
+    return points[order], pairs[order]
+
+
+def count_true_intersections(segments, end_points, tolerance=0.0, cell_size=None, threads=1):
+    '''
+    this function counts the distinct true intersections (see get_true_intersections)
+    without keeping the points: the points are deduplicated by their keys
+    in the cells they belong to, the memory depends on the number of segments only
+
+    :param segments: Segments
+    :param end_points: (m, 2) array of the line ends
+    :param tolerance: cell size of the snapping grid
+    :param cell_size: cell size of the index or None to choose it
+    :param threads: the number of threads
+    '''
+
+    if not len(segments.x0):
+        return 0
+
+    grid = get_grid(segments, cell_size)
+    end_keys, end_degrees = numpy.unique(get_point_keys(end_points, tolerance), return_counts=True)
+    end_x = end_keys['x'].astype(numpy.float64)
+    end_y = end_keys['y'].astype(numpy.float64)
+
+    def count(window):
+        return count_grid_intersections(
+            segments.x0, segments.y0, segments.x1, segments.y1, segments.groups,
+            grid.origin_x, grid.origin_y, grid.size, grid.columns, grid.rows, window,
+            float(tolerance), end_x, end_y, end_degrees)
+
+    return int(sum(run_tiles(count, grid, threads)))
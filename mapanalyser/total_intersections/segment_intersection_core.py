@@ -0,0 +1,406 @@
+'''
+this module finds the intersections of line segments
+with a uniform grid index
+'''
+
+import numpy
+from numba import njit
+
+
+@njit(cache=True)
+def orientation(ax, ay, bx, by, cx, cy):
+    '''
+    this function returns the side of the point c relative to the line ab:
+    1 - left, -1 - right, 0 - on the line
+
+    :param ax, ay: the first point of the line
+    :param bx, by: the second point of the line
+    :param cx, cy: the point
+    '''
+
+    value = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+    if value > 0:
+        return 1
+
+    if value < 0:
+        return -1
+
+    return 0
+
+
+@njit(cache=True)
+def intersect_collinear(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    '''
+    this function returns the common point of collinear segments that touch at the ends,
+    overlapping segments have a common line and no point
+
+    :param ax0, ay0, ax1, ay1: the first segment
+    :param bx0, by0, bx1, by1: the second segment
+    '''
+
+    # the segments are compared along the axis they are longer on
+    if abs(ax1 - ax0) >= abs(ay1 - ay0):
+        a_min, a_max, b_min, b_max = min(ax0, ax1), max(ax0, ax1), min(bx0, bx1), max(bx0, bx1)
+        a_first = ax0
+    else:
+        a_min, a_max, b_min, b_max = min(ay0, ay1), max(ay0, ay1), min(by0, by1), max(by0, by1)
+        a_first = ay0
+
+    low = max(a_min, b_min)
+    high = min(a_max, b_max)
+
+    if low != high:
+        return False, 0.0, 0.0
+
+    if a_first == low:
+        return True, ax0, ay0
+
+    return True, ax1, ay1
+
+
+@njit(cache=True)
+def intersect_segments(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    '''
+    this function returns (found, x, y) of the intersection of two segments,
+    the touching ends are returned exactly
+
+    :param ax0, ay0, ax1, ay1: the first segment
+    :param bx0, by0, bx1, by1: the second segment
+    '''
+
+    o1 = orientation(ax0, ay0, ax1, ay1, bx0, by0)
+    o2 = orientation(ax0, ay0, ax1, ay1, bx1, by1)
+
+    if o1 == 0 and o2 == 0:
+        return intersect_collinear(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1)
+
+    o3 = orientation(bx0, by0, bx1, by1, ax0, ay0)
+    o4 = orientation(bx0, by0, bx1, by1, ax1, ay1)
+
+    if o1 * o2 > 0 or o3 * o4 > 0:
+        return False, 0.0, 0.0
+
+    if o1 == 0:
+        return True, bx0, by0
+
+    if o2 == 0:
+        return True, bx1, by1
+
+    if o3 == 0:
+        return True, ax0, ay0
+
+    if o4 == 0:
+        return True, ax1, ay1
+
+    denominator = (ax1 - ax0) * (by1 - by0) - (ay1 - ay0) * (bx1 - bx0)
+    t = ((bx0 - ax0) * (by1 - by0) - (by0 - ay0) * (bx1 - bx0)) / denominator
+    x = ax0 + t * (ax1 - ax0)
+    y = ay0 + t * (ay1 - ay0)
+    # the rounded point is kept inside both segments
+    x = min(max(x, max(min(ax0, ax1), min(bx0, bx1))), min(max(ax0, ax1), max(bx0, bx1)))
+    y = min(max(y, max(min(ay0, ay1), min(by0, by1))), min(max(ay0, ay1), max(by0, by1)))
+
+    return True, x, y
+
+
+@njit(cache=True)
+def get_cell(value, origin, size, cells_number):
+    '''
+    this function returns the grid cell of a coordinate
+
+    :param value: coordinate
+    :param origin: the first coordinate of the grid
+    :param size: cell size
+    :param cells_number: the number of cells along the axis
+    '''
+
+    return min(max(int((value - origin) / size), 0), cells_number - 1)
+
+
+@njit(cache=True)
+def get_window_cells(i, x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window, margin):
+    '''
+    this function returns the cells of the window overlapped by the bounding box of a segment:
+    first column, last column, first row, last row
+
+    :param i: segment
+    :param x0, y0, x1, y1: arrays of the segment ends
+    :param origin_x, origin_y: the lower left corner of the grid
+    :param size: cell size
+    :param columns: the number of columns
+    :param rows: the number of rows
+    :param window: (first column, end column, first row, end row) of the cells
+    :param margin: the bounding box is expanded by the margin
+    '''
+
+    return (max(get_cell(min(x0[i], x1[i]) - margin, origin_x, size, columns), window[0]),
+            min(get_cell(max(x0[i], x1[i]) + margin, origin_x, size, columns), window[1] - 1),
+            max(get_cell(min(y0[i], y1[i]) - margin, origin_y, size, rows), window[2]),
+            min(get_cell(max(y0[i], y1[i]) + margin, origin_y, size, rows), window[3] - 1))
+
+
+@njit(cache=True, nogil=True)
+def build_grid(x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window, margin=0.0):
+    '''
+    this function registers every segment in all cells of the window its bounding box overlaps,
+    returns the offsets of the window cells and the segments of the cells
+
+    :param x0, y0, x1, y1: arrays of the segment ends
+    :param origin_x, origin_y: the lower left corner of the grid
+    :param size: cell size
+    :param columns: the number of columns
+    :param rows: the number of rows
+    :param window: (first column, end column, first row, end row) of the cells to build
+    :param margin: the bounding boxes of the segments are expanded by the margin
+    '''
+
+    window_columns = window[1] - window[0]
+    counts = numpy.zeros(window_columns * (window[3] - window[2]) + 1, numpy.int64)
+
+    for i in range(len(x0)):
+        c0, c1, r0, r1 = get_window_cells(i, x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window, margin)
+
+        for row in range(r0, r1 + 1):
+            for column in range(c0, c1 + 1):
+                counts[(row - window[2]) * window_columns + column - window[0] + 1] += 1
+
+    offsets = numpy.cumsum(counts)
+    positions = offsets[:-1].copy()
+    cells = numpy.empty(offsets[-1], numpy.int32)
+
+    for i in range(len(x0)):
+        c0, c1, r0, r1 = get_window_cells(i, x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window, margin)
+
+        for row in range(r0, r1 + 1):
+            for column in range(c0, c1 + 1):
+                cell = (row - window[2]) * window_columns + column - window[0]
+                cells[positions[cell]] = i
+                positions[cell] += 1
+
+    return offsets, cells
+
+
+@njit(cache=True, nogil=True)
+def find_grid_intersections(x0, y0, x1, y1, groups, origin_x, origin_y, size, columns, rows, window):
+    '''
+    this function tests the pairs of segments of different groups in every cell of the window,
+    an intersection is reported only by the cell that contains it, so the windows
+    of one grid can be processed independently,
+    returns the intersection points and the segments of every point
+
+    :param x0, y0, x1, y1: arrays of the segment ends
+    :param groups: the group (feature) of every segment, segments of a group don't intersect
+    :param origin_x, origin_y: the lower left corner of the grid
+    :param size: cell size
+    :param columns: the number of columns
+    :param rows: the number of rows
+    :param window: (first column, end column, first row, end row) of the cells to process
+    '''
+
+    offsets, cells = build_grid(x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window)
+    first_column, end_column, first_row, end_row = window
+    window_columns = end_column - first_column
+    capacity = 1024
+    points = numpy.empty((capacity, 2), numpy.float64)
+    pairs = numpy.empty((capacity, 2), numpy.int64)
+    found = 0
+
+    for window_cell in range(len(offsets) - 1):
+        start = offsets[window_cell]
+        end = offsets[window_cell + 1]
+        cell = (first_row + window_cell // window_columns) * columns + first_column + window_cell % window_columns
+
+        for k in range(start, end):
+            i = cells[k]
+
+            if x0[i] == x1[i] and y0[i] == y1[i]:
+                continue
+
+            for m in range(k + 1, end):
+                j = cells[m]
+
+                if groups[i] == groups[j] or (x0[j] == x1[j] and y0[j] == y1[j]):
+                    continue
+
+                if (max(x0[i], x1[i]) < min(x0[j], x1[j]) or max(x0[j], x1[j]) < min(x0[i], x1[i]) or
+                        max(y0[i], y1[i]) < min(y0[j], y1[j]) or max(y0[j], y1[j]) < min(y0[i], y1[i])):
+                    continue
+
+                intersects, x, y = intersect_segments(x0[i], y0[i], x1[i], y1[i], x0[j], y0[j], x1[j], y1[j])
+
+                if not intersects:
+                    continue
+
+                if get_cell(y, origin_y, size, rows) * columns + get_cell(x, origin_x, size, columns) != cell:
+                    continue
+
+                if found == capacity:
+                    capacity *= 2
+                    new_points = numpy.empty((capacity, 2), numpy.float64)
+                    new_points[:found] = points[:found]
+                    points = new_points
+                    new_pairs = numpy.empty((capacity, 2), numpy.int64)
+                    new_pairs[:found] = pairs[:found]
+                    pairs = new_pairs
+
+                points[found, 0] = x
+                points[found, 1] = y
+                pairs[found, 0] = min(i, j)
+                pairs[found, 1] = max(i, j)
+                found += 1
+
+    return points[:found], pairs[:found]
+
+
+@njit(cache=True)
+def get_key(x, y, tolerance):
+    '''
+    this function returns the key of a point: the cell of the snapping grid
+    of the tolerance or the exact coordinates if the tolerance is 0
+
+    :param x, y: the point
+    :param tolerance: cell size of the snapping grid
+    '''
+
+    if tolerance > 0:
+        return numpy.rint(x / tolerance), numpy.rint(y / tolerance)
+
+    return x + 0.0, y + 0.0
+
+
+@njit(cache=True)
+def get_degree(key_x, key_y, end_x, end_y, end_degrees):
+    '''
+    this function returns the number of line ends with the key by a binary search
+
+    :param key_x, key_y: the key of the point
+    :param end_x, end_y: the keys of the line ends ordered by x and y
+    :param end_degrees: the number of line ends with every key
+    '''
+
+    low = 0
+    high = len(end_x)
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if end_x[middle] < key_x or (end_x[middle] == key_x and end_y[middle] < key_y):
+            low = middle + 1
+        else:
+            high = middle
+
+    if low < len(end_x) and end_x[low] == key_x and end_y[low] == key_y:
+        return end_degrees[low]
+
+    return 0
+
+
+@njit(cache=True)
+def count_true_keys(keys, end_x, end_y, end_degrees):
+    '''
+    this function counts the distinct keys that are not the ends of exactly two lines
+
+    :param keys: (n, 2) keys of the points
+    :param end_x, end_y: the keys of the line ends ordered by x and y
+    :param end_degrees: the number of line ends with every key
+    '''
+
+    if not len(keys):
+        return 0
+
+    # stable sorts by y and then by x order the keys by x and y
+    order = numpy.argsort(keys[:, 1], kind='mergesort')
+    order = order[numpy.argsort(keys[order, 0], kind='mergesort')]
+    count = 0
+
+    for n in range(len(order)):
+        key_x = keys[order[n], 0]
+        key_y = keys[order[n], 1]
+
+        if n > 0 and keys[order[n - 1], 0] == key_x and keys[order[n - 1], 1] == key_y:
+            continue
+
+        if get_degree(key_x, key_y, end_x, end_y, end_degrees) != 2:
+            count += 1
+
+    return count
+
+
+@njit(cache=True, nogil=True)
+def count_grid_intersections(x0, y0, x1, y1, groups, origin_x, origin_y, size, columns, rows, window,
+                             tolerance, end_x, end_y, end_degrees):
+    '''
+    this function counts the distinct true intersections of the segments of different groups
+    in the cells of the window keeping only the keys of one cell: every point belongs to the cell
+    of its key, so the duplicates of a point are found in one cell and removed there
+
+    :param x0, y0, x1, y1: arrays of the segment ends
+    :param groups: the group (feature) of every segment, segments of a group don't intersect
+    :param origin_x, origin_y: the lower left corner of the grid
+    :param size: cell size
+    :param columns: the number of columns
+    :param rows: the number of rows
+    :param window: (first column, end column, first row, end row) of the cells to process
+    :param tolerance: cell size of the snapping grid of the keys
+    :param end_x, end_y: the keys of the line ends ordered by x and y
+    :param end_degrees: the number of line ends with every key
+    '''
+
+    # the snapped point of a key is within the tolerance of the intersection
+    offsets, cells = build_grid(x0, y0, x1, y1, origin_x, origin_y, size, columns, rows, window, tolerance)
+    first_column, end_column, first_row, end_row = window
+    window_columns = end_column - first_column
+    capacity = 64
+    keys = numpy.empty((capacity, 2), numpy.float64)
+    count = 0
+
+    for window_cell in range(len(offsets) - 1):
+        start = offsets[window_cell]
+        end = offsets[window_cell + 1]
+        cell = (first_row + window_cell // window_columns) * columns + first_column + window_cell % window_columns
+        found = 0
+
+        for k in range(start, end):
+            i = cells[k]
+
+            if x0[i] == x1[i] and y0[i] == y1[i]:
+                continue
+
+            for m in range(k + 1, end):
+                j = cells[m]
+
+                if groups[i] == groups[j] or (x0[j] == x1[j] and y0[j] == y1[j]):
+                    continue
+
+                if (max(x0[i], x1[i]) < min(x0[j], x1[j]) or max(x0[j], x1[j]) < min(x0[i], x1[i]) or
+                        max(y0[i], y1[i]) < min(y0[j], y1[j]) or max(y0[j], y1[j]) < min(y0[i], y1[i])):
+                    continue
+
+                intersects, x, y = intersect_segments(x0[i], y0[i], x1[i], y1[i], x0[j], y0[j], x1[j], y1[j])
+
+                if not intersects:
+                    continue
+
+                key_x, key_y = get_key(x, y, tolerance)
+
+                if tolerance > 0:
+                    x = key_x * tolerance
+                    y = key_y * tolerance
+
+                if get_cell(y, origin_y, size, rows) * columns + get_cell(x, origin_x, size, columns) != cell:
+                    continue
+
+                if found == capacity:
+                    capacity *= 2
+                    new_keys = numpy.empty((capacity, 2), numpy.float64)
+                    new_keys[:found] = keys[:found]
+                    keys = new_keys
+
+                keys[found, 0] = key_x
+                keys[found, 1] = key_y
+                found += 1
+
+        count += count_true_keys(keys[:found], end_x, end_y, end_degrees)
+
+    return count
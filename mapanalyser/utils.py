@@ -5,7 +5,7 @@ import os
 import csv
 import importlib.util
 import json
-import processing
+import re
 
 from PyQt5.QtCore import QCoreApplication
 from qgis.core import QgsMessageLog, Qgis, QgsProcessingException, QgsWkbTypes
@@ -19,6 +19,17 @@ def raise_exception(message):
     raise QgsProcessingException(tr(message))
 
 
+def get_safe_name(name):
+    """
+    This method replaces the characters of the name that can't be in a file name
+    (separators, reserved characters) with underscores
+
+    :param name: name of a layer
+    """
+
+    return re.sub(r'[^\w.-]', '_', name)[:64].lstrip('.') or 'layer'
+
+
 def write_to_file(path, header, rows, delimiter):
     """
     This method writes the result to a file
@@ -53,6 +64,33 @@ def write_to_file(path, header, rows, delimiter):
         raise_exception('error while writing to file')
 
 
+def write_matrix_to_file(path, names, matrix, delimiter):
+    """
+    This method writes a square matrix with the names of its rows and columns
+    to a file, the file is overwritten
+
+    :param path: Path to file
+    :param names: names of the rows and the columns
+    :param matrix: rows of the matrix
+    :param delimiter: Csv delimiter
+    """
+
+    if not path:
+        raise_exception('output path is empty')
+    if not delimiter:
+        raise_exception('delimiter is empty')
+
+    try:
+        with open(path, 'w', newline='') as output_file:
+            cout = csv.writer(output_file, delimiter=delimiter)
+            cout.writerow(['layer'] + list(names))
+
+            for name, row in zip(names, matrix):
+                cout.writerow([name] + [int(value) for value in row])
+    except Exception:
+        raise_exception('error while writing to file')
+
+
 def define_help_info(file_name):
     """
     Sets the help text.
@@ -95,128 +133,279 @@ def check(req_path, readme_path):
         raise ImportError(message)
 
 
-def get_total_intersection(layer, feedback):
+def get_total_intersection(layer, feedback, threads=1, tolerance=0.0):
     """
     This method calculates the number of line intersections
 
     :param layer: Vector layer
     :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    """
+
+    if not layer:
+        raise_exception('layer is empty')
+    if layer.geometryType() not in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry):
+        raise_exception('layer geometry is not line or polygon geometry')
+
+    return get_layers_intersection([layer], feedback, threads, tolerance=tolerance)
+
+
+def get_total_intersection_count(layer, feedback, threads=1, tolerance=0.0):
+    """
+    This method counts the line intersections without building the points
+
+    :param layer: Vector layer
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
     """
 
     if not layer:
         raise_exception('layer is empty')
+    if layer.geometryType() not in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry):
+        raise_exception('layer geometry is not line or polygon geometry')
+
+    return get_layers_intersection_count([layer], feedback, threads, tolerance=tolerance)
+
+
+def read_layers_intersections(layers, feedback, threads=1, transform_context=None, geometry_cache=None):
+    """
+    This method reads the segments of the lines and the polygon boundaries of the layers
+    straight from the features without intermediate layers and finds their intersections.
+    Returns (Segments, end points, intersection points, pairs of segments of the points)
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    """
+
+    # the engine reads the layers with the readers of layer_chars that import this module
+    from .total_intersections.segment_intersection import get_layers_segments, find_intersections
+
+    if not layers:
+        raise_exception('layers is empty')
     if not feedback:
         raise_exception('feedback is empty')
-    if layer.geometryType() != QgsWkbTypes.LineGeometry:
-        raise_exception('layer geometry is not line geometry')
 
-    feedback.pushInfo(tr('Receiving endpoints of the lines'))
+    feedback.pushInfo(tr('Receiving the segments and the endpoints of the lines'))
+
+    segments, end_points = get_layers_segments(layers, feedback, transform_context, geometry_cache)
+
+    feedback.pushInfo(tr('Getting intersection points'))
+
+    points, pairs = find_intersections(segments, threads=threads)
+
+    return segments, end_points, points, pairs
+
 
-    end_points = {}
+def get_layers_intersection(layers, feedback, threads=1, transform_context=None, tolerance=0.0,
+                            geometry_cache=None):
+    """
+    This method calculates the intersections of the lines and the polygon boundaries
+    of the layers (see read_layers_intersections). Returns (n, 2) array of the intersection points
 
-    for feature in layer.getFeatures():
-        geom = feature.geometry()
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    """
 
-        for part in geom.parts():
-            verts = list(part.vertices())
-            start_v = verts[0]
-            start_v_cortege = (start_v.x(), start_v.y())
+    from .total_intersections.segment_intersection import get_true_intersections
 
-            if start_v_cortege in end_points:
-                end_points[start_v_cortege] += 1
-            else:
-                end_points[start_v_cortege] = 1
+    _, end_points, points, _ = read_layers_intersections(layers, feedback, threads, transform_context, geometry_cache)
 
-            end_v = verts[-1]
-            end_v_cortege = (end_v.x(), end_v.y())
+    feedback.pushInfo(tr('Getting true intersection points'))
 
-            if end_v_cortege in end_points:
-                end_points[end_v_cortege] += 1
-            else:
-                end_points[end_v_cortege] = 1
+    return get_true_intersections(points, end_points, tolerance)
 
-    feedback.pushInfo(tr('Getting intersection points (this can take a long time (the more lines, the more time))'))
 
-    intersections_proc_params = {
-        'INPUT': layer,
-        'INTERSECT': layer,
-        'OUTPUT': 'memory:'
-        }
-    result = processing.run(
-        'qgis:lineintersections',
-        intersections_proc_params
-        )
-    intersections_layer = result['OUTPUT']
+def get_layers_intersection_nodes(layers, feedback, threads=1, transform_context=None, tolerance=0.0,
+                                  graph_root=None, geometry_cache=None, pairs_matrix=False):
+    """
+    This method calculates the intersections of the layers (see get_layers_intersection)
+    with their attributes, the planar graph of the lines and optionally the intersections
+    of every pair of layers in the same pass.
+    Returns (IntersectionNodes, Segments, PlanarGraph, layer pairs matrix or None): the pairs of the nodes
+    are the indexes of the segments with their layers and feature ids.
+    The graph sorts the line ends and both points of every intersection along the lines,
+    it takes about as long as getting the true intersections and keeps the nodes and the edges in memory
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param graph_root: directory to save the planar graph for the other algorithms or None
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    :param pairs_matrix: count the intersections of every pair of layers
+    """
 
-    set_of_intersections = set((f.geometry().asPoint().x(), f.geometry().asPoint().y()) for f in intersections_layer.getFeatures())
+    from .total_intersections.segment_intersection import get_intersection_nodes, get_layer_pairs_matrix
+    from .total_intersections.planar_graph import (build_planar_graph, save_planar_graph, get_graph_path,
+                                                   get_graph_fingerprint)
+
+    segments, end_points, points, pairs = read_layers_intersections(
+        layers, feedback, threads, transform_context, geometry_cache)
 
     feedback.pushInfo(tr('Getting true intersection points'))
 
-    intersections = get_true_intersections(set_of_intersections, end_points) if set_of_intersections else []
+    nodes = get_intersection_nodes(points, pairs, segments, end_points, tolerance)
+    matrix = None
+
+    if pairs_matrix:
+        matrix = get_layer_pairs_matrix(points, pairs, segments, end_points, len(layers), tolerance)
+
+    feedback.pushInfo(tr('Building the planar graph'))
+
+    graph = build_planar_graph(segments, points, pairs, tolerance)
+
+    fingerprint = get_graph_fingerprint(layers, tolerance) if graph_root else None
+
+    if fingerprint is not None:
+        os.makedirs(graph_root, exist_ok=True)
+        save_planar_graph(get_graph_path(graph_root, layers), graph, fingerprint)
+
+    return nodes, segments, graph, matrix
+
+
+def get_layers_planar_graph(layers, feedback, threads=1, transform_context=None, tolerance=0.0, graph_root=None,
+                            geometry_cache=None):
+    """
+    This method returns the planar graph of the lines of the layers split at their
+    intersections. The graph saved in the directory is reused while the layers are the same,
+    otherwise the intersections are found and the new graph is saved
+
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the nodes (0 - exact coordinates)
+    :param graph_root: directory of the saved graphs or None
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
+    """
+
+    from .total_intersections.planar_graph import (build_planar_graph, save_planar_graph, load_planar_graph,
+                                                   get_graph_path, get_graph_fingerprint)
+
+    if not layers:
+        raise_exception('layers is empty')
+
+    fingerprint = get_graph_fingerprint(layers, tolerance) if graph_root else None
+    path = get_graph_path(graph_root, layers) if fingerprint is not None else None
+    graph = load_planar_graph(path, fingerprint) if path else None
 
-    return intersections
+    if graph is not None:
+        feedback.pushInfo(tr('Reusing the saved planar graph'))
+        return graph
 
+    segments, _, points, pairs = read_layers_intersections(layers, feedback, threads, transform_context, geometry_cache)
 
-def get_true_intersections(intersections, end_points):
+    feedback.pushInfo(tr('Building the planar graph'))
+
+    graph = build_planar_graph(segments, points, pairs, tolerance)
+
+    if path:
+        os.makedirs(graph_root, exist_ok=True)
+        save_planar_graph(path, graph, fingerprint)
+
+    return graph
+
+
+def get_layers_intersection_count(layers, feedback, threads=1, transform_context=None, tolerance=0.0,
+                                  geometry_cache=None):
     """
-    This method calculates true line intersections
+    This method counts the intersections of the lines and the polygon boundaries
+    of the layers (see get_layers_intersection) without building the points
 
-    :param intersections: Total set of intersections
-    :param end_points: End points of lines
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
     """
 
-    if not intersections:
-        raise_exception('intersections is empty')
-    if not end_points:
-        raise_exception('end_points is empty')
+    # the engine reads the layers with the readers of layer_chars that import this module
+    from .total_intersections.segment_intersection import get_layers_segments, count_true_intersections
+
+    if not layers:
+        raise_exception('layers is empty')
+    if not feedback:
+        raise_exception('feedback is empty')
+
+    feedback.pushInfo(tr('Receiving the segments and the endpoints of the lines'))
+
+    segments, end_points = get_layers_segments(layers, feedback, transform_context, geometry_cache)
 
-    true_intersections = set()
+    feedback.pushInfo(tr('Counting true intersection points'))
 
-    for point_cortege in intersections:
-        if point_cortege in end_points:
-            if end_points[point_cortege] != 2:
-                true_intersections.add(point_cortege)
-        else:
-            true_intersections.add(point_cortege)
+    return count_true_intersections(segments, end_points, tolerance, threads=threads)
 
-    return true_intersections
 
-def merge_layers(layers):
+def get_layers_cached_intersection_count(layers, feedback, cache_root, threads=1, transform_context=None,
+                                         tolerance=0.0, geometry_cache=None):
     """
-    This method merges layers
+    This method counts the intersections of the layers (see get_layers_intersection)
+    with the intersection points of every pair of layers cached in the directory:
+    only the pairs with a new or changed layer are searched
 
-    :param layers: Vector layers
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param cache_root: directory of the cached intersection points
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param geometry_cache: directory of the geometry caches to read the lines from or None
     """
 
+    from .total_intersections.pairs_cache import PairsCache, get_cached_intersections
+
     if not layers:
         raise_exception('layers is empty')
+    if not feedback:
+        raise_exception('feedback is empty')
+
+    feedback.pushInfo(tr('Receiving the lines of the layers and the cached intersections of the layer pairs'))
 
-    merge_proc_params = {
-        'LAYERS': layers,
-        'OUTPUT': 'memory:'
-        }
+    cache = PairsCache(cache_root)
+    points = get_cached_intersections(layers, cache, feedback, threads, transform_context, tolerance, geometry_cache)
 
-    result = processing.run('qgis:mergevectorlayers', merge_proc_params, None)
-    merged_layers_map = result['OUTPUT']
+    feedback.pushInfo(tr('Layer pairs from the cache: {} of {}').format(cache.hits, cache.hits + cache.misses))
 
-    return merged_layers_map
+    return len(points)
 
 
-def filter_layers(layers):
+def get_layers_out_of_core_intersection_count(layers, feedback, memory_budget, threads=1, transform_context=None,
+                                              tolerance=0.0, directory=None):
     """
-    Converts a polygon geometry layers in the line geometry layers
+    This method counts the intersections of the layers (see get_layers_intersection)
+    with the segments spilled to disk in spatial partitions searched one by one,
+    so the layers don't have to fit in memory
 
-    :param layers: Vector layers
+    :param layers: line and polygon layers
+    :param feedback: Feedback from a processing algorithm
+    :param memory_budget: bytes of memory to search the intersections of a partition
+    :param threads: the number of threads searching for the intersections
+    :param transform_context: transform context for the layers in other coordinate systems
+    :param tolerance: snapping tolerance of the end points (0 - exact coordinates)
+    :param directory: directory of the temporary partition files or None for the system one
     """
-    filtered_layers = []
 
-    for layer in layers:
-        if layer.geometryType() == QgsWkbTypes.PolygonGeometry:
-            name = layer.name()
-            line_layer = processing.run("native:polygonstolines", {'INPUT': layer, 'OUTPUT':'TEMPORARY_OUTPUT'})["OUTPUT"]
-            line_layer.setName(name)
-            filtered_layers.append(line_layer)
-        elif layer.geometryType() == QgsWkbTypes.LineGeometry:
-            filtered_layers.append(layer)
+    from .total_intersections.out_of_core import count_out_of_core_intersections
+
+    if not layers:
+        raise_exception('layers is empty')
+    if not feedback:
+        raise_exception('feedback is empty')
+    if memory_budget <= 0:
+        raise_exception('memory budget is not positive')
+
+    feedback.pushInfo(tr('Spilling the segments of the lines to disk'))
 
-    return filtered_layers
+    return count_out_of_core_intersections(
+        layers, memory_budget, feedback, threads, transform_context, tolerance, directory)
@@ -0,0 +1,174 @@
+"""
+    Access to the layers of workspaces (GeoPackages) shared by the algorithms:
+    the sublayers are listed once per version of the file and the opened layers
+    are reused by the threads and the runs of the algorithms until the file changes.
+    The layers of the least recently used workspaces are closed, all layers
+    are closed when the provider is unloaded
+"""
+import os
+import threading
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager, ExitStack
+
+from qgis.core import QgsDataProvider, QgsVectorLayer, QgsWkbTypes
+from .utils import raise_exception
+
+SublayerInfo = namedtuple('SublayerInfo', ['name', 'feature_count', 'geometry_type'])
+
+_lock = threading.Lock()
+# {path: (signature, list of SublayerInfo)}
+_sublayers = {}
+# {(path, layer name): (signature, QgsVectorLayer, lock of the layer)}
+_layers = {}
+# the paths of the workspaces with open layers from the least recently used
+_recent = OrderedDict()
+
+# the number of workspaces whose layers are kept open
+MAX_WORKSPACES = 8
+
+
+def get_signature(path):
+    """
+    Returns the version of a workspace file: modification time and size
+    of the file and of its write-ahead log
+
+    :param path: path to the workspace
+    """
+
+    signature = ()
+
+    for file_path in (path, path + '-wal'):
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            signature += (stat.st_mtime_ns, stat.st_size)
+
+    return signature
+
+
+def get_sublayers(path):
+    """
+    Returns the list of SublayerInfo of a workspace
+
+    :param path: path to the workspace
+    """
+
+    if not path:
+        raise_exception('workspace path is empty')
+
+    path = os.path.normpath(path)
+    signature = get_signature(path)
+
+    with _lock:
+        cached = _sublayers.get(path)
+
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+    dummy = QgsVectorLayer(path, 'dummy', 'ogr')
+    sublayers = []
+
+    for sublayer in dummy.dataProvider().subLayers():
+        parts = sublayer.split(QgsDataProvider.SUBLAYER_SEPARATOR)
+        feature_count = int(parts[2]) if len(parts) > 2 and parts[2].lstrip('-').isdigit() else -1
+        geometry_type = parts[3] if len(parts) > 3 else ''
+        sublayers.append(SublayerInfo(parts[1], feature_count, geometry_type))
+
+    with _lock:
+        _sublayers[path] = (signature, sublayers)
+
+    return sublayers
+
+
+def has_lines(sublayer):
+    """
+    Returns True if the sublayer can have lines or polygons: it has features
+    and its geometry type is a line, a polygon or unknown
+
+    :param sublayer: SublayerInfo
+    """
+
+    if sublayer.feature_count == 0:
+        return False
+
+    geometry_type = QgsWkbTypes.geometryType(QgsWkbTypes.parseType(sublayer.geometry_type))
+
+    return geometry_type in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry, QgsWkbTypes.UnknownGeometry)
+
+
+@contextmanager
+def use_layer(path, name):
+    """
+    Opens a layer of a workspace or reuses the layer opened before,
+    a layer is used by one thread at a time
+
+    :param path: path to the workspace
+    :param name: layer name
+    """
+
+    path = os.path.normpath(path)
+    signature = get_signature(path)
+    key = (path, name)
+
+    with _lock:
+        cached = _layers.get(key)
+
+        if cached is None or cached[0] != signature or not cached[1].isValid():
+            # the layers of the previous version of the file are closed
+            close_layers(lambda other: other[0] == path and _layers[other][0] != signature)
+            cached = (signature, QgsVectorLayer('{}|layername={}'.format(path, name), name, 'ogr'), threading.RLock())
+            _layers[key] = cached
+
+        _recent[path] = None
+        _recent.move_to_end(path)
+
+        while len(_recent) > MAX_WORKSPACES:
+            oldest, _ = _recent.popitem(last=False)
+            close_layers(lambda other: other[0] == oldest)
+
+    signature, layer, layer_lock = cached
+
+    if not layer.isValid():
+        raise_exception('can\'t open the layer {} of {}'.format(name, path))
+
+    with layer_lock:
+        yield layer
+
+
+@contextmanager
+def use_layers(path, condition=None):
+    """
+    Opens the layers of a workspace (see use_layer)
+
+    :param path: path to the workspace
+    :param condition: function(SublayerInfo) choosing the layers to open or None for all layers
+    """
+
+    with ExitStack() as stack:
+        yield [
+            stack.enter_context(use_layer(path, sublayer.name)) for sublayer in get_sublayers(path)
+            if condition is None or condition(sublayer)
+        ]
+
+
+def close_layers(condition):
+    """
+    Closes the opened layers chosen by the condition, the layers in use
+    are closed when they are released. Must be called with the lock
+
+    :param condition: function((path, layer name)) choosing the layers
+    """
+
+    for key in [key for key in _layers if condition(key)]:
+        del _layers[key]
+
+
+def close_all():
+    """
+    Closes all layers and forgets the sublayers of all workspaces
+    """
+
+    with _lock:
+        _layers.clear()
+        _sublayers.clear()
+        _recent.clear()